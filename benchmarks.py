@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарки горячих путей OZER GARANT Bot
+Замер utils, captcha и keyboards, сохранение базовой линии и сравнение с ней
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+from aiogram.fsm.storage.base import StorageKey
+
+from utils import utils
+from captcha import captcha_system, render_text_captcha
+from captcha_bank import CaptchaBank
+from keyboards import keyboards
+from database import create_database
+from idempotency import MemoryIdempotencyStore
+from deal_cards import DealCards
+from throttling import Throttler
+from fsm_storage import DatabaseStorage
+from texts import texts
+
+# Настройки бенчмарков
+BENCHMARK_SEED = int(os.getenv('BENCHMARK_SEED', 20250101))
+BENCHMARK_BASELINE_FILE = os.getenv('BENCHMARK_BASELINE_FILE', 'benchmarks_baseline.json')
+BENCHMARK_THRESHOLD = float(os.getenv('BENCHMARK_THRESHOLD', 15))  # Допустимая деградация в %
+# MySQL из MYSQL_CONFIG замеряется только по явному согласию: бенчмарк пишет в базу
+BENCHMARK_MYSQL = os.getenv('BENCHMARK_MYSQL', '').lower() in ('1', 'true', 'yes')
+
+# Реестр бенчмарков: имя -> (функция, количество повторов за раунд)
+BENCHMARKS: Dict[str, tuple] = {}
+
+# Корутины, выполняемые после всех бенчмарков (закрытие соединений и т.п.)
+TEARDOWN_HOOKS: List[Callable] = []
+
+
+def benchmark(name: str, number: int = 1000):
+    """Регистрация функции как бенчмарка
+
+    Функция может быть синхронной или корутиной. Для корутин замеряется
+    выполнение внутри одного цикла событий.
+    """
+    def decorator(func: Callable) -> Callable:
+        BENCHMARKS[name] = (func, number)
+        return func
+    return decorator
+
+
+# === ТЕСТОВЫЕ ДАННЫЕ ===
+
+SAMPLE_USER = {
+    'user_id': 123456789,
+    'username': 'ozer_user',
+    'first_name': 'Иван',
+    'last_name': 'Петров',
+    'is_verified': True,
+    'created_at': datetime(2025, 1, 1, 12, 0),
+    'updated_at': datetime(2025, 1, 1, 12, 0),
+    'deals_count': 12,
+    'successful_deals': 10,
+    'rating': Decimal('4.50'),
+    'is_banned': False
+}
+
+SAMPLE_DEAL = {
+    'id': 42,
+    'deal_code': 'AB12CD34',
+    'creator_id': 123456789,
+    'participant_id': 987654321,
+    'creator_role': 'buyer',
+    'amount_usd': Decimal('150.00'),
+    'deal_conditions': 'Продажа аккаунта [premium] с гарантией *30 дней* - передача через @support.',
+    'deal_password': '',
+    'status': 'payment_pending',
+    'payment_method': 'TRC20',
+    'payment_proof': None,
+    'created_at': datetime(2025, 1, 1, 12, 0),
+    'updated_at': datetime(2025, 1, 1, 12, 5),
+    'completed_at': None,
+    'expires_at': datetime(2025, 1, 1, 12, 0) + timedelta(hours=24)
+}
+
+SAMPLE_DEALS_LIST = [
+    dict(SAMPLE_DEAL, id=i, deal_code=f"CODE{i:04d}", status=status)
+    for i, status in enumerate(
+        ['created', 'joined', 'payment_pending', 'completed', 'cancelled', 'disputed'] * 3
+    )
+]
+
+SAMPLE_PASSWORD = 'secret-pass'
+SAMPLE_PASSWORD_HASH = utils.hash_password(SAMPLE_PASSWORD)
+SAMPLE_ADDRESS = 'TXYZabcdefghijklmnopqrstuvwxyz1234'
+SAMPLE_CAPTCHA_OPTIONS = ['🔴 красный', '🔵 синий', '🟢 зеленый', '🟡 желтый']
+
+
+# === UTILS ===
+
+@benchmark('utils.hash_password', number=5)
+def bench_hash_password():
+    utils.hash_password(SAMPLE_PASSWORD)
+
+
+@benchmark('utils.verify_password', number=5)
+def bench_verify_password():
+    utils.verify_password(SAMPLE_PASSWORD, SAMPLE_PASSWORD_HASH)
+
+
+@benchmark('utils.generate_qr_code.trc20', number=20)
+def bench_qr_trc20():
+    utils.generate_qr_code(SAMPLE_ADDRESS, 150.0, 'TRC20')
+
+
+@benchmark('utils.generate_qr_code.ton', number=20)
+def bench_qr_ton():
+    utils.generate_qr_code(SAMPLE_ADDRESS, 150.0, 'TON')
+
+
+@benchmark('utils.format_deal_info', number=5000)
+def bench_format_deal_info():
+    utils.format_deal_info(SAMPLE_DEAL, SAMPLE_USER['user_id'])
+
+
+@benchmark('utils.format_user_info', number=5000)
+def bench_format_user_info():
+    utils.format_user_info(SAMPLE_USER)
+
+
+@benchmark('utils.escape_markdown', number=5000)
+def bench_escape_markdown():
+    utils.escape_markdown(SAMPLE_DEAL['deal_conditions'])
+
+
+# === TEXTS ===
+
+@benchmark('texts.render.deal_created', number=5000)
+def bench_render_deal_created():
+    texts.render(
+        'deal_created', 'ru',
+        deal_code=SAMPLE_DEAL['deal_code'],
+        role=texts.role(SAMPLE_DEAL['creator_role'], 'ru'),
+        amount=SAMPLE_DEAL['amount_usd'],
+        conditions=SAMPLE_DEAL['deal_conditions'][:100],
+        password=SAMPLE_PASSWORD,
+        deal_link=f"https://t.me/ozer_garant_bot?start=deal_{SAMPLE_DEAL['deal_code']}",
+        expires_at=SAMPLE_DEAL['expires_at']
+    )
+
+
+@benchmark('texts.render.payment_details.en', number=5000)
+def bench_render_payment_details():
+    texts.render(
+        'payment_details', 'en-US',
+        deal_code=SAMPLE_DEAL['deal_code'],
+        amount=SAMPLE_DEAL['amount_usd'],
+        crypto_amount=Decimal('150.123456'),
+        asset='USDT',
+        rate=Decimal('0.9991'),
+        payment_method='TRC20',
+        address=SAMPLE_ADDRESS,
+        memo_line=texts.render('payment_memo_line', 'en-US', memo='AB12CD34')
+    )
+
+
+# === CAPTCHA ===
+
+@benchmark('captcha.generate_captcha', number=5000)
+def bench_generate_captcha():
+    captcha_system.generate_captcha()
+
+
+@benchmark('captcha.verify_answer', number=20000)
+def bench_verify_answer():
+    captcha_system.verify_answer(' Красный ', 'красный')
+
+
+@benchmark('captcha.render_text_captcha', number=20)
+def bench_render_text_captcha():
+    render_text_captcha()
+
+
+_captcha_bank = CaptchaBank(size=10 ** 6, low_watermark=0)
+_captcha_bank.bank.extend([(b'png', 'ANSWR')] * 10 ** 6)
+
+
+@benchmark('captcha_bank.pop', number=20000)
+def bench_captcha_bank_pop():
+    _captcha_bank.pop()
+
+
+# === KEYBOARDS ===
+
+@benchmark('keyboards.get_main_menu')
+def bench_kb_main_menu():
+    keyboards.get_main_menu()
+
+
+@benchmark('keyboards.get_captcha_keyboard')
+def bench_kb_captcha():
+    keyboards.get_captcha_keyboard(SAMPLE_CAPTCHA_OPTIONS)
+
+
+@benchmark('keyboards.get_role_selection')
+def bench_kb_role_selection():
+    keyboards.get_role_selection()
+
+
+@benchmark('keyboards.get_payment_methods')
+def bench_kb_payment_methods():
+    keyboards.get_payment_methods()
+
+
+@benchmark('keyboards.get_deal_actions')
+def bench_kb_deal_actions():
+    keyboards.get_deal_actions(SAMPLE_DEAL['id'], 'payment_pending')
+
+
+@benchmark('keyboards.get_deal_confirmation')
+def bench_kb_deal_confirmation():
+    keyboards.get_deal_confirmation(SAMPLE_DEAL['deal_code'])
+
+
+@benchmark('keyboards.get_support_keyboard')
+def bench_kb_support():
+    keyboards.get_support_keyboard()
+
+
+@benchmark('keyboards.get_deals_list_keyboard')
+def bench_kb_deals_list():
+    keyboards.get_deals_list_keyboard(SAMPLE_DEALS_LIST)
+
+
+@benchmark('keyboards.get_cancel_keyboard')
+def bench_kb_cancel():
+    keyboards.get_cancel_keyboard()
+
+
+@benchmark('keyboards.get_admin_keyboard')
+def bench_kb_admin():
+    keyboards.get_admin_keyboard()
+
+
+@benchmark('keyboards.get_qr_payment_keyboard')
+def bench_kb_qr_payment():
+    keyboards.get_qr_payment_keyboard()
+
+
+# === ИДЕМПОТЕНТНОСТЬ ===
+
+_idempotency_store = MemoryIdempotencyStore()
+_idempotency_keys = iter(range(10 ** 9))
+
+
+@benchmark('idempotency.memory.first_tap', number=5000)
+async def bench_idempotency_first_tap():
+    key = f"callback:{SAMPLE_USER['user_id']}:{next(_idempotency_keys)}:payment_completed"
+    await _idempotency_store.claim(key, 10)
+    await _idempotency_store.complete(key, '{"text": null, "show_alert": null}', 10)
+
+
+@benchmark('idempotency.memory.duplicate_tap', number=5000)
+async def bench_idempotency_duplicate_tap():
+    await _idempotency_store.claim(f"callback:{SAMPLE_USER['user_id']}:1:payment_completed", 10)
+
+
+# === ОГРАНИЧЕНИЕ ЧАСТОТЫ ===
+
+_throttler = Throttler(limits={'message': (10 ** 9, 10 ** 9), 'start': (0.001, 1)})
+_throttle_users = iter(range(10 ** 9))
+
+
+@benchmark('throttling.check.allowed', number=20000)
+def bench_throttling_allowed():
+    _throttler.check(next(_throttle_users) % 10000, 'message')
+
+
+@benchmark('throttling.check.rejected', number=20000)
+def bench_throttling_rejected():
+    _throttler.check(SAMPLE_USER['user_id'], 'start')
+
+
+# === ХРАНИЛИЩА ===
+
+_storages = {}
+
+
+async def _get_storage(backend: str):
+    """Подключенное хранилище с тестовыми данными (создается один раз)"""
+    if backend not in _storages:
+        if backend == 'sqlite':
+            from database_sqlite import SQLiteDatabase
+            storage = SQLiteDatabase(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        else:
+            storage = create_database(backend)
+        await storage.connect()
+
+        user_id = SAMPLE_USER['user_id']
+        await storage.create_user(user_id, SAMPLE_USER['username'], SAMPLE_USER['first_name'], SAMPLE_USER['last_name'])
+        await storage.create_captcha_session(user_id, 'math', '4', datetime.now() + timedelta(hours=1))
+        if not await storage.get_deal_by_code(SAMPLE_DEAL['deal_code']):
+            for i in range(20):
+                await storage.create_deal(
+                    user_id, 'buyer', SAMPLE_DEAL['amount_usd'], SAMPLE_DEAL['deal_conditions'],
+                    SAMPLE_PASSWORD_HASH, SAMPLE_DEAL['deal_code'] if i == 0 else f"BNCH{i:04d}",
+                    datetime.now() + timedelta(hours=24)
+                )
+        _storages[backend] = storage
+    return _storages[backend]
+
+
+async def _close_storages():
+    for storage in _storages.values():
+        await storage.close()
+    _storages.clear()
+
+
+TEARDOWN_HOOKS.append(_close_storages)
+
+
+def _register_storage_benchmarks(backend: str):
+    """Одинаковый набор операций для каждого бэкенда хранилища"""
+    user_id = SAMPLE_USER['user_id']
+
+    @benchmark(f'db.{backend}.get_user', number=500)
+    async def bench_get_user():
+        await (await _get_storage(backend)).get_user(user_id)
+
+    @benchmark(f'db.{backend}.create_user', number=200)
+    async def bench_create_user():
+        await (await _get_storage(backend)).create_user(user_id, 'ozer_user', 'Иван', 'Петров')
+
+    @benchmark(f'db.{backend}.get_deal_by_code', number=500)
+    async def bench_get_deal_by_code():
+        await (await _get_storage(backend)).get_deal_by_code(SAMPLE_DEAL['deal_code'])
+
+    @benchmark(f'db.{backend}.get_user_deals', number=200)
+    async def bench_get_user_deals():
+        await (await _get_storage(backend)).get_user_deals(user_id)
+
+    @benchmark(f'db.{backend}.get_captcha_session', number=500)
+    async def bench_get_captcha_session():
+        await (await _get_storage(backend)).get_captcha_session(user_id)
+
+    @benchmark(f'db.{backend}.add_deal_messages.batch100', number=20)
+    async def bench_add_deal_messages():
+        storage = await _get_storage(backend)
+        deal = await storage.get_deal_by_code(SAMPLE_DEAL['deal_code'])
+        await storage.add_deal_messages([(deal['id'], user_id, 'user', 'Сообщение по сделке', None)] * 100)
+
+    @benchmark(f'db.{backend}.search_deals.own', number=200)
+    async def bench_search_own_deals():
+        await (await _get_storage(backend)).search_deals('аккаунт гарантией', user_id)
+
+    @benchmark(f'db.{backend}.search_deals.all', number=200)
+    async def bench_search_all_deals():
+        await (await _get_storage(backend)).search_deals('аккаунт гарантией')
+
+    # Карточка сделки: полное чтение и отрисовка против проверки версии и кэша
+    cards = {}
+
+    async def _deal_cards():
+        if not cards:
+            storage = await _get_storage(backend)
+            cards['deal_id'] = (await storage.get_deal_by_code(SAMPLE_DEAL['deal_code']))['id']
+            cards['cards'] = DealCards(database=storage)
+        return cards['cards'], cards['deal_id']
+
+    @benchmark(f'db.{backend}.deal_card.render', number=500)
+    async def bench_deal_card_render():
+        deal_cards, deal_id = await _deal_cards()
+        DealCards.render(await deal_cards.db.get_deal_by_id(deal_id), 'creator', user_id)
+
+    @benchmark(f'db.{backend}.deal_card.cached', number=500)
+    async def bench_deal_card_cached():
+        deal_cards, deal_id = await _deal_cards()
+        await deal_cards.get(deal_id, user_id)
+
+    # Шаг мастера сделки в FSM: update_data и set_state сразу или одной записью в конце апдейта
+    fsm = {}
+
+    async def _fsm_storage():
+        if not fsm:
+            fsm['storage'] = DatabaseStorage(database=await _get_storage(backend))
+            fsm['key'] = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            fsm['steps'] = itertools.count()
+        return fsm['storage'], fsm['key'], next(fsm['steps'])
+
+    @benchmark(f'db.{backend}.fsm_step.immediate', number=200)
+    async def bench_fsm_step_immediate():
+        storage, key, step = await _fsm_storage()
+        await storage.update_data(key, {'amount': step})
+        await storage.set_state(key, f"DealStates:step_{step}")
+
+    @benchmark(f'db.{backend}.fsm_step.write_behind', number=200)
+    async def bench_fsm_step_write_behind():
+        storage, key, step = await _fsm_storage()
+        async with storage.batch():
+            await storage.update_data(key, {'amount': step})
+            await storage.set_state(key, f"DealStates:step_{step}")
+
+    @benchmark(f'db.{backend}.set_user_session', number=200)
+    async def bench_set_user_session():
+        await (await _get_storage(backend)).set_user_session(user_id, 'bench', {'step': 1})
+
+
+_register_storage_benchmarks('sqlite')
+if BENCHMARK_MYSQL:
+    _register_storage_benchmarks('mysql')
+
+
+# === ЗАПУСК ===
+
+def _time_round(func: Callable, number: int, loop: Optional[asyncio.AbstractEventLoop]) -> float:
+    """Время одного вызова (в микросекундах), усредненное по раунду"""
+    if asyncio.iscoroutinefunction(func):
+        async def run_round():
+            start = time.perf_counter()
+            for _ in range(number):
+                await func()
+            return time.perf_counter() - start
+        elapsed = loop.run_until_complete(run_round())
+    else:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+    return elapsed / number * 1_000_000
+
+
+def run_benchmarks(pattern: str = None, rounds: int = 5, seed: int = BENCHMARK_SEED) -> Dict[str, Dict]:
+    """Запуск зарегистрированных бенчмарков
+
+    Перед каждым бенчмарком генератор случайных чисел сбрасывается на
+    фиксированный seed, чтобы капча и коды сделок были одинаковыми между запусками.
+    """
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        for name, (func, number) in BENCHMARKS.items():
+            if pattern and pattern not in name:
+                continue
+
+            random.seed(seed)
+            # Прогрев
+            _time_round(func, max(1, number // 10), loop)
+
+            timings = [_time_round(func, number, loop) for _ in range(rounds)]
+            results[name] = {
+                'min_us': min(timings),
+                'median_us': statistics.median(timings),
+                'max_us': max(timings),
+                'rounds': rounds,
+                'number': number
+            }
+            print(f"⏱️ {name:<45} {results[name]['median_us']:>12.2f} мкс")
+    finally:
+        for hook in TEARDOWN_HOOKS:
+            loop.run_until_complete(hook())
+        loop.close()
+    return results
+
+
+def save_baseline(results: Dict[str, Dict], path: str = BENCHMARK_BASELINE_FILE):
+    """Сохранение результатов как базовой линии"""
+    baseline = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    baseline.update(results)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False, sort_keys=True)
+
+    print(f"✅ Базовая линия сохранена: {path}")
+
+
+def compare_with_baseline(results: Dict[str, Dict], path: str = BENCHMARK_BASELINE_FILE,
+                          threshold: float = BENCHMARK_THRESHOLD) -> List[str]:
+    """Сравнение с базовой линией, возвращает список деградировавших бенчмарков
+
+    Сравнивается минимальное время раунда как наименее шумная метрика.
+    """
+    if not os.path.exists(path):
+        print(f"❌ Базовая линия не найдена: {path}")
+        return list(results)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"⚪ {name:<45} нет в базовой линии")
+            continue
+
+        base = baseline[name]['min_us']
+        change = (result['min_us'] - base) / base * 100 if base else 0.0
+
+        if change > threshold:
+            regressions.append(name)
+            print(f"🔴 {name:<45} {change:>+8.1f}%")
+        else:
+            print(f"🟢 {name:<45} {change:>+8.1f}%")
+
+    return regressions
+
+
+def main():
+    """Точка входа CLI"""
+    parser = argparse.ArgumentParser(description="Бенчмарки OZER GARANT Bot")
+    parser.add_argument('-k', '--filter', help="Запускать только бенчмарки, содержащие подстроку")
+    parser.add_argument('--rounds', type=int, default=5, help="Количество раундов")
+    parser.add_argument('--seed', type=int, default=BENCHMARK_SEED, help="Seed генератора случайных чисел")
+    parser.add_argument('--baseline', default=BENCHMARK_BASELINE_FILE, help="Файл базовой линии")
+    parser.add_argument('--save', action='store_true', help="Сохранить результаты как базовую линию")
+    parser.add_argument('--compare', action='store_true', help="Сравнить с базовой линией")
+    parser.add_argument('--threshold', type=float, default=BENCHMARK_THRESHOLD,
+                        help="Допустимая деградация в процентах")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.filter, args.rounds, args.seed)
+
+    if args.save:
+        save_baseline(results, args.baseline)
+
+    if args.compare:
+        regressions = compare_with_baseline(results, args.baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ Деградация больше {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ Деградаций не обнаружено")
+
+
+if __name__ == "__main__":
+    main()
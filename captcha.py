@@ -1,3 +1,4 @@
+import math
 import random
 import secrets
 from datetime import datetime, timedelta
@@ -201,5 +202,61 @@ class CaptchaSystem:
         """Проверка ответа пользователя"""
         return user_answer.lower().strip() == correct_answer.lower().strip()
 
+# === КАПЧА-КАРТИНКА ===
+
+# Символы без похожих пар (0/O, 1/I/l, 5/S, 8/B)
+IMAGE_CAPTCHA_ALPHABET = 'ACDEFHJKMNPRTUVWXY234679'
+IMAGE_CAPTCHA_SIZE = (280, 100)
+
+def _load_font(size: int, font_path: str = None) -> ImageFont.FreeTypeFont:
+    if font_path:
+        return ImageFont.truetype(font_path, size)
+    return ImageFont.load_default(size=size)
+
+def render_text_captcha(length: int = 5, font_path: str = None) -> Tuple[bytes, str]:
+    """Картинка с искаженным текстом: (PNG, ответ)
+
+    Каждый символ повернут и смещен отдельно, строка изогнута синусоидой,
+    сверху - шумовые линии и точки. Выполняется в процессах пула банка
+    капчи, а не в цикле событий.
+    """
+    rng = secrets.SystemRandom()
+    answer = ''.join(rng.choice(IMAGE_CAPTCHA_ALPHABET) for _ in range(length))
+    width, height = IMAGE_CAPTCHA_SIZE
+    background = tuple(rng.randint(220, 255) for _ in range(3))
+    image = Image.new('RGB', IMAGE_CAPTCHA_SIZE, background)
+
+    # Символы
+    step = (width - 40) // length
+    for index, char in enumerate(answer):
+        font = _load_font(rng.randint(44, 58), font_path)
+        glyph = Image.new('L', (80, 90), 0)
+        ImageDraw.Draw(glyph).text((15, 5), char, font=font, fill=255)
+        glyph = glyph.rotate(rng.uniform(-30, 30), resample=Image.BICUBIC, expand=False)
+        color = tuple(rng.randint(0, 120) for _ in range(3))
+        x = 20 + index * step + rng.randint(-6, 6)
+        y = rng.randint(-5, 15)
+        image.paste(Image.new('RGB', glyph.size, color), (x, y), glyph)
+
+    # Изгиб строки: сдвиг столбцов по синусоиде
+    amplitude, period, phase = rng.uniform(4, 8), rng.uniform(60, 120), rng.uniform(0, 6.28)
+    warped = Image.new('RGB', IMAGE_CAPTCHA_SIZE, background)
+    for x in range(width):
+        offset = int(amplitude * math.sin(2 * math.pi * x / period + phase))
+        warped.paste(image.crop((x, 0, x + 1, height)), (x, offset))
+    image = warped
+
+    # Шум
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(4, 7)):
+        points = [(rng.randint(0, width), rng.randint(0, height)) for _ in range(2)]
+        draw.line(points, fill=tuple(rng.randint(0, 160) for _ in range(3)), width=rng.randint(1, 3))
+    for _ in range(width * height // 60):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=tuple(rng.randint(0, 200) for _ in range(3)))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue(), answer
+
 # Создание глобального экземпляра системы капчи
 captcha_system = CaptchaSystem()
\ No newline at end of file
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+from captcha import render_text_captcha
+from config import (
+    CAPTCHA_BANK_SIZE, CAPTCHA_BANK_LOW_WATERMARK, CAPTCHA_BANK_BATCH, CAPTCHA_RENDER_WORKERS,
+    CAPTCHA_IMAGE_LENGTH, CAPTCHA_FONT_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+# Последние замеры пакетов для перцентилей
+REFILL_WINDOW = 200
+
+def _render_batch(count: int, length: int, font_path: Optional[str]) -> list:
+    """Пакет капч в процессе пула: один вызов на пакет вместо одного на картинку"""
+    return [render_text_captcha(length, font_path) for _ in range(count)]
+
+class CaptchaBank:
+    """Банк готовых капч-картинок (PNG и ответ)
+
+    Картинки рисуются в пуле процессов пакетами по CAPTCHA_BANK_BATCH и
+    складываются в ограниченный банк. Когда в банке остается меньше
+    CAPTCHA_BANK_LOW_WATERMARK капч, фоновая задача пополняет его до
+    CAPTCHA_BANK_SIZE. Выдача только забирает готовую капчу из банка; если
+    банк пуст, вызывающий показывает капчу с кнопками.
+    """
+
+    def __init__(self, size: int = CAPTCHA_BANK_SIZE, low_watermark: int = CAPTCHA_BANK_LOW_WATERMARK,
+                 workers: int = CAPTCHA_RENDER_WORKERS):
+        self.size = size
+        self.low_watermark = low_watermark
+        self.workers = workers
+        self.bank: deque = deque(maxlen=size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batch_ms: deque = deque(maxlen=REFILL_WINDOW)
+        self.stats = {
+            'requests': 0, 'hits': 0, 'misses': 0, 'rendered': 0, 'batches': 0, 'errors': 0, 'last_refill_ms': 0.0
+        }
+
+    def pop(self) -> Optional[Tuple[bytes, str]]:
+        """Готовая капча из банка или None, если банк пуст"""
+        self.stats['requests'] += 1
+        try:
+            challenge = self.bank.popleft()
+        except IndexError:
+            self.stats['misses'] += 1
+            challenge = None
+        else:
+            self.stats['hits'] += 1
+        if len(self.bank) < self.low_watermark and self._refill_needed:
+            self._refill_needed.set()
+        return challenge
+
+    async def refill(self):
+        """Пополнение банка до полного размера"""
+        loop = asyncio.get_running_loop()
+        refill_started = time.perf_counter()
+        while len(self.bank) < self.size:
+            # Пакеты рисуются параллельно во всех процессах пула
+            missing = self.size - len(self.bank)
+            batches = [min(CAPTCHA_BANK_BATCH, missing - offset) for offset in range(0, missing, CAPTCHA_BANK_BATCH)]
+            batches = batches[:self.workers]
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, _render_batch, count, CAPTCHA_IMAGE_LENGTH, CAPTCHA_FONT_PATH)
+                for count in batches
+            ))
+            self.batch_ms.append((time.perf_counter() - started) * 1000)
+            for challenges in results:
+                self.bank.extend(challenges)
+                self.stats['rendered'] += len(challenges)
+                self.stats['batches'] += 1
+        self.stats['last_refill_ms'] = (time.perf_counter() - refill_started) * 1000
+
+    async def _run(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            try:
+                await self.refill()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Captcha bank refill error: {e}")
+                await asyncio.sleep(5)
+                self._refill_needed.set()
+
+    def start(self):
+        """Запуск пула процессов и начальное заполнение банка"""
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        latencies = sorted(self.batch_ms)
+        stats['size'] = len(self.bank)
+        stats['hit_rate'] = stats['hits'] / stats['requests'] if stats['requests'] else 0.0
+        # Время одного круга пакетов в пуле
+        stats['batch_p50_ms'] = latencies[len(latencies) // 2] if latencies else 0.0
+        stats['batch_max_ms'] = latencies[-1] if latencies else 0.0
+        return stats
+
+# Создание глобального экземпляра банка капч
+captcha_bank = CaptchaBank()
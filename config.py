@@ -17,23 +17,199 @@ MYSQL_CONFIG = {
     'autocommit': True
 }
 
-# Redis Settings (not used currently)
-# REDIS_CONFIG = {
-#     'host': os.getenv('REDIS_HOST', 'localhost'),
-#     'port': int(os.getenv('REDIS_PORT', 6379)),
-#     'password': os.getenv('REDIS_PASSWORD', None),
-#     'db': 0
-# }
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 5))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 50))
+DB_ACQUIRE_TIMEOUT = float(os.getenv('DB_ACQUIRE_TIMEOUT', 3))  # seconds
+DB_POOL_GROW_WAIT = 0.05  # seconds, average acquire wait that triggers growth
+DB_POOL_ADJUST_INTERVAL = 5  # seconds
+DB_POOL_RECYCLE = 300  # seconds, idle connections older than this are reopened
+DB_HEALTH_CHECK_INTERVAL = 30  # seconds
+
+# Read replicas: "host:port,host:port", credentials are the same as for the primary
+MYSQL_REPLICAS = [
+    {**MYSQL_CONFIG, 'host': host, 'port': int(port or MYSQL_CONFIG['port'])}
+    for host, _, port in (
+        item.strip().partition(':') for item in os.getenv('MYSQL_REPLICAS', '').split(',') if item.strip()
+    )
+]
+READ_YOUR_WRITES_WINDOW = 5  # seconds, reads of a user who just wrote go to the primary
+REPLICA_MAX_LAG = 3  # seconds, lagging replicas are removed from rotation
+REPLICA_CHECK_INTERVAL = 5  # seconds
+
+# Storage backend: 'mysql' or 'sqlite'
+DATABASE_BACKEND = os.getenv('DATABASE_BACKEND', 'mysql')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'ozer_garant.db')
+
+# Redis Settings (used by IDEMPOTENCY_BACKEND=redis)
+REDIS_CONFIG = {
+    'host': os.getenv('REDIS_HOST', 'localhost'),
+    'port': int(os.getenv('REDIS_PORT', 6379)),
+    'password': os.getenv('REDIS_PASSWORD', None),
+    'db': 0
+}
+
+# FSM storage: 'memory' (lost on restart), 'database' (user_sessions table) or 'redis'
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+FSM_CACHE_SIZE = 10000  # users whose FSM state is kept in the local cache of the database storage
+
+# Callback idempotency: 'memory' (single bot process) or 'redis' (shared)
+IDEMPOTENCY_BACKEND = os.getenv('IDEMPOTENCY_BACKEND', 'memory')
+IDEMPOTENCY_TTL = 10  # seconds a repeated tap on the same button is answered from cache
+IDEMPOTENCY_UPDATE_TTL = 600  # seconds a redelivered update_id is dropped
+# Navigation buttons that are safe and expected to be pressed again
+IDEMPOTENCY_SKIP_PREFIXES = ('search_page_', 'chat_history_', 'refresh_deal_')
+
+# Update throttling: per-user token buckets by update kind, (tokens per second, burst)
+THROTTLE_LIMITS = {
+    'start': (0.2, 3),
+    'command': (1, 5),
+    'message': (2, 10),
+    'callback': (3, 10)
+}
+THROTTLE_MAX_CONCURRENT = int(os.getenv('THROTTLE_MAX_CONCURRENT', 200))  # updates handled at once before shedding
+THROTTLE_MUTE_VIOLATIONS = 20  # rejected updates within the window that trigger a mute
+THROTTLE_MUTE_WINDOW = 10  # seconds
+THROTTLE_MUTE_SECONDS = int(os.getenv('THROTTLE_MUTE_SECONDS', 60))  # first mute, doubled on each repeat
+THROTTLE_MUTE_MAX = 3600  # seconds
+THROTTLE_MUTE_DECAY = 86400  # seconds without a mute after which the next mute is halved
+THROTTLE_NOTICE_INTERVAL = 5  # seconds between "too fast" replies to one user
+THROTTLE_IDLE_TTL = 600  # seconds before an idle user's buckets are dropped
+THROTTLE_SWEEP_INTERVAL = 60  # seconds
+
+# Per-user and per-deal serialisation of update handling
+KEYED_LOCK_SHARDS = 16
+KEYED_LOCK_IDLE_TTL = 60  # seconds an unused lock is kept before cleanup
+KEYED_LOCK_SWEEP_INTERVAL = 30  # seconds for a full cleanup pass over all shards
+KEYED_LOCK_TIMEOUT = 30  # seconds to wait before handling an update without the lock
+
+# Telegram Bot API HTTP session
+TELEGRAM_CONNECTION_LIMIT = int(os.getenv('TELEGRAM_CONNECTION_LIMIT', 100))
+TELEGRAM_MEDIA_CONCURRENCY = int(os.getenv('TELEGRAM_MEDIA_CONCURRENCY', 10))  # parallel uploads
+# Text requests get the rest of the pool, so uploads never take their connections
+TELEGRAM_TEXT_CONCURRENCY = TELEGRAM_CONNECTION_LIMIT - TELEGRAM_MEDIA_CONCURRENCY
+TELEGRAM_KEEPALIVE_TIMEOUT = 60  # seconds an idle connection is kept open
+TELEGRAM_DNS_CACHE_TTL = 300  # seconds
+TELEGRAM_TIMEOUT = 15  # seconds, default request timeout
+TELEGRAM_MEDIA_TIMEOUT = 60  # seconds, uploads
+TELEGRAM_METHOD_TIMEOUTS = {
+    'answerCallbackQuery': 5,  # Telegram stops waiting for the answer after a few seconds anyway
+    'sendDocument': 180  # deal exports up to 50 MB
+}
+
+# Deal password hashing: 'scrypt' or 'pbkdf2-sha256' (see python passwords.py calibrate)
+PASSWORD_ALGORITHM = os.getenv('PASSWORD_ALGORITHM', 'scrypt')
+PASSWORD_SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', 1))
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', 600000))
+
+# Sharded deployment (python sharding.py run): updates routed to worker processes by user_id
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1))
+SHARD_SOCKET = os.getenv('SHARD_SOCKET', '/tmp/ozer_garant_shards.sock')
+SHARD_VIRTUAL_NODES = 64  # points per worker on the consistent hash ring
+SHARD_RESTART_DELAY = 1  # seconds before a crashed worker is restarted
+SHARD_MAX_UNACKED = 1000  # updates per worker in flight before the poller waits
 
 # Bot Settings
 SUPPORT_USERNAME = os.getenv('SUPPORT_USERNAME', 'Anton_ozernote')
 TRC20_ADDRESS = os.getenv('TRC20_ADDRESS')
 TON_ADDRESS = os.getenv('TON_ADDRESS')
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+
+# Per-deal deposit addresses derived from an account-level extended public key (m/44'/195'/0')
+TRC20_XPUB = os.getenv('TRC20_XPUB')
+DEPOSIT_POOL_TARGET = int(os.getenv('DEPOSIT_POOL_TARGET', 500))  # unused addresses kept ready
+DEPOSIT_POOL_LOW_WATERMARK = int(os.getenv('DEPOSIT_POOL_LOW_WATERMARK', 100))
+DEPOSIT_POOL_BATCH = 100  # addresses derived and inserted per batch
+DEPOSIT_POOL_CHECK_INTERVAL = 30  # seconds
+
+# Payment watcher: chain indexer API polled for incoming transfers
+CHAIN_INDEXER_URL = os.getenv('CHAIN_INDEXER_URL')
+CHAIN_INDEXER_API_KEY = os.getenv('CHAIN_INDEXER_API_KEY')
+PAYMENT_POLL_INTERVAL = int(os.getenv('PAYMENT_POLL_INTERVAL', 15))  # seconds
+# Without the indexer, buyer confirmation alone completes the deal only when explicitly allowed
+ALLOW_UNVERIFIED_COMPLETION = os.getenv('ALLOW_UNVERIFIED_COMPLETION', 'false').lower() in ('1', 'true', 'yes')
+PAYMENT_POLL_PAGE_SIZE = 500
+PAYMENT_POLL_MAX_PAGES = 10  # pages fetched per cycle when the indexer has a backlog
+
+# Exchange rates: USD price per coin from GET {RATE_FEED_URL}?symbols=USDT,TON
+RATE_FEED_URL = os.getenv('RATE_FEED_URL')
+RATE_TTL = int(os.getenv('RATE_TTL', 60))  # seconds a rate is considered fresh
+RATE_STALE_TTL = int(os.getenv('RATE_STALE_TTL', 900))  # seconds a stale rate is still served while refreshing
 
 # Captcha Settings
 CAPTCHA_TIMEOUT = 60  # seconds
 MAX_CAPTCHA_ATTEMPTS = 3
+CAPTCHA_IMAGE_ENABLED = os.getenv('CAPTCHA_IMAGE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CAPTCHA_IMAGE_TIMEOUT = 180  # seconds to type the text from the image
+CAPTCHA_IMAGE_LENGTH = 5
+CAPTCHA_FONT_PATH = os.getenv('CAPTCHA_FONT_PATH')  # TTF font, Pillow's bundled font when unset
+CAPTCHA_BANK_SIZE = int(os.getenv('CAPTCHA_BANK_SIZE', 500))  # ready image captchas kept in memory
+CAPTCHA_BANK_LOW_WATERMARK = 200
+CAPTCHA_BANK_BATCH = 50  # captchas rendered per process pool call
+CAPTCHA_RENDER_WORKERS = int(os.getenv('CAPTCHA_RENDER_WORKERS', 1))  # rendering processes
 
 # Deal Settings
 DEAL_TIMEOUT = 3600  # 1 hour
-MAX_DEALS_PER_USER = 5
\ No newline at end of file
+MAX_DEALS_PER_USER = 5
+
+# Deal chat settings
+DEAL_CHAT_FLUSH_INTERVAL_MS = int(os.getenv('DEAL_CHAT_FLUSH_INTERVAL_MS', 200))
+DEAL_CHAT_FLUSH_SIZE = int(os.getenv('DEAL_CHAT_FLUSH_SIZE', 100))
+DEAL_CHAT_MAX_PENDING = 10000  # messages kept in memory while the database is unavailable
+DEAL_CHAT_RETRY_BACKOFF = 1  # seconds before the first retry after the database failed, doubled per failure
+DEAL_CHAT_RETRY_BACKOFF_MAX = 30  # seconds
+DEAL_CHAT_HISTORY_PAGE = 10
+
+# Leaderboard settings
+LEADERBOARD_SIZE = 10
+LEADERBOARD_ADMIN_SIZE = 50
+LEADERBOARD_REFRESH_INTERVAL = 300  # seconds
+LEADERBOARD_REFRESH_DELAY = 5  # seconds, counter changes within this window trigger one refresh
+
+# Deal search settings
+DEAL_SEARCH_PAGE = 10
+DEAL_SEARCH_MAX_TERMS = 8
+
+# Deal card settings
+DEAL_CARD_CACHE_SIZE = 5000  # rendered cards kept in memory, keyed by deal version and viewer role
+
+# Deal cache settings (join by link)
+DEAL_CACHE_TTL = float(os.getenv('DEAL_CACHE_TTL', 5))  # seconds; bounds staleness of changes made by other processes
+DEAL_CACHE_SIZE = int(os.getenv('DEAL_CACHE_SIZE', 10000))  # entries: each deal is cached by code and by id
+
+# Deal archive settings: finished deals are moved to deals_archive
+DEAL_ARCHIVE_AFTER_DAYS = int(os.getenv('DEAL_ARCHIVE_AFTER_DAYS', 30))
+DEAL_ARCHIVE_BATCH = 200  # deals moved per transaction
+DEAL_ARCHIVE_PAUSE = 0.2  # seconds between batches
+DEAL_ARCHIVE_INTERVAL = 3600  # seconds between archiving runs
+
+# Retention of transient tables: rows older than keep_days by age_column are purged,
+# rows matching the keep SQL condition never are
+RETENTION_POLICIES = {
+    'captcha_sessions': {'age_column': 'expires_at', 'keep_days': 1, 'keep': None},
+    'user_sessions': {
+        'age_column': 'updated_at',
+        'keep_days': int(os.getenv('RETENTION_SESSION_DAYS', 30)),
+        # Sessions of users with unfinished deals
+        'keep': "EXISTS (SELECT 1 FROM deals d WHERE d.creator_id = user_sessions.user_id "
+                "AND d.status IN ('created', 'joined', 'payment_pending', 'disputed')) "
+                "OR EXISTS (SELECT 1 FROM deals d WHERE d.participant_id = user_sessions.user_id "
+                "AND d.status IN ('created', 'joined', 'payment_pending', 'disputed'))"
+    }
+}
+RETENTION_BATCH = 1000  # rows deleted per statement
+RETENTION_PAUSE = 0.5  # seconds between batches, lets replicas catch up
+RETENTION_MAX_BATCHES = 500  # per table per run, the rest waits for the next run
+RETENTION_INTERVAL = 3600  # seconds between runs
+
+# Deal export settings
+EXPORT_FETCH_SIZE = 500  # rows fetched from the server-side cursor at a time
+EXPORT_MAX_CONCURRENT = 2  # exports running at once, each holds a DB connection
+EXPORT_GZIP_LEVEL = 6
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024  # Telegram Bot API upload limit
+
+# Localisation settings: message templates live in texts.py
+DEFAULT_LOCALE = os.getenv('DEFAULT_LOCALE', 'ru')  # users without a supported language_code
+LOCALE_ALIASES = {'uk': 'ru', 'be': 'ru', 'kk': 'ru'}  # language_code -> template locale
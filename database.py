@@ -1,38 +1,211 @@
 import aiomysql
 import asyncio
+import itertools
 import logging
-from typing import Optional, Dict, List, Any
-from config import MYSQL_CONFIG
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, List, Any, Callable
+from config import (
+    MYSQL_CONFIG, MYSQL_REPLICAS, DATABASE_BACKEND,
+    READ_YOUR_WRITES_WINDOW, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL, DEAL_SEARCH_MAX_TERMS,
+    EXPORT_FETCH_SIZE
+)
+
+from db_pool import AdaptivePool
 
 logger = logging.getLogger(__name__)
 
+# Пользователь, чей апдейт сейчас обрабатывается (выставляется middleware)
+current_user_id: ContextVar[Optional[int]] = ContextVar('current_user_id', default=None)
+
+# Статусы, из которых сделка может перейти в указанный
+DEAL_TRANSITIONS = {
+    'joined': ('created',),
+    'payment_pending': ('joined',),
+    'completed': ('payment_pending',),
+    'cancelled': ('created', 'joined', 'payment_pending'),
+    'disputed': ('joined', 'payment_pending')
+}
+
+# Счетчик обоих участников, который увеличивает переход сделки в статус
+REPUTATION_COUNTERS = {
+    'joined': 'deals_count',
+    'completed': 'successful_deals'
+}
+
+# Статусы завершенных сделок, которые переносятся в архив
+ARCHIVED_DEAL_STATUSES = ('completed', 'cancelled')
+
+# Колонки, переносимые в deals_archive и deal_messages_archive
+DEAL_COLUMNS = (
+    "id, deal_code, creator_id, participant_id, creator_role, amount_usd, deal_conditions, deal_password, "
+    "status, payment_method, payment_proof, created_at, updated_at, completed_at, expires_at"
+)
+DEAL_MESSAGE_COLUMNS = "id, deal_id, user_id, message_type, message_text, file_id, created_at"
+
+# Колонки выгрузки сделок (без пароля)
+DEAL_EXPORT_COLUMNS = (
+    "id, deal_code, creator_id, participant_id, creator_role, amount_usd, deal_conditions, "
+    "status, payment_method, payment_proof, created_at, updated_at, completed_at"
+)
+
+# Условие на пользователей - участников сделки (параметры: deal_id, deal_id)
+DEAL_PARTIES_FILTER = (
+    "user_id IN (SELECT creator_id FROM deals WHERE id = %s "
+    "UNION ALL SELECT participant_id FROM deals WHERE id = %s)"
+)
+
+# Колонки, добавленные после первого релиза: (таблица, колонка, определение)
+ADDED_COLUMNS = [
+    ('users', 'ratings_count', 'INT DEFAULT 0'),
+    ('users', 'ratings_sum', 'INT DEFAULT 0')
+]
+
 class Database:
+    """Хранилище на MySQL (aiomysql)
+
+    Класс задает интерфейс хранилища: остальные бэкенды наследуются от него
+    и переопределяют примитивы выполнения запросов и методы с диалектным SQL.
+    """
+
+    # Вставка с пропуском дубликатов по ключу
+    INSERT_IGNORE = "INSERT IGNORE"
+    
+    # Минимальная длина слова, которое находит полнотекстовый индекс (ngram_token_size)
+    SEARCH_MIN_TERM = 2
+    
+    # Индексы, добавленные после первого релиза: (таблица, индекс, DDL)
+    ADDED_INDEXES = [
+        ('users', 'idx_leaderboard', "CREATE INDEX idx_leaderboard ON users (is_banned, rating, successful_deals)"),
+        ('deals', 'ft_deal_conditions',
+         "CREATE FULLTEXT INDEX ft_deal_conditions ON deals (deal_conditions) WITH PARSER ngram"),
+        ('deals', 'idx_created_at', "CREATE INDEX idx_created_at ON deals (created_at)"),
+        ('user_sessions', 'idx_updated_at', "CREATE INDEX idx_updated_at ON user_sessions (updated_at)"),
+        ('deals_archive', 'idx_id', "CREATE INDEX idx_id ON deals_archive (id)")
+    ]
+    
     def __init__(self):
         self.pool = None
+        self.replica_pools = []
+        self.healthy_replicas = []
+        self.recent_writers: Dict[int, float] = {}
+        self._replica_counter = itertools.count()
+        self._replica_monitor = None
+        # Обработчики изменения сделок (сброс кэшей): функция(deal_id, deal_code)
+        self.deal_listeners: List[Callable[[int, Optional[str]], None]] = []
     
     async def connect(self):
         """Создание пула соединений с базой данных"""
         try:
-            self.pool = await aiomysql.create_pool(
-                minsize=5,
-                maxsize=20,
-                **MYSQL_CONFIG
-            )
+            self.pool = await AdaptivePool.create('primary', **MYSQL_CONFIG)
             logger.info("Database connection pool created successfully")
             await self.create_tables()
         except Exception as e:
             logger.error(f"Error creating database pool: {e}")
             raise
+        
+        # Реплики необязательны: недоступная реплика не мешает запуску
+        for replica_config in MYSQL_REPLICAS:
+            try:
+                pool = await AdaptivePool.create(f"replica {replica_config['host']}", **replica_config)
+                self.replica_pools.append(pool)
+                logger.info(f"Replica pool created: {replica_config['host']}:{replica_config['port']}")
+            except Exception as e:
+                logger.error(f"Error creating replica pool {replica_config['host']}: {e}")
+        
+        self.healthy_replicas = list(self.replica_pools)
+        if self.replica_pools:
+            self._replica_monitor = asyncio.create_task(self._monitor_replicas())
     
     async def close(self):
         """Закрытие пула соединений"""
-        if self.pool:
-            self.pool.close()
-            await self.pool.wait_closed()
+        if self._replica_monitor:
+            self._replica_monitor.cancel()
+            self._replica_monitor = None
+        for pool in [self.pool] + self.replica_pools:
+            if pool:
+                pool.close()
+                await pool.wait_closed()
+        self.replica_pools = []
+        self.healthy_replicas = []
+    
+    def get_pool_stats(self) -> List[Dict]:
+        """Статистика насыщения пулов соединений"""
+        return [pool.get_stats() for pool in [self.pool] + self.replica_pools if pool]
+    
+    # Replica routing
+    def _mark_write(self):
+        """Запоминаем пользователя, который только что писал в базу"""
+        user_id = current_user_id.get()
+        if user_id is not None and self.replica_pools:
+            self.recent_writers[user_id] = time.monotonic()
+    
+    def read_pool(self):
+        """Пул для чтения: реплика, либо основной сервер для недавно писавшего пользователя"""
+        replicas = self.healthy_replicas
+        if not replicas:
+            return self.pool
+        
+        user_id = current_user_id.get()
+        if user_id is not None:
+            written_at = self.recent_writers.get(user_id)
+            if written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_WINDOW:
+                return self.pool
+        
+        return replicas[next(self._replica_counter) % len(replicas)]
+    
+    async def _replica_lag(self, pool) -> Optional[float]:
+        """Отставание реплики в секундах (None - репликация не работает)"""
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    try:
+                        await cursor.execute("SHOW REPLICA STATUS")
+                    except Exception:
+                        # MySQL < 8.0.22 и MariaDB
+                        await cursor.execute("SHOW SLAVE STATUS")
+                    status = await cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Replica health check error: {e}")
+            return None
+        
+        if not status:
+            return None
+        return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    
+    async def check_replicas(self):
+        """Одна проверка: в ротации остаются реплики с допустимым отставанием"""
+        healthy = []
+        for pool in self.replica_pools:
+            lag = await self._replica_lag(pool)
+            if lag is not None and lag <= REPLICA_MAX_LAG:
+                healthy.append(pool)
+            else:
+                logger.warning(f"Replica removed from rotation, lag: {lag}")
+        self.healthy_replicas = healthy
+        
+        cutoff = time.monotonic() - READ_YOUR_WRITES_WINDOW
+        self.recent_writers = {
+            user_id: written_at for user_id, written_at in self.recent_writers.items()
+            if written_at > cutoff
+        }
+    
+    async def _monitor_replicas(self):
+        """Фоновая проверка отставания реплик"""
+        while True:
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+            try:
+                await self.check_replicas()
+            except Exception as e:
+                logger.error(f"Replica monitor error: {e}")
     
-    async def execute_query(self, query: str, params: tuple = None) -> Optional[Any]:
+    async def execute_query(self, query: str, params: tuple = None, pool=None) -> Optional[Any]:
         """Выполнение SQL запроса"""
-        async with self.pool.acquire() as conn:
+        async with (pool or self.pool).acquire() as conn:
             async with conn.cursor() as cursor:
                 try:
                     await cursor.execute(query, params)
@@ -40,15 +213,30 @@ class Database:
                         return await cursor.fetchall()
                     else:
                         await conn.commit()
+                        self._mark_write()
                         return cursor.rowcount
                 except Exception as e:
                     logger.error(f"Database query error: {e}")
                     await conn.rollback()
                     raise
     
-    async def execute_fetchone(self, query: str, params: tuple = None) -> Optional[tuple]:
-        """Выполнение SQL запроса с получением одной записи"""
+    async def execute_insert(self, query: str, params: tuple = None) -> Optional[int]:
+        """Выполнение INSERT с получением ID созданной записи"""
         async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                try:
+                    await cursor.execute(query, params)
+                    await conn.commit()
+                    self._mark_write()
+                    return cursor.lastrowid
+                except Exception as e:
+                    logger.error(f"Database insert error: {e}")
+                    await conn.rollback()
+                    raise
+    
+    async def execute_fetchone(self, query: str, params: tuple = None, pool=None) -> Optional[tuple]:
+        """Выполнение SQL запроса с получением одной записи"""
+        async with (pool or self.pool).acquire() as conn:
             async with conn.cursor() as cursor:
                 try:
                     await cursor.execute(query, params)
@@ -57,6 +245,94 @@ class Database:
                     logger.error(f"Database fetchone error: {e}")
                     raise
     
+    async def stream_query(self, query: str, params: tuple = None, pool=None, batch_size: int = EXPORT_FETCH_SIZE):
+        """Чтение большого результата пакетами строк
+
+        Запрос выполняется небуферизованным курсором (SSCursor): строки читаются
+        с сервера по batch_size по мере потребления пакетов, поэтому память не
+        зависит от размера результата. Соединение занято до конца чтения.
+        """
+        async with (pool or self.pool).acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
+                try:
+                    await cursor.execute(query, params)
+                    while True:
+                        rows = await cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield rows
+                except Exception as e:
+                    logger.error(f"Database stream error: {e}")
+                    raise
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """Несколько запросов в одной транзакции
+
+        Объект транзакции выполняет запросы методом execute, который возвращает
+        число затронутых строк. Исключение внутри блока откатывает все запросы.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                try:
+                    await conn.begin()
+                    yield cursor
+                    await conn.commit()
+                    self._mark_write()
+                except Exception as e:
+                    logger.error(f"Database transaction error: {e}")
+                    await conn.rollback()
+                    raise
+    
+    async def _column_exists(self, table: str, column: str) -> bool:
+        query = """
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """
+        result = await self.execute_fetchone(query, (table, column))
+        return bool(result and result[0])
+    
+    async def _index_exists(self, table: str, index: str) -> bool:
+        query = """
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """
+        result = await self.execute_fetchone(query, (table, index))
+        return bool(result and result[0])
+    
+    async def upgrade_schema(self):
+        """Добавление новых колонок и индексов в таблицы существующей базы"""
+        for table, column, definition in ADDED_COLUMNS:
+            if not await self._column_exists(table, column):
+                await self.execute_query(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                logger.info(f"Column {table}.{column} added")
+        
+        for table, index, ddl in self.ADDED_INDEXES:
+            if not await self._index_exists(table, index):
+                await self.execute_query(ddl)
+                logger.info(f"Index {table}.{index} added")
+    
+    async def upgrade_archive_ids(self):
+        """Архивные таблицы без уникального ID и счетчики ID после архива
+
+        MySQL 5.7 после перезапуска берет AUTO_INCREMENT как MAX(id) + 1, и ID
+        перенесенных в архив последних сделок и сообщений выдаются повторно.
+        Счетчики сдвигаются за архивные ID, а архив хранит ID без уникальности,
+        чтобы перенос не останавливался на повторе.
+        """
+        for table in ('deals_archive', 'deal_messages_archive'):
+            if not await self._column_exists(table, 'archive_id'):
+                await self.execute_query(
+                    f"ALTER TABLE {table} DROP PRIMARY KEY, ADD COLUMN archive_id BIGINT AUTO_INCREMENT PRIMARY KEY"
+                )
+                logger.info(f"Column {table}.archive_id added")
+        
+        for table in ('deals', 'deal_messages'):
+            result = await self.execute_fetchone(f"SELECT MAX(id) FROM {table}_archive")
+            if result and result[0]:
+                # InnoDB сам не опустит счетчик ниже MAX(id) + 1 основной таблицы
+                await self.execute_query(f"ALTER TABLE {table} AUTO_INCREMENT = {result[0] + 1}")
+    
     async def create_tables(self):
         """Создание таблиц в базе данных"""
         tables = [
@@ -72,7 +348,10 @@ class Database:
                 deals_count INT DEFAULT 0,
                 successful_deals INT DEFAULT 0,
                 rating DECIMAL(3,2) DEFAULT 0.00,
-                is_banned BOOLEAN DEFAULT FALSE
+                is_banned BOOLEAN DEFAULT FALSE,
+                ratings_count INT DEFAULT 0,
+                ratings_sum INT DEFAULT 0,
+                INDEX idx_leaderboard (is_banned, rating, successful_deals)
             )
             """,
             """
@@ -109,7 +388,9 @@ class Database:
                 INDEX idx_creator_id (creator_id),
                 INDEX idx_participant_id (participant_id),
                 INDEX idx_deal_code (deal_code),
-                INDEX idx_status (status)
+                INDEX idx_status (status),
+                INDEX idx_created_at (created_at),
+                FULLTEXT INDEX ft_deal_conditions (deal_conditions) WITH PARSER ngram
             )
             """,
             """
@@ -127,13 +408,93 @@ class Database:
             )
             """,
             """
+            CREATE TABLE IF NOT EXISTS deals_archive (
+                id INT NOT NULL,
+                deal_code VARCHAR(10) UNIQUE NOT NULL,
+                creator_id BIGINT NOT NULL,
+                participant_id BIGINT,
+                creator_role ENUM('buyer', 'seller') NOT NULL,
+                amount_usd DECIMAL(10,2) NOT NULL,
+                deal_conditions TEXT NOT NULL,
+                deal_password VARCHAR(255) NOT NULL,
+                status ENUM('completed', 'cancelled') NOT NULL,
+                payment_method ENUM('TRC20', 'TON'),
+                payment_proof TEXT,
+                created_at TIMESTAMP NULL,
+                updated_at TIMESTAMP NULL,
+                completed_at TIMESTAMP NULL,
+                expires_at TIMESTAMP NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                archive_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                INDEX idx_id (id),
+                INDEX idx_creator_id (creator_id),
+                INDEX idx_participant_id (participant_id),
+                INDEX idx_created_at (created_at)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS deal_messages_archive (
+                id INT NOT NULL,
+                deal_id INT NOT NULL,
+                user_id BIGINT NOT NULL,
+                message_type ENUM('system', 'user', 'payment_proof') NOT NULL,
+                message_text TEXT,
+                file_id VARCHAR(255),
+                created_at TIMESTAMP NULL,
+                archive_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                INDEX idx_deal_id (deal_id, id)
+            )
+            """,
+            """
             CREATE TABLE IF NOT EXISTS user_sessions (
                 user_id BIGINT PRIMARY KEY,
                 current_action VARCHAR(100),
                 session_data JSON,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_updated_at (updated_at)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS deposit_addresses (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                network ENUM('TRC20', 'TON') NOT NULL,
+                derivation_index INT NOT NULL,
+                address VARCHAR(128) NOT NULL UNIQUE,
+                deal_id INT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMP NULL,
+                UNIQUE KEY uq_network_index (network, derivation_index),
+                INDEX idx_network_deal (network, deal_id),
+                INDEX idx_deal_id (deal_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS payment_cursors (
+                name VARCHAR(50) PRIMARY KEY,
+                cursor_value VARCHAR(255),
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
             )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS deal_payment_quotes (
+                deal_id INT PRIMARY KEY,
+                payment_method ENUM('TRC20', 'TON') NOT NULL,
+                crypto_amount DECIMAL(20, 9) NOT NULL,
+                rate DECIMAL(20, 8) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS deal_ratings (
+                deal_id INT NOT NULL,
+                rater_id BIGINT NOT NULL,
+                rated_id BIGINT NOT NULL,
+                score TINYINT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (deal_id, rater_id),
+                INDEX idx_rated_id (rated_id)
+            )
             """
         ]
         
@@ -144,6 +505,9 @@ class Database:
             except Exception as e:
                 logger.error(f"Error creating table: {e}")
                 raise
+        
+        await self.upgrade_schema()
+        await self.upgrade_archive_ids()
     
     # User methods
     async def create_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
@@ -162,7 +526,7 @@ class Database:
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Получение информации о пользователе"""
         query = "SELECT * FROM users WHERE user_id = %s"
-        result = await self.execute_fetchone(query, (user_id,))
+        result = await self.execute_fetchone(query, (user_id,), pool=self.read_pool())
         if result:
             return {
                 'user_id': result[0],
@@ -198,9 +562,9 @@ class Database:
         query = """
         SELECT * FROM captcha_sessions 
         WHERE user_id = %s AND is_solved = FALSE AND expires_at > NOW()
-        ORDER BY created_at DESC LIMIT 1
+        ORDER BY created_at DESC, id DESC LIMIT 1
         """
-        result = await self.execute_fetchone(query, (user_id,))
+        result = await self.execute_fetchone(query, (user_id,), pool=self.read_pool())
         if result:
             return {
                 'id': result[0],
@@ -225,6 +589,11 @@ class Database:
         return await self.execute_query(query, (session_id,))
     
     # Deal methods
+    def _deal_changed(self, deal_id: int, deal_code: Optional[str] = None):
+        """Оповещение кэшей об изменении сделки"""
+        for listener in self.deal_listeners:
+            listener(deal_id, deal_code)
+    
     async def create_deal(self, creator_id: int, creator_role: str, amount_usd: float, 
                          conditions: str, password: str, deal_code: str, expires_at) -> int:
         """Создание новой сделки"""
@@ -233,76 +602,579 @@ class Database:
                           deal_password, deal_code, expires_at)
         VALUES (%s, %s, %s, %s, %s, %s, %s)
         """
-        await self.execute_query(query, (creator_id, creator_role, amount_usd, 
-                                       conditions, password, deal_code, expires_at))
+        # ID берется с того же соединения, что выполнило INSERT
+        deal_id = await self.execute_insert(query, (creator_id, creator_role, amount_usd, 
+                                                    conditions, password, deal_code, expires_at))
+        self._deal_changed(deal_id, deal_code)
+        return deal_id
+    
+    async def _get_deal(self, column: str, value, primary: bool = False) -> Optional[Dict]:
+        """Сделка из основной таблицы, а если ее там нет - из архива"""
+        pool = self.pool if primary else self.read_pool()
+        for table in ('deals', 'deals_archive'):
+            result = await self.execute_fetchone(f"SELECT * FROM {table} WHERE {column} = %s", (value,), pool=pool)
+            if result:
+                return self._deal_from_row(result, archived=table == 'deals_archive')
+        return None
+    
+    async def deal_code_exists(self, deal_code: str) -> bool:
+        """Занят ли код сделкой из основной таблицы или из архива"""
+        # Одним запросом к основному серверу: сделка не проскочит между таблицами при переносе
+        result = await self.execute_fetchone(
+            "SELECT 1 FROM deals WHERE deal_code = %s UNION ALL SELECT 1 FROM deals_archive WHERE deal_code = %s",
+            (deal_code, deal_code)
+        )
+        return result is not None
+    
+    async def get_deal_by_code(self, deal_code: str, primary: bool = False) -> Optional[Dict]:
+        """Получение сделки по коду (primary - с основного сервера, минуя реплики)"""
+        return await self._get_deal('deal_code', deal_code, primary)
+    
+    async def get_deal_by_id(self, deal_id: int, primary: bool = False) -> Optional[Dict]:
+        """Получение сделки по ID (primary - с основного сервера, минуя реплики)"""
+        return await self._get_deal('id', deal_id, primary)
+    
+    async def get_deal_version(self, deal_id: int) -> Optional[Dict]:
+        """Поля сделки, по которым видно ее изменение, без чтения всей строки"""
+        pool = self.read_pool()
+        for table in ('deals', 'deals_archive'):
+            result = await self.execute_fetchone(
+                f"SELECT creator_id, participant_id, status, payment_method, updated_at FROM {table} WHERE id = %s",
+                (deal_id,), pool=pool
+            )
+            if result:
+                return {
+                    'creator_id': result[0],
+                    'participant_id': result[1],
+                    'status': result[2],
+                    'payment_method': result[3],
+                    'updated_at': result[4],
+                    'archived': table == 'deals_archive'
+                }
+        return None
+    
+    @staticmethod
+    def _deal_from_row(result: tuple, archived: bool = False) -> Dict:
+        """Преобразование строки таблицы deals в словарь"""
+        return {
+            'id': result[0],
+            'deal_code': result[1],
+            'creator_id': result[2],
+            'participant_id': result[3],
+            'creator_role': result[4],
+            'amount_usd': result[5],
+            'deal_conditions': result[6],
+            'deal_password': result[7],
+            'status': result[8],
+            'payment_method': result[9],
+            'payment_proof': result[10],
+            'created_at': result[11],
+            'updated_at': result[12],
+            'completed_at': result[13],
+            'expires_at': result[14],
+            'archived': archived
+        }
+    
+    async def transition_deal(self, deal_id: int, status: str, fields: Dict = None) -> bool:
+        """Смена статуса сделки вместе со счетчиками участников в одной транзакции
+
+        Переход выполняется только из допустимых статусов, поэтому повторный
+        вызов не увеличит счетчики дважды. Возвращает True, если статус сменился.
+        """
+        fields = dict(fields or {})
+        if status == 'completed':
+            fields.setdefault('completed_at', datetime.now())
         
-        # Получаем ID созданной сделки
-        result = await self.execute_fetchone("SELECT LAST_INSERT_ID()")
-        return result[0] if result else None
+        allowed = DEAL_TRANSITIONS[status]
+        assignments = ''.join(f", {column} = %s" for column in fields)
+        query = f"""
+        UPDATE deals SET status = %s{assignments}
+        WHERE id = %s AND status IN ({', '.join(['%s'] * len(allowed))})
+        """
+        
+        async with self.transaction() as tx:
+            if await tx.execute(query, (status, *fields.values(), deal_id, *allowed)) != 1:
+                return False
+            
+            counter = REPUTATION_COUNTERS.get(status)
+            if counter:
+                await tx.execute(
+                    f"UPDATE users SET {counter} = {counter} + 1 WHERE {DEAL_PARTIES_FILTER}",
+                    (deal_id, deal_id)
+                )
+        self._deal_changed(deal_id)
+        return True
     
-    async def get_deal_by_code(self, deal_code: str) -> Optional[Dict]:
-        """Получение сделки по коду"""
-        query = "SELECT * FROM deals WHERE deal_code = %s"
-        result = await self.execute_fetchone(query, (deal_code,))
-        if result:
-            return {
+    async def join_deal(self, deal_id: int, participant_id: int) -> bool:
+        """Присоединение к сделке (False - к сделке уже присоединились)"""
+        return await self.transition_deal(deal_id, 'joined', {'participant_id': participant_id})
+    
+    async def update_deal_status(self, deal_id: int, status: str) -> bool:
+        """Обновление статуса сделки"""
+        return await self.transition_deal(deal_id, status)
+    
+    async def update_deal_password(self, deal_id: int, password_hash: str):
+        """Замена хеша пароля сделки (без изменения updated_at)"""
+        query = "UPDATE deals SET deal_password = %s, updated_at = updated_at WHERE id = %s"
+        result = await self.execute_query(query, (password_hash, deal_id))
+        self._deal_changed(deal_id)
+        return result
+    
+    async def set_payment_method(self, deal_id: int, payment_method: str) -> bool:
+        """Установка метода оплаты (False - сделка уже не ожидает выбора оплаты)"""
+        return await self.transition_deal(deal_id, 'payment_pending', {'payment_method': payment_method})
+    
+    async def get_pending_payment_deals(self) -> List[Dict]:
+        """Сделки, ожидающие поступления оплаты, с их депозитными адресами"""
+        query = """
+        SELECT d.id, d.deal_code, d.creator_id, d.participant_id, d.amount_usd, d.payment_method, a.address,
+               q.crypto_amount
+        FROM deals d
+        LEFT JOIN deposit_addresses a ON a.deal_id = d.id AND a.network = d.payment_method
+        LEFT JOIN deal_payment_quotes q ON q.deal_id = d.id AND q.payment_method = d.payment_method
+        WHERE d.status = 'payment_pending'
+        """
+        results = await self.execute_query(query)
+        return [
+            {
                 'id': result[0],
                 'deal_code': result[1],
                 'creator_id': result[2],
                 'participant_id': result[3],
-                'creator_role': result[4],
-                'amount_usd': result[5],
-                'deal_conditions': result[6],
-                'deal_password': result[7],
-                'status': result[8],
-                'payment_method': result[9],
-                'payment_proof': result[10],
-                'created_at': result[11],
-                'updated_at': result[12],
-                'completed_at': result[13],
-                'expires_at': result[14]
+                'amount_usd': result[4],
+                'payment_method': result[5],
+                'deposit_address': result[6],
+                'payment_amount': Decimal(str(result[7])) if result[7] is not None else None
             }
-        return None
-    
-    async def join_deal(self, deal_id: int, participant_id: int):
-        """Присоединение к сделке"""
-        query = "UPDATE deals SET participant_id = %s, status = 'joined' WHERE id = %s"
-        return await self.execute_query(query, (participant_id, deal_id))
-    
-    async def update_deal_status(self, deal_id: int, status: str):
-        """Обновление статуса сделки"""
-        query = "UPDATE deals SET status = %s WHERE id = %s"
-        return await self.execute_query(query, (status, deal_id))
+            for result in results or []
+        ]
     
-    async def set_payment_method(self, deal_id: int, payment_method: str):
-        """Установка метода оплаты"""
-        query = "UPDATE deals SET payment_method = %s, status = 'payment_pending' WHERE id = %s"
-        return await self.execute_query(query, (payment_method, deal_id))
+    async def complete_deal_payment(self, deal_id: int, payment_proof: str) -> bool:
+        """Завершение сделки по найденной в блокчейне оплате
+
+        Условие на статус не дает завершить сделку дважды.
+        """
+        return await self.transition_deal(deal_id, 'completed', {'payment_proof': payment_proof})
     
-    async def get_user_deals(self, user_id: int) -> List[Dict]:
-        """Получение всех сделок пользователя"""
+    async def get_user_deals(self, user_id: int, include_archive: bool = True) -> List[Dict]:
+        """Получение всех сделок пользователя
+
+        include_archive=False - только незаархивированные сделки (достаточно
+        для поиска активной сделки).
+        """
         query = """
-        SELECT * FROM deals 
+        SELECT * FROM {table} 
         WHERE creator_id = %s OR participant_id = %s 
         ORDER BY created_at DESC
         """
-        results = await self.execute_query(query, (user_id, user_id))
+        tables = ('deals', 'deals_archive') if include_archive else ('deals',)
+        pool = self.read_pool()
         deals = []
-        if results:
-            for result in results:
-                deals.append({
-                    'id': result[0],
-                    'deal_code': result[1],
-                    'creator_id': result[2],
-                    'participant_id': result[3],
-                    'creator_role': result[4],
-                    'amount_usd': result[5],
-                    'deal_conditions': result[6],
-                    'status': result[8],
-                    'created_at': result[11]
-                })
+        for table in tables:
+            results = await self.execute_query(query.format(table=table), (user_id, user_id), pool=pool)
+            if results:
+                for result in results:
+                    deals.append({
+                        'id': result[0],
+                        'deal_code': result[1],
+                        'creator_id': result[2],
+                        'participant_id': result[3],
+                        'creator_role': result[4],
+                        'amount_usd': result[5],
+                        'deal_conditions': result[6],
+                        'status': result[8],
+                        'created_at': result[11]
+                    })
+        if include_archive:
+            deals.sort(key=lambda deal: deal['created_at'], reverse=True)
         return deals
     
+    # Archive methods
+    async def archive_deals_batch(self, finished_before: datetime, limit: int) -> int:
+        """Перенос пакета завершенных сделок и их сообщений в архив
+
+        Кандидаты выбираются обычным чтением, а перенос идет короткой
+        транзакцией по первичным ключам, поэтому блокируются только строки
+        пакета. Возвращает число перенесенных сделок.
+        """
+        statuses = ', '.join(['%s'] * len(ARCHIVED_DEAL_STATUSES))
+        query = f"""
+        SELECT id FROM deals
+        WHERE status IN ({statuses}) AND updated_at < %s
+        ORDER BY id LIMIT %s
+        """
+        results = await self.execute_query(query, (*ARCHIVED_DEAL_STATUSES, finished_before, limit))
+        deal_ids = tuple(result[0] for result in results or [])
+        if not deal_ids:
+            return 0
+        
+        placeholders = ', '.join(['%s'] * len(deal_ids))
+        async with self.transaction() as tx:
+            moved = await tx.execute(
+                f"INSERT INTO deals_archive ({DEAL_COLUMNS}) SELECT {DEAL_COLUMNS} FROM deals WHERE id IN ({placeholders})",
+                deal_ids
+            )
+            await tx.execute(
+                f"INSERT INTO deal_messages_archive ({DEAL_MESSAGE_COLUMNS}) "
+                f"SELECT {DEAL_MESSAGE_COLUMNS} FROM deal_messages WHERE deal_id IN ({placeholders})",
+                deal_ids
+            )
+            # Сообщения удаляются каскадно вместе со сделками
+            await tx.execute(f"DELETE FROM deals WHERE id IN ({placeholders})", deal_ids)
+        for deal_id in deal_ids:
+            self._deal_changed(deal_id)
+        return moved
+    
+    # Retention methods
+    @staticmethod
+    def _retention_condition(age_column: str, keep: Optional[str]) -> str:
+        condition = f"{age_column} < %s"
+        if keep:
+            condition += f" AND NOT ({keep})"
+        return condition
+    
+    async def count_purgeable(self, table: str, age_column: str, cutoff: datetime, keep: Optional[str] = None) -> int:
+        """Число строк, которые удалит очистка по политике хранения"""
+        query = f"SELECT COUNT(*) FROM {table} WHERE {self._retention_condition(age_column, keep)}"
+        result = await self.execute_fetchone(query, (cutoff,))
+        return result[0]
+    
+    async def purge_batch(self, table: str, age_column: str, cutoff: datetime, limit: int,
+                          keep: Optional[str] = None) -> int:
+        """Удаление пакета устаревших строк одним DELETE ... LIMIT
+        
+        Короткий оператор блокирует не больше limit строк и дает небольшое
+        событие в binlog, поэтому реплики не отстают. Возвращает число
+        удаленных строк.
+        """
+        query = f"DELETE FROM {table} WHERE {self._retention_condition(age_column, keep)} LIMIT %s"
+        return await self.execute_query(query, (cutoff, limit))
+    
+    # Deal search methods
+    def _search_terms(self, text: str) -> List[str]:
+        """Слова поискового запроса без операторов полнотекстового поиска"""
+        terms = [term for term in re.findall(r'\w+', text.lower()) if len(term) >= self.SEARCH_MIN_TERM]
+        return terms[:DEAL_SEARCH_MAX_TERMS]
+    
+    @staticmethod
+    def _search_result(result: tuple) -> Dict:
+        return {
+            'id': result[0],
+            'deal_code': result[1],
+            'status': result[2],
+            'amount_usd': result[3],
+            'created_at': result[4]
+        }
+    
+    async def search_deals(self, text: str, user_id: int = None, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """Поиск сделок по условиям
+
+        Сделки пользователя (user_id) перебираются по индексам creator_id и
+        participant_id, поэтому время поиска зависит от числа его сделок, а не
+        от размера таблицы; сортировка - от новых к старым. Поиск по всем
+        сделкам (user_id=None, для администраторов) идет по полнотекстовому
+        индексу с сортировкой по релевантности.
+        """
+        terms = self._search_terms(text)
+        if not terms:
+            return []
+        if user_id is None:
+            return await self._search_all_deals(terms, limit, offset)
+        return await self._search_user_deals(terms, user_id, limit, offset)
+    
+    async def _search_user_deals(self, terms: List[str], user_id: int, limit: int, offset: int) -> List[Dict]:
+        """Поиск среди сделок пользователя (сравнение без учета регистра дает колляция)"""
+        conditions = ' AND '.join(["deal_conditions LIKE %s ESCAPE '!'"] * len(terms))
+        patterns = tuple(
+            '%' + term.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%' for term in terms
+        )
+        query = f"""
+        SELECT id, deal_code, status, amount_usd, created_at FROM deals
+        WHERE (creator_id = %s OR participant_id = %s) AND {conditions}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s OFFSET %s
+        """
+        results = await self.execute_query(query, (user_id, user_id, *patterns, limit, offset), pool=self.read_pool())
+        return [self._search_result(result) for result in results or []]
+    
+    async def _search_all_deals(self, terms: List[str], limit: int, offset: int) -> List[Dict]:
+        """Поиск по индексу ft_deal_conditions (ngram)"""
+        # В режиме BOOLEAN каждое слово - обязательная фраза из n-грамм
+        against = ' '.join(f'+"{term}"' for term in terms)
+        query = """
+        SELECT id, deal_code, status, amount_usd, created_at,
+               MATCH (deal_conditions) AGAINST (%s IN BOOLEAN MODE) AS score
+        FROM deals
+        WHERE MATCH (deal_conditions) AGAINST (%s IN BOOLEAN MODE)
+        ORDER BY score DESC, id DESC
+        LIMIT %s OFFSET %s
+        """
+        results = await self.execute_query(query, (against, against, limit, offset), pool=self.read_pool())
+        return [self._search_result(result) for result in results or []]
+    
+    # Export methods
+    def stream_deals_export(self, user_id: int = None, created_from: datetime = None, created_to: datetime = None):
+        """Сделки для выгрузки пакетами строк (колонки DEAL_EXPORT_COLUMNS)
+
+        user_id - сделки пользователя, иначе - созданные в промежутке
+        [created_from, created_to). Архивные сделки включаются. Строки идут
+        без сортировки, чтобы сервер не собирал весь результат перед отдачей.
+        """
+        if user_id is not None:
+            condition, params = "creator_id = %s OR participant_id = %s", (user_id, user_id)
+        else:
+            condition, params = "created_at >= %s AND created_at < %s", (created_from, created_to)
+        query = f"""
+        SELECT {DEAL_EXPORT_COLUMNS} FROM deals WHERE {condition}
+        UNION ALL
+        SELECT {DEAL_EXPORT_COLUMNS} FROM deals_archive WHERE {condition}
+        """
+        return self.stream_query(query, params * 2, pool=self.read_pool())
+    
+    # Deal message methods
+    async def add_deal_messages(self, messages: List[tuple]) -> int:
+        """Пакетная запись сообщений сделки одним INSERT
+
+        Каждое сообщение - кортеж (deal_id, user_id, message_type, message_text, file_id).
+        """
+        if not messages:
+            return 0
+        query = (
+            "INSERT INTO deal_messages (deal_id, user_id, message_type, message_text, file_id) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(messages))
+        )
+        params = tuple(value for message in messages for value in message)
+        return await self.execute_query(query, params)
+    
+    async def get_deal_messages(self, deal_id: int, before_id: int = None, limit: int = 20) -> List[Dict]:
+        """Страница истории сообщений сделки, от новых к старым
+
+        Пагинация по ключу (deal_id, id): следующая страница запрашивается с
+        before_id равным наименьшему id предыдущей, без OFFSET.
+        """
+        if before_id is None:
+            query = """
+            SELECT id, deal_id, user_id, message_type, message_text, file_id, created_at
+            FROM {table} WHERE deal_id = %s
+            ORDER BY id DESC LIMIT %s
+            """
+            params = (deal_id, limit)
+        else:
+            query = """
+            SELECT id, deal_id, user_id, message_type, message_text, file_id, created_at
+            FROM {table} WHERE deal_id = %s AND id < %s
+            ORDER BY id DESC LIMIT %s
+            """
+            params = (deal_id, before_id, limit)
+        
+        pool = self.read_pool()
+        results = await self.execute_query(query.format(table='deal_messages'), params, pool=pool)
+        if not results:
+            # Сообщения архивной сделки целиком перенесены в deal_messages_archive
+            results = await self.execute_query(query.format(table='deal_messages_archive'), params, pool=pool)
+        return [
+            {
+                'id': result[0],
+                'deal_id': result[1],
+                'user_id': result[2],
+                'message_type': result[3],
+                'message_text': result[4],
+                'file_id': result[5],
+                'created_at': result[6]
+            }
+            for result in results or []
+        ]
+    
+    # Deposit address methods
+    async def claim_deposit_address(self, deal_id: int, network: str) -> Optional[str]:
+        """Закрепление свободного депозитного адреса за сделкой
+
+        Адрес занимается одним UPDATE по индексу (network, deal_id), без
+        деривации ключей. None - свободных адресов нет.
+        """
+        query = """
+        UPDATE deposit_addresses SET deal_id = %s, claimed_at = %s
+        WHERE network = %s AND deal_id IS NULL
+        ORDER BY id LIMIT 1
+        """
+        if not await self.execute_query(query, (deal_id, datetime.now(), network)):
+            return None
+        return await self.get_deal_deposit_address(deal_id, network)
+    
+    async def get_deal_deposit_address(self, deal_id: int, network: str) -> Optional[str]:
+        """Депозитный адрес сделки"""
+        query = "SELECT address FROM deposit_addresses WHERE deal_id = %s AND network = %s"
+        result = await self.execute_fetchone(query, (deal_id, network))
+        return result[0] if result else None
+    
+    async def count_unused_deposit_addresses(self, network: str) -> int:
+        """Количество свободных депозитных адресов"""
+        query = "SELECT COUNT(*) FROM deposit_addresses WHERE network = %s AND deal_id IS NULL"
+        result = await self.execute_fetchone(query, (network,))
+        return result[0] if result else 0
+    
+    async def get_last_derivation_index(self, network: str) -> Optional[int]:
+        """Последний использованный индекс деривации"""
+        query = "SELECT MAX(derivation_index) FROM deposit_addresses WHERE network = %s"
+        result = await self.execute_fetchone(query, (network,))
+        return result[0] if result else None
+    
+    async def add_deposit_addresses(self, network: str, addresses: List[tuple]) -> int:
+        """Пакетное добавление адресов, каждый - кортеж (derivation_index, address)"""
+        if not addresses:
+            return 0
+        query = (
+            "INSERT INTO deposit_addresses (network, derivation_index, address) VALUES "
+            + ", ".join(["(%s, %s, %s)"] * len(addresses))
+        )
+        params = tuple(value for index, address in addresses for value in (network, index, address))
+        return await self.execute_query(query, params)
+    
+    # Payment cursor methods
+    async def get_payment_cursor(self, name: str) -> Optional[str]:
+        """Получение сохраненной позиции сканирования платежей"""
+        result = await self.execute_fetchone("SELECT cursor_value FROM payment_cursors WHERE name = %s", (name,))
+        return result[0] if result else None
+    
+    async def set_payment_cursor(self, name: str, cursor_value: str):
+        """Сохранение позиции сканирования платежей"""
+        query = "REPLACE INTO payment_cursors (name, cursor_value) VALUES (%s, %s)"
+        return await self.execute_query(query, (name, cursor_value))
+    
+    # Reputation methods
+    async def rate_deal(self, deal_id: int, rater_id: int, rated_id: int, score: int) -> bool:
+        """Оценка партнера по сделке (False - сделка уже оценена)
+
+        Рейтинг пересчитывается в той же транзакции из суммы и числа оценок.
+        """
+        async with self.transaction() as tx:
+            inserted = await tx.execute(
+                f"{self.INSERT_IGNORE} INTO deal_ratings (deal_id, rater_id, rated_id, score) VALUES (%s, %s, %s, %s)",
+                (deal_id, rater_id, rated_id, score)
+            )
+            if inserted != 1:
+                return False
+            
+            # rating вычисляется первым: MySQL применяет присваивания по порядку
+            await tx.execute("""
+            UPDATE users SET
+            rating = (ratings_sum + %s) * 1.0 / (ratings_count + 1),
+            ratings_sum = ratings_sum + %s,
+            ratings_count = ratings_count + 1
+            WHERE user_id = %s
+            """, (score, score, rated_id))
+        return True
+    
+    async def get_top_users(self, limit: int) -> List[Dict]:
+        """Пользователи с лучшим рейтингом (читается по индексу idx_leaderboard)"""
+        query = """
+        SELECT user_id, username, first_name, rating, successful_deals, deals_count, ratings_count
+        FROM users
+        WHERE is_banned = FALSE AND successful_deals > 0
+        ORDER BY rating DESC, successful_deals DESC
+        LIMIT %s
+        """
+        results = await self.execute_query(query, (limit,), pool=self.read_pool())
+        return [
+            {
+                'user_id': result[0],
+                'username': result[1],
+                'first_name': result[2],
+                'rating': result[3],
+                'successful_deals': result[4],
+                'deals_count': result[5],
+                'ratings_count': result[6]
+            }
+            for result in results or []
+        ]
+    
+    async def get_user_ids_page(self, after_id: int = 0, limit: int = 500) -> List[int]:
+        """Страница ID пользователей по возрастанию (keyset)"""
+        query = "SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s"
+        results = await self.execute_query(query, (after_id, limit))
+        return [result[0] for result in results or []]
+    
+    async def get_reputation_totals(self, user_ids: List[int]) -> Dict[int, Dict]:
+        """Значения счетчиков репутации, посчитанные по истории сделок и оценок"""
+        totals = {user_id: {'deals_count': 0, 'successful_deals': 0, 'ratings_count': 0, 'ratings_sum': 0}
+                  for user_id in user_ids}
+        if not user_ids:
+            return totals
+        
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        # Сделкой пользователя считается сделка, к которой присоединился партнер
+        deals_query = f"""
+        SELECT user_id, COUNT(*), SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END)
+        FROM (
+            SELECT creator_id AS user_id, status FROM deals
+            WHERE creator_id IN ({placeholders}) AND participant_id IS NOT NULL
+            UNION ALL
+            SELECT participant_id AS user_id, status FROM deals
+            WHERE participant_id IN ({placeholders})
+            UNION ALL
+            SELECT creator_id AS user_id, status FROM deals_archive
+            WHERE creator_id IN ({placeholders}) AND participant_id IS NOT NULL
+            UNION ALL
+            SELECT participant_id AS user_id, status FROM deals_archive
+            WHERE participant_id IN ({placeholders})
+        ) AS user_deals
+        GROUP BY user_id
+        """
+        for user_id, deals_count, successful_deals in await self.execute_query(deals_query, tuple(user_ids) * 4) or []:
+            totals[user_id]['deals_count'] = int(deals_count)
+            totals[user_id]['successful_deals'] = int(successful_deals or 0)
+        
+        ratings_query = f"""
+        SELECT rated_id, COUNT(*), SUM(score) FROM deal_ratings
+        WHERE rated_id IN ({placeholders})
+        GROUP BY rated_id
+        """
+        for user_id, ratings_count, ratings_sum in await self.execute_query(ratings_query, tuple(user_ids)) or []:
+            totals[user_id]['ratings_count'] = int(ratings_count)
+            totals[user_id]['ratings_sum'] = int(ratings_sum or 0)
+        
+        return totals
+    
+    async def set_reputation(self, totals: Dict[int, Dict]):
+        """Запись пересчитанных счетчиков репутации одной транзакцией"""
+        query = """
+        UPDATE users SET deals_count = %s, successful_deals = %s,
+        ratings_count = %s, ratings_sum = %s, rating = %s
+        WHERE user_id = %s
+        """
+        async with self.transaction() as tx:
+            for user_id, values in totals.items():
+                rating = (
+                    (Decimal(values['ratings_sum']) / values['ratings_count']).quantize(Decimal('0.01'))
+                    if values['ratings_count'] else Decimal('0.00')
+                )
+                await tx.execute(query, (
+                    values['deals_count'], values['successful_deals'],
+                    values['ratings_count'], values['ratings_sum'], rating, user_id
+                ))
+    
+    # Payment quote methods
+    async def lock_payment_quote(self, deal_id: int, payment_method: str, crypto_amount: Decimal, rate: Decimal):
+        """Фиксация суммы оплаты сделки в монете способа оплаты"""
+        query = """
+        REPLACE INTO deal_payment_quotes (deal_id, payment_method, crypto_amount, rate)
+        VALUES (%s, %s, %s, %s)
+        """
+        return await self.execute_query(query, (deal_id, payment_method, crypto_amount, rate))
+    
+    async def get_payment_quote(self, deal_id: int) -> Optional[Dict]:
+        """Зафиксированная сумма оплаты сделки"""
+        query = "SELECT payment_method, crypto_amount, rate, created_at FROM deal_payment_quotes WHERE deal_id = %s"
+        result = await self.execute_fetchone(query, (deal_id,))
+        if result:
+            return {
+                'payment_method': result[0],
+                'crypto_amount': Decimal(str(result[1])),
+                'rate': Decimal(str(result[2])),
+                'created_at': result[3]
+            }
+        return None
+    
     # Session methods
     async def set_user_session(self, user_id: int, action: str, data: Dict = None):
         """Установка пользовательской сессии"""
@@ -338,5 +1210,14 @@ class Database:
         query = "DELETE FROM user_sessions WHERE user_id = %s"
         return await self.execute_query(query, (user_id,))
 
+def create_database(backend: str = DATABASE_BACKEND) -> Database:
+    """Создание хранилища по имени бэкенда из конфигурации"""
+    if backend == 'mysql':
+        return Database()
+    if backend == 'sqlite':
+        from database_sqlite import SQLiteDatabase
+        return SQLiteDatabase()
+    raise ValueError(f"Unknown database backend: {backend}")
+
 # Создание глобального экземпляра базы данных
-db = Database()
\ No newline at end of file
+db = create_database()
\ No newline at end of file
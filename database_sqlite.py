@@ -0,0 +1,467 @@
+import aiosqlite
+import asyncio
+import json
+import logging
+import sqlite3
+from contextlib import asynccontextmanager
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any
+from config import SQLITE_PATH, EXPORT_FETCH_SIZE
+from database import Database, DEAL_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Приведение типов к тем же, что возвращает aiomysql
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()).quantize(Decimal('0.01')))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+# Локальное время, как у TIMESTAMP в MySQL
+SQLITE_NOW = "(datetime('now', 'localtime'))"
+
+class SQLiteTransaction:
+    """Выполнение запросов внутри транзакции SQLite"""
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self.conn = conn
+
+    async def execute(self, query: str, params: tuple = None) -> int:
+        cursor = await self.conn.execute(SQLiteDatabase._translate(query), params or ())
+        return cursor.rowcount
+
+class SQLiteDatabase(Database):
+    """Встраиваемое хранилище на SQLite (aiosqlite, режим WAL)
+
+    Схема и индексы повторяют MySQL. Соединение одно, поэтому запросы
+    сериализуются через блокировку, а WAL позволяет внешним читателям
+    работать параллельно с записью.
+    """
+
+    INSERT_IGNORE = "INSERT OR IGNORE"
+
+    # Индексы создаются в create_tables через IF NOT EXISTS
+    ADDED_INDEXES = []
+
+    # Токенизатор trigram не находит слова короче трех символов
+    SEARCH_MIN_TERM = 3
+
+    def __init__(self, path: str = SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self.conn = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        """Открытие соединения с файлом базы данных"""
+        try:
+            self.conn = await aiosqlite.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+            await self.conn.execute("PRAGMA journal_mode=WAL")
+            await self.conn.execute("PRAGMA synchronous=NORMAL")
+            await self.conn.execute("PRAGMA foreign_keys=ON")
+            logger.info(f"SQLite database opened: {self.path}")
+            await self.create_tables()
+        except Exception as e:
+            logger.error(f"Error opening SQLite database: {e}")
+            raise
+
+    async def close(self):
+        """Закрытие соединения"""
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+
+    @staticmethod
+    def _translate(query: str) -> str:
+        """Перевод плейсхолдеров MySQL в формат SQLite"""
+        return query.replace('%s', '?')
+
+    async def execute_query(self, query: str, params: tuple = None, pool=None) -> Optional[Any]:
+        """Выполнение SQL запроса"""
+        async with self.lock:
+            try:
+                cursor = await self.conn.execute(self._translate(query), params or ())
+                if query.strip().upper().startswith('SELECT'):
+                    return await cursor.fetchall()
+                else:
+                    await self.conn.commit()
+                    return cursor.rowcount
+            except Exception as e:
+                logger.error(f"Database query error: {e}")
+                await self.conn.rollback()
+                raise
+
+    async def execute_insert(self, query: str, params: tuple = None) -> Optional[int]:
+        """Выполнение INSERT с получением ID созданной записи"""
+        async with self.lock:
+            try:
+                cursor = await self.conn.execute(self._translate(query), params or ())
+                await self.conn.commit()
+                return cursor.lastrowid
+            except Exception as e:
+                logger.error(f"Database insert error: {e}")
+                await self.conn.rollback()
+                raise
+
+    async def execute_fetchone(self, query: str, params: tuple = None, pool=None) -> Optional[tuple]:
+        """Выполнение SQL запроса с получением одной записи"""
+        async with self.lock:
+            try:
+                cursor = await self.conn.execute(self._translate(query), params or ())
+                return await cursor.fetchone()
+            except Exception as e:
+                logger.error(f"Database fetchone error: {e}")
+                raise
+
+    async def stream_query(self, query: str, params: tuple = None, pool=None, batch_size: int = EXPORT_FETCH_SIZE):
+        """Чтение большого результата пакетами строк
+
+        Чтение идет через отдельное соединение: в режиме WAL оно не блокирует
+        основное и не держит общую блокировку на время выгрузки.
+        """
+        async with aiosqlite.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
+            try:
+                async with conn.execute(self._translate(query), params or ()) as cursor:
+                    while True:
+                        rows = await cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        yield rows
+            except Exception as e:
+                logger.error(f"Database stream error: {e}")
+                raise
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Несколько запросов в одной транзакции"""
+        async with self.lock:
+            try:
+                yield SQLiteTransaction(self.conn)
+                await self.conn.commit()
+            except Exception as e:
+                logger.error(f"Database transaction error: {e}")
+                await self.conn.rollback()
+                raise
+
+    async def _column_exists(self, table: str, column: str) -> bool:
+        rows = await self.execute_query(f"SELECT name FROM pragma_table_info('{table}')")
+        return any(row[0] == column for row in rows or [])
+
+    async def create_tables(self):
+        """Создание таблиц в базе данных"""
+        fts_exists = await self.execute_fetchone("SELECT name FROM sqlite_master WHERE name = 'deals_fts'")
+        tables = [
+            f"""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username VARCHAR(255),
+                first_name VARCHAR(255),
+                last_name VARCHAR(255),
+                is_verified BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                updated_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                deals_count INT DEFAULT 0,
+                successful_deals INT DEFAULT 0,
+                rating DECIMAL(3,2) DEFAULT 0.00,
+                is_banned BOOLEAN DEFAULT FALSE,
+                ratings_count INT DEFAULT 0,
+                ratings_sum INT DEFAULT 0
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_leaderboard ON users (is_banned, rating, successful_deals)",
+            f"""
+            CREATE TABLE IF NOT EXISTS captcha_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id BIGINT NOT NULL,
+                captcha_type VARCHAR(50) NOT NULL,
+                correct_answer VARCHAR(255) NOT NULL,
+                attempts INT DEFAULT 0,
+                is_solved BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                expires_at TIMESTAMP NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_captcha_user_id ON captcha_sessions (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_captcha_expires_at ON captcha_sessions (expires_at)",
+            f"""
+            CREATE TABLE IF NOT EXISTS deals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                deal_code VARCHAR(10) UNIQUE NOT NULL,
+                creator_id BIGINT NOT NULL,
+                participant_id BIGINT,
+                creator_role TEXT NOT NULL CHECK (creator_role IN ('buyer', 'seller')),
+                amount_usd DECIMAL(10,2) NOT NULL,
+                deal_conditions TEXT NOT NULL,
+                deal_password VARCHAR(255) NOT NULL,
+                status TEXT DEFAULT 'created' CHECK (status IN ('created', 'joined', 'payment_pending', 'completed', 'cancelled', 'disputed')),
+                payment_method TEXT CHECK (payment_method IN ('TRC20', 'TON')),
+                payment_proof TEXT,
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                updated_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                completed_at TIMESTAMP NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_creator_id ON deals (creator_id)",
+            "CREATE INDEX IF NOT EXISTS idx_participant_id ON deals (participant_id)",
+            "CREATE INDEX IF NOT EXISTS idx_deal_code ON deals (deal_code)",
+            "CREATE INDEX IF NOT EXISTS idx_status ON deals (status)",
+            "CREATE INDEX IF NOT EXISTS idx_created_at ON deals (created_at)",
+            f"""
+            CREATE TABLE IF NOT EXISTS deal_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                deal_id INT NOT NULL REFERENCES deals(id) ON DELETE CASCADE,
+                user_id BIGINT NOT NULL,
+                message_type TEXT NOT NULL CHECK (message_type IN ('system', 'user', 'payment_proof')),
+                message_text TEXT,
+                file_id VARCHAR(255),
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW}
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_messages_deal_id ON deal_messages (deal_id)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON deal_messages (user_id)",
+            f"""
+            CREATE TABLE IF NOT EXISTS deals_archive (
+                id INTEGER PRIMARY KEY,
+                deal_code VARCHAR(10) UNIQUE NOT NULL,
+                creator_id BIGINT NOT NULL,
+                participant_id BIGINT,
+                creator_role TEXT NOT NULL,
+                amount_usd DECIMAL(10,2) NOT NULL,
+                deal_conditions TEXT NOT NULL,
+                deal_password VARCHAR(255) NOT NULL,
+                status TEXT NOT NULL CHECK (status IN ('completed', 'cancelled')),
+                payment_method TEXT,
+                payment_proof TEXT,
+                created_at TIMESTAMP NULL,
+                updated_at TIMESTAMP NULL,
+                completed_at TIMESTAMP NULL,
+                expires_at TIMESTAMP NULL,
+                archived_at TIMESTAMP DEFAULT {SQLITE_NOW}
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_archive_creator_id ON deals_archive (creator_id)",
+            "CREATE INDEX IF NOT EXISTS idx_archive_participant_id ON deals_archive (participant_id)",
+            "CREATE INDEX IF NOT EXISTS idx_archive_created_at ON deals_archive (created_at)",
+            """
+            CREATE TABLE IF NOT EXISTS deal_messages_archive (
+                id INTEGER PRIMARY KEY,
+                deal_id INT NOT NULL,
+                user_id BIGINT NOT NULL,
+                message_type TEXT NOT NULL,
+                message_text TEXT,
+                file_id VARCHAR(255),
+                created_at TIMESTAMP NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_messages_archive_deal_id ON deal_messages_archive (deal_id, id)",
+            f"""
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                user_id INTEGER PRIMARY KEY,
+                current_action VARCHAR(100),
+                session_data TEXT,
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                updated_at TIMESTAMP DEFAULT {SQLITE_NOW}
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON user_sessions (updated_at)",
+            f"""
+            CREATE TABLE IF NOT EXISTS deposit_addresses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                network TEXT NOT NULL CHECK (network IN ('TRC20', 'TON')),
+                derivation_index INT NOT NULL,
+                address VARCHAR(128) NOT NULL UNIQUE,
+                deal_id INT NULL,
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                claimed_at TIMESTAMP NULL,
+                UNIQUE (network, derivation_index)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_deposit_network_deal ON deposit_addresses (network, deal_id)",
+            "CREATE INDEX IF NOT EXISTS idx_deposit_deal_id ON deposit_addresses (deal_id)",
+            f"""
+            CREATE TABLE IF NOT EXISTS payment_cursors (
+                name VARCHAR(50) PRIMARY KEY,
+                cursor_value VARCHAR(255),
+                updated_at TIMESTAMP DEFAULT {SQLITE_NOW}
+            )
+            """,
+            # Суммы в монете хранятся текстом: конвертер DECIMAL округляет до центов
+            f"""
+            CREATE TABLE IF NOT EXISTS deal_payment_quotes (
+                deal_id INTEGER PRIMARY KEY,
+                payment_method TEXT NOT NULL CHECK (payment_method IN ('TRC20', 'TON')),
+                crypto_amount TEXT NOT NULL,
+                rate TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW}
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS deal_ratings (
+                deal_id INT NOT NULL,
+                rater_id INTEGER NOT NULL,
+                rated_id INTEGER NOT NULL,
+                score INT NOT NULL CHECK (score BETWEEN 1 AND 5),
+                created_at TIMESTAMP DEFAULT {SQLITE_NOW},
+                PRIMARY KEY (deal_id, rater_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_deal_ratings_rated_id ON deal_ratings (rated_id)"
+        ]
+
+        # Аналог ON UPDATE CURRENT_TIMESTAMP. Замена хеша пароля, как и в MySQL
+        # (updated_at = updated_at), не меняет updated_at: от него зависит версия сделки
+        deal_columns = [column for column in DEAL_COLUMNS.split(', ') if column not in ('deal_password', 'updated_at')]
+        tables.append("DROP TRIGGER IF EXISTS trg_deals_updated_at")
+        for table, key, columns in (
+            ('users', 'user_id', ''),
+            ('deals', 'id', f" OF {', '.join(deal_columns)}"),
+            ('user_sessions', 'user_id', '')
+        ):
+            tables.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at
+            AFTER UPDATE{columns} ON {table} FOR EACH ROW
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE {table} SET updated_at = {SQLITE_NOW} WHERE {key} = NEW.{key};
+            END
+            """)
+
+        # Полнотекстовый индекс условий сделок (аналог FULLTEXT ... WITH PARSER ngram)
+        tables.extend([
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS deals_fts USING fts5(
+                deal_conditions, content='deals', content_rowid='id', tokenize='trigram'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_deals_fts_insert AFTER INSERT ON deals BEGIN
+                INSERT INTO deals_fts (rowid, deal_conditions) VALUES (NEW.id, NEW.deal_conditions);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_deals_fts_delete AFTER DELETE ON deals BEGIN
+                INSERT INTO deals_fts (deals_fts, rowid, deal_conditions) VALUES ('delete', OLD.id, OLD.deal_conditions);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS trg_deals_fts_update AFTER UPDATE OF deal_conditions ON deals BEGIN
+                INSERT INTO deals_fts (deals_fts, rowid, deal_conditions) VALUES ('delete', OLD.id, OLD.deal_conditions);
+                INSERT INTO deals_fts (rowid, deal_conditions) VALUES (NEW.id, NEW.deal_conditions);
+            END
+            """
+        ])
+
+        for table_sql in tables:
+            try:
+                await self.execute_query(table_sql)
+            except Exception as e:
+                logger.error(f"Error creating table: {e}")
+                raise
+        await self.upgrade_schema()
+        if not fts_exists:
+            # Индекс появился в существующей базе: заполняем его из deals
+            await self.execute_query("INSERT INTO deals_fts (deals_fts) VALUES ('rebuild')")
+        logger.info("SQLite tables created successfully")
+
+    async def _search_user_deals(self, terms, user_id: int, limit: int, offset: int):
+        """Поиск среди сделок пользователя: LIKE в SQLite не учитывает регистр кириллицы"""
+        match = ' '.join(f'"{term}"' for term in terms)
+        query = """
+        SELECT d.id, d.deal_code, d.status, d.amount_usd, d.created_at
+        FROM deals_fts JOIN deals d ON d.id = deals_fts.rowid
+        WHERE deals_fts MATCH %s AND (d.creator_id = %s OR d.participant_id = %s)
+        ORDER BY d.created_at DESC, d.id DESC
+        LIMIT %s OFFSET %s
+        """
+        results = await self.execute_query(query, (match, user_id, user_id, limit, offset))
+        return [self._search_result(result) for result in results or []]
+
+    async def _search_all_deals(self, terms, limit: int, offset: int):
+        """Поиск по таблице deals_fts (FTS5, trigram)"""
+        match = ' '.join(f'"{term}"' for term in terms)
+        query = """
+        SELECT d.id, d.deal_code, d.status, d.amount_usd, d.created_at
+        FROM deals_fts JOIN deals d ON d.id = deals_fts.rowid
+        WHERE deals_fts MATCH %s
+        ORDER BY bm25(deals_fts), d.id DESC
+        LIMIT %s OFFSET %s
+        """
+        results = await self.execute_query(query, (match, limit, offset))
+        return [self._search_result(result) for result in results or []]
+
+    # User methods
+    async def create_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        """Создание нового пользователя"""
+        query = """
+        INSERT INTO users (user_id, username, first_name, last_name)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name
+        """
+        return await self.execute_query(query, (user_id, username, first_name, last_name))
+
+    # Captcha methods
+    async def get_captcha_session(self, user_id: int) -> Optional[Dict]:
+        """Получение активной сессии капчи"""
+        query = f"""
+        SELECT * FROM captcha_sessions
+        WHERE user_id = %s AND is_solved = FALSE AND expires_at > {SQLITE_NOW}
+        ORDER BY created_at DESC, id DESC LIMIT 1
+        """
+        result = await self.execute_fetchone(query, (user_id,), pool=self.read_pool())
+        if result:
+            return {
+                'id': result[0],
+                'user_id': result[1],
+                'captcha_type': result[2],
+                'correct_answer': result[3],
+                'attempts': result[4],
+                'is_solved': result[5],
+                'created_at': result[6],
+                'expires_at': result[7]
+            }
+        return None
+
+    # Deposit address methods
+    async def claim_deposit_address(self, deal_id: int, network: str) -> Optional[str]:
+        """Закрепление свободного депозитного адреса за сделкой"""
+        # SQLite без SQLITE_ENABLE_UPDATE_DELETE_LIMIT не поддерживает UPDATE ... LIMIT
+        query = """
+        UPDATE deposit_addresses SET deal_id = %s, claimed_at = %s
+        WHERE id = (
+            SELECT id FROM deposit_addresses
+            WHERE network = %s AND deal_id IS NULL
+            ORDER BY id LIMIT 1
+        )
+        """
+        if not await self.execute_query(query, (deal_id, datetime.now(), network)):
+            return None
+        return await self.get_deal_deposit_address(deal_id, network)
+
+    # Retention methods
+    async def purge_batch(self, table: str, age_column: str, cutoff: datetime, limit: int,
+                          keep: Optional[str] = None) -> int:
+        """Удаление пакета устаревших строк (DELETE ... LIMIT через rowid)"""
+        query = f"""
+        DELETE FROM {table} WHERE rowid IN (
+            SELECT rowid FROM {table} WHERE {self._retention_condition(age_column, keep)} LIMIT %s
+        )
+        """
+        return await self.execute_query(query, (cutoff, limit))
+
+    # Session methods
+    async def set_user_session(self, user_id: int, action: str, data: Dict = None):
+        """Установка пользовательской сессии"""
+        query = """
+        INSERT INTO user_sessions (user_id, current_action, session_data)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET
+        current_action = excluded.current_action,
+        session_data = excluded.session_data
+        """
+        session_data = json.dumps(data) if data else None
+        return await self.execute_query(query, (user_id, action, session_data))
@@ -0,0 +1,223 @@
+import aiomysql
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+from config import (
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_ACQUIRE_TIMEOUT, DB_POOL_GROW_WAIT,
+    DB_POOL_ADJUST_INTERVAL, DB_POOL_RECYCLE, DB_HEALTH_CHECK_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+class DatabaseBusyError(Exception):
+    """Не удалось получить соединение за отведенное время"""
+
+async def wait_or_undo(coro, timeout: float, undo):
+    """Ожидание с таймаутом, которое не теряет результат, полученный в последний момент
+
+    На Python 3.11 wait_for может сообщить о таймауте, когда операция уже
+    завершилась, или проглотить отмену, и занятый ресурс остался бы занятым.
+    Операция идет в отдельной задаче; если ее перестали ждать (таймаут или
+    отмена), а она все же завершилась, результат передается в undo.
+    """
+    task = asyncio.ensure_future(coro)
+
+    def undo_if_done(done: asyncio.Task):
+        if not done.cancelled() and done.exception() is None:
+            undo(done.result())
+
+    def abandon():
+        task.cancel()
+        task.add_done_callback(undo_if_done)
+
+    try:
+        finished, _ = await asyncio.wait({task}, timeout=timeout)
+    except BaseException:
+        abandon()
+        raise
+    if not finished:
+        abandon()
+        raise asyncio.TimeoutError()
+    return task.result()
+
+class AdaptivePool:
+    """Пул соединений с адаптивным лимитом и таймаутом получения
+
+    Лимит одновременно выданных соединений растет, пока запросы ждут
+    дольше DB_POOL_GROW_WAIT, и постепенно снижается при простое. Ожидание
+    соединения ограничено DB_ACQUIRE_TIMEOUT: вместо бесконечной очереди
+    вызывающий получает DatabaseBusyError.
+    """
+
+    def __init__(self, pool: aiomysql.Pool, name: str = 'primary',
+                 min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 acquire_timeout: float = DB_ACQUIRE_TIMEOUT):
+        self.pool = pool
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.limit = min_size
+
+        self._cond = asyncio.Condition()
+        self._in_use = 0
+        self._waiting = 0
+        self._peak_in_use = 0
+        self._window_waits = 0
+        self._window_wait_time = 0.0
+        self._last_health_check = time.monotonic()
+        self._maintenance = asyncio.create_task(self._maintain())
+
+        self.stats = {
+            'acquires': 0,
+            'timeouts': 0,
+            'grows': 0,
+            'shrinks': 0,
+            'health_check_failures': 0,
+            'max_wait_ms': 0.0,
+            'total_wait_ms': 0.0
+        }
+
+    @classmethod
+    async def create(cls, name: str = 'primary', **config) -> 'AdaptivePool':
+        """Создание пула aiomysql и обертки над ним"""
+        pool = await aiomysql.create_pool(
+            minsize=DB_POOL_MIN_SIZE,
+            maxsize=DB_POOL_MAX_SIZE,
+            pool_recycle=DB_POOL_RECYCLE,
+            **config
+        )
+        return cls(pool, name)
+
+    async def _reserve(self):
+        async with self._cond:
+            self._waiting += 1
+            try:
+                await self._cond.wait_for(lambda: self._in_use < self.limit)
+            finally:
+                self._waiting -= 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+    async def _unreserve(self):
+        async with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Получение соединения с таймаутом"""
+        started = time.monotonic()
+        try:
+            await wait_or_undo(
+                self._reserve(), self.acquire_timeout, lambda _: asyncio.ensure_future(self._unreserve())
+            )
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            logger.warning(f"Pool '{self.name}' acquire timeout: {self.get_stats()}")
+            raise DatabaseBusyError(f"Pool '{self.name}' is saturated ({self._in_use}/{self.limit})")
+
+        try:
+            remaining = max(self.acquire_timeout - (time.monotonic() - started), 0.001)
+            try:
+                conn = await wait_or_undo(
+                    self.pool.acquire(), remaining, lambda conn: asyncio.ensure_future(self.pool.release(conn))
+                )
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                raise DatabaseBusyError(f"Pool '{self.name}' could not open a connection in time")
+
+            wait = time.monotonic() - started
+            self._window_waits += 1
+            self._window_wait_time += wait
+            self.stats['acquires'] += 1
+            self.stats['total_wait_ms'] += wait * 1000
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait * 1000)
+
+            try:
+                yield conn
+            finally:
+                await self.pool.release(conn)
+        finally:
+            await self._unreserve()
+
+    async def _adjust(self):
+        """Изменение лимита по среднему ожиданию за прошедший интервал"""
+        avg_wait = self._window_wait_time / self._window_waits if self._window_waits else 0.0
+        peak = self._peak_in_use
+        self._window_waits = 0
+        self._window_wait_time = 0.0
+        self._peak_in_use = self._in_use
+
+        if (avg_wait > DB_POOL_GROW_WAIT or self._waiting) and self.limit < self.max_size:
+            # Растем быстро, чтобы пережить всплеск нагрузки
+            self.limit = min(self.max_size, math.ceil(self.limit * 1.5))
+            self.stats['grows'] += 1
+            logger.info(f"Pool '{self.name}' limit grown to {self.limit} (avg wait {avg_wait * 1000:.1f} ms)")
+            async with self._cond:
+                self._cond.notify_all()
+        elif peak < self.limit // 2 and self.limit > self.min_size:
+            # Снижаемся плавно и закрываем простаивающие соединения
+            self.limit -= 1
+            self.stats['shrinks'] += 1
+            await self._close_excess_free()
+
+    async def _close_excess_free(self):
+        """Закрытие простаивающих соединений сверх лимита (остальные остаются в пуле)"""
+        # Pool.clear() закрыл бы все свободные соединения, поэтому лишние
+        # берутся из пула по одному и возвращаются закрытыми: закрытое
+        # соединение release() не кладет обратно в очередь свободных
+        for _ in range(self.pool.freesize - self.limit):
+            if self.pool.freesize <= self.limit:
+                break
+            conn = await self.pool.acquire()
+            conn.close()
+            await self.pool.release(conn)
+
+    async def _health_check(self):
+        """Проверка соединения ping-запросом"""
+        try:
+            async with self.acquire() as conn:
+                await conn.ping(reconnect=True)
+        except Exception as e:
+            self.stats['health_check_failures'] += 1
+            logger.warning(f"Pool '{self.name}' health check failed: {e}")
+
+    async def _maintain(self):
+        """Фоновая подстройка размера и проверки здоровья"""
+        while True:
+            await asyncio.sleep(DB_POOL_ADJUST_INTERVAL)
+            try:
+                await self._adjust()
+                if time.monotonic() - self._last_health_check >= DB_HEALTH_CHECK_INTERVAL:
+                    self._last_health_check = time.monotonic()
+                    await self._health_check()
+            except Exception as e:
+                logger.error(f"Pool '{self.name}' maintenance error: {e}")
+
+    def get_stats(self) -> Dict:
+        """Статистика насыщения пула"""
+        acquires = self.stats['acquires']
+        return {
+            **self.stats,
+            'name': self.name,
+            'limit': self.limit,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'in_use': self._in_use,
+            'waiting': self._waiting,
+            'connections': self.pool.size,
+            'free_connections': self.pool.freesize,
+            'saturation': self._in_use / self.limit if self.limit else 0.0,
+            'avg_wait_ms': self.stats['total_wait_ms'] / acquires if acquires else 0.0
+        }
+
+    def close(self):
+        self._maintenance.cancel()
+        self.pool.close()
+
+    async def wait_closed(self):
+        await self.pool.wait_closed()
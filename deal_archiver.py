@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from database import db
+from config import DEAL_ARCHIVE_AFTER_DAYS, DEAL_ARCHIVE_BATCH, DEAL_ARCHIVE_PAUSE, DEAL_ARCHIVE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class DealArchiver:
+    """Перенос завершенных сделок в deals_archive
+
+    Раз в DEAL_ARCHIVE_INTERVAL секунд сделки со статусом completed или
+    cancelled, не менявшиеся дольше DEAL_ARCHIVE_AFTER_DAYS дней, переносятся
+    в архив вместе с сообщениями пакетами по DEAL_ARCHIVE_BATCH с паузой
+    между пакетами. Чтение сделок по коду, ID и список сделок пользователя
+    прозрачно ищут и в архиве.
+    """
+
+    def __init__(self, after_days: int = DEAL_ARCHIVE_AFTER_DAYS, batch_size: int = DEAL_ARCHIVE_BATCH):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'runs': 0, 'batches': 0, 'archived': 0, 'errors': 0, 'last_run_ms': 0.0}
+
+    async def run_once(self) -> int:
+        """Один проход архивации, возвращает число перенесенных сделок"""
+        started = time.perf_counter()
+        finished_before = datetime.now() - timedelta(days=self.after_days)
+        archived = 0
+
+        while True:
+            moved = await db.archive_deals_batch(finished_before, self.batch_size)
+            if not moved:
+                break
+            archived += moved
+            self.stats['batches'] += 1
+            self.stats['archived'] += moved
+            if moved < self.batch_size:
+                break
+            # Пауза дает место обычным запросам между пакетами
+            await asyncio.sleep(DEAL_ARCHIVE_PAUSE)
+
+        self.stats['runs'] += 1
+        self.stats['last_run_ms'] = (time.perf_counter() - started) * 1000
+        if archived:
+            logger.info(f"Archived {archived} deals in {self.stats['last_run_ms']:.0f} ms")
+        return archived
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Deal archiving error: {e}")
+            await asyncio.sleep(DEAL_ARCHIVE_INTERVAL)
+
+    def start(self):
+        """Запуск фоновой архивации"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats)
+
+# Создание глобального экземпляра архиватора сделок
+deal_archiver = DealArchiver()
@@ -0,0 +1,218 @@
+"""Кэш сделок для присоединения по ссылке
+
+Ссылка на сделку, опубликованная в большом канале, приводит к десяткам
+переходов по одному коду за секунды, и каждый переход (а также каждый
+неверный пароль) читал всю строку сделки. Кэш отдает сделку по коду и по ID
+из памяти; параллельные промахи по одному ключу ждут один общий запрос.
+
+Нагрузочный замер: число запросов к БД в секунду с кэшем и без него при
+росте числа одновременно присоединяющихся:
+
+    python deal_cache.py bench --joiners 10 100 1000
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from database import db
+from config import DEAL_CACHE_TTL, DEAL_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+class DealCache:
+    """Кэш сделок по коду и ID с общим запросом при одновременных промахах
+
+    Сделка (и отсутствие сделки с таким кодом) хранится DEAL_CACHE_TTL
+    секунд. Database сообщает о каждом изменении сделки (создание, переход
+    статуса, смена пароля или способа оплаты, перенос в архив), и обе записи
+    сделки сразу удаляются. Загрузка, начатая до изменения, свой результат в
+    кэш не кладет, а новые промахи после изменения ждут уже новый запрос.
+
+    Промахи читаются с основного сервера: реплика может отставать на
+    REPLICA_MAX_LAG и вернуть строку до сброса, которая пролежала бы в кэше
+    весь TTL. Изменения из других процессов видны не позже чем через
+    DEAL_CACHE_TTL: кэш используется только для показа сделки, а переходы
+    статуса в БД проверяют текущий статус сами.
+    """
+
+    def __init__(self, ttl: float = DEAL_CACHE_TTL, max_size: int = DEAL_CACHE_SIZE, database=db):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.db = database
+        # ключ ('id', ID) или ('code', код) -> (срок действия, сделка или None)
+        self.entries: OrderedDict = OrderedDict()
+        # ID -> код закэшированной сделки: записи по ID и по коду вытесняются
+        # независимо, а сброс по одному ID должен найти и запись по коду
+        self.codes: Dict[int, str] = {}
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        # Номер изменения, после которого ключ был сброшен, - для загрузок в процессе
+        self.generation = 0
+        self.invalidated: Dict[tuple, int] = {}
+        self._loading = 0
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0, 'loads': 0, 'invalidations': 0,
+                      'stale_dropped': 0, 'evicted': 0}
+        database.deal_listeners.append(self.invalidate)
+
+    async def get_by_code(self, deal_code: str) -> Optional[Dict]:
+        """Сделка по коду (копия) или None"""
+        return await self._get(('code', deal_code), self._load_by_code, deal_code)
+
+    async def get_by_id(self, deal_id: int) -> Optional[Dict]:
+        """Сделка по ID (копия) или None"""
+        return await self._get(('id', deal_id), self._load_by_id, deal_id)
+
+    async def _load_by_code(self, deal_code: str) -> Optional[Dict]:
+        return await self.db.get_deal_by_code(deal_code, primary=True)
+
+    async def _load_by_id(self, deal_id: int) -> Optional[Dict]:
+        return await self.db.get_deal_by_id(deal_id, primary=True)
+
+    async def _get(self, key: tuple, loader, value) -> Optional[Dict]:
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            deal = entry[1]
+        else:
+            self.stats['misses'] += 1
+            task = self._inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._load(key, loader, value))
+                task.add_done_callback(lambda done: self._load_done(key, done))
+                self._inflight[key] = task
+            else:
+                self.stats['shared'] += 1
+            # Отмена одного ожидающего не отменяет общий запрос
+            deal = await asyncio.shield(task)
+        return dict(deal) if deal else None
+
+    async def _load(self, key: tuple, loader, value) -> Optional[Dict]:
+        generation = self.generation
+        self._loading += 1
+        self.stats['loads'] += 1
+        try:
+            deal = await loader(value)
+            keys = [('id', deal['id']), ('code', deal['deal_code'])] if deal else [key]
+            if any(self.invalidated.get(k, -1) > generation for k in keys):
+                # Сделка изменилась во время запроса: результат отдается ждущим, но не кэшируется
+                self.stats['stale_dropped'] += 1
+            else:
+                expires = time.monotonic() + self.ttl
+                for k in keys:
+                    self.entries[k] = (expires, deal)
+                    self.entries.move_to_end(k)
+                if deal:
+                    self.codes[deal['id']] = deal['deal_code']
+                self._evict()
+            return deal
+        finally:
+            self._loading -= 1
+            if not self._loading:
+                self.invalidated.clear()
+
+    def _load_done(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибка доставлена ждущим; если все они отменены, не пишем ее в лог как необработанную
+        if not task.cancelled():
+            task.exception()
+
+    def _evict(self):
+        while len(self.entries) > self.max_size:
+            key, (_, deal) = self.entries.popitem(last=False)
+            if key[0] == 'code' and deal:
+                self.codes.pop(deal['id'], None)
+            self.stats['evicted'] += 1
+
+    def invalidate(self, deal_id: int, deal_code: Optional[str] = None):
+        """Сброс сделки после ее изменения"""
+        self.stats['invalidations'] += 1
+        cached_code = self.codes.pop(deal_id, None)
+        if deal_code is None:
+            deal_code = cached_code
+
+        self.generation += 1
+        keys = [('id', deal_id)]
+        if deal_code is not None:
+            keys.append(('code', deal_code))
+        for key in keys:
+            self.entries.pop(key, None)
+            # Новые промахи по ключам сделки ждут уже новый запрос; загрузки
+            # других сделок продолжают обслуживать своих ждущих
+            self._inflight.pop(key, None)
+            if self._loading:
+                self.invalidated[key] = self.generation
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['size'] = len(self.entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+# Создание глобального экземпляра кэша сделок
+deal_cache = DealCache()
+
+class _CountingDatabase:
+    """Заглушка БД для замера: одна сделка, задержка запроса и счетчик"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.queries = 0
+        self.deal_listeners = []
+        self.deal = {'id': 1, 'deal_code': 'BENCH001', 'status': 'created', 'deal_password': 'hash'}
+
+    async def get_deal_by_code(self, deal_code: str, primary: bool = False) -> Optional[Dict]:
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+        return dict(self.deal) if deal_code == self.deal['deal_code'] else None
+
+    async def get_deal_by_id(self, deal_id: int, primary: bool = False) -> Optional[Dict]:
+        self.queries += 1
+        await asyncio.sleep(self.latency)
+        return dict(self.deal) if deal_id == self.deal['id'] else None
+
+async def _burst(joiners: int, window: float, retries: int, latency: float, ttl: float, cached: bool) -> int:
+    """Присоединяющиеся приходят равномерно за window секунд: карточка сделки
+    и retries повторов после неверного пароля. Результат - число запросов к БД."""
+    database = _CountingDatabase(latency)
+    cache = DealCache(ttl=ttl, database=database)
+    get_deal = cache.get_by_code if cached else database.get_deal_by_code
+
+    async def joiner():
+        await asyncio.sleep(random.uniform(0, window))
+        await get_deal('BENCH001')
+        for _ in range(retries):
+            await asyncio.sleep(random.uniform(0.05, 0.2))
+            await get_deal('BENCH001')
+
+    await asyncio.gather(*(joiner() for _ in range(joiners)))
+    return database.queries
+
+async def bench(args):
+    random.seed(0)
+    print(f"Окно {args.window} с, повторов пароля {args.retries}, задержка БД {args.latency * 1000:.0f} мс, TTL {args.ttl} с")
+    print(f"{'joiners':>8} {'без кэша, запр/с':>18} {'с кэшем, запр/с':>17}")
+    for joiners in args.joiners:
+        direct = await _burst(joiners, args.window, args.retries, args.latency, args.ttl, cached=False)
+        cached = await _burst(joiners, args.window, args.retries, args.latency, args.ttl, cached=True)
+        print(f"{joiners:>8} {direct / args.window:>18.1f} {cached / args.window:>17.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Кэш сделок")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('bench', help="запросы к БД при наплыве присоединяющихся")
+    bench_parser.add_argument('--joiners', type=int, nargs='+', default=[10, 100, 1000])
+    bench_parser.add_argument('--window', type=float, default=2.0, help="за сколько секунд приходят все, с")
+    bench_parser.add_argument('--retries', type=int, default=2, help="повторов после неверного пароля")
+    bench_parser.add_argument('--latency', type=float, default=0.005, help="задержка запроса к БД, с")
+    bench_parser.add_argument('--ttl', type=float, default=DEAL_CACHE_TTL, help="время жизни записи кэша, с")
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+if __name__ == '__main__':
+    main()
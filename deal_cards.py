@@ -0,0 +1,103 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from aiogram.types import InlineKeyboardMarkup
+from database import db
+from keyboards import keyboards
+from utils import utils
+from config import ADMIN_IDS, DEAL_CARD_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+class DealCards:
+    """Карточки сделок (текст и кнопки) с кэшем готовой отрисовки
+
+    Карточка хранится по ключу (ID сделки, версия, роль зрителя). Версия -
+    updated_at вместе со статусом, участником, способом оплаты и признаком
+    архива: updated_at хранится с точностью до секунды и сам по себе не
+    различает две правки в одну секунду, а перенос в архив его не меняет.
+    Повторный показ и «Обновить статус» для неизменной сделки стоят одного
+    запроса версии по первичному ключу; полная строка читается и
+    отрисовывается заново, только когда версия изменилась. Старые версии
+    вытесняются по LRU.
+    """
+
+    def __init__(self, max_size: int = DEAL_CARD_CACHE_SIZE, database=db):
+        self.max_size = max_size
+        self.db = database
+        self.cards: OrderedDict = OrderedDict()
+        self.stats = {'views': 0, 'hits': 0, 'renders': 0, 'evicted': 0, 'render_ms': 0.0}
+
+    @staticmethod
+    def version(deal: Dict) -> tuple:
+        return deal['updated_at'], deal['status'], deal['payment_method'], deal['participant_id'], deal['archived']
+
+    @staticmethod
+    def viewer_role(deal: Dict, user_id: int) -> Optional[str]:
+        """Роль зрителя в сделке; None - сделка ему недоступна"""
+        if deal['creator_id'] == user_id:
+            return 'creator'
+        if deal['participant_id'] == user_id:
+            return 'participant'
+        if user_id in ADMIN_IDS:
+            return 'admin'
+        return None
+
+    @staticmethod
+    def render(deal: Dict, role: str, user_id: int) -> Tuple[str, InlineKeyboardMarkup]:
+        """Текст и кнопки карточки"""
+        text = utils.format_deal_info(deal, user_id)
+        if deal['archived']:
+            text += "\n🗄 Сделка в архиве."
+        if role == 'admin':
+            text += f"\n🛡 Просмотр администратором\n👤 Создатель: {deal['creator_id']}, участник: {deal['participant_id'] or '—'}"
+
+        # Завершенные, отмененные и архивные сделки показываются без действий
+        if deal['archived'] or deal['status'] in ('completed', 'cancelled'):
+            return text, None
+        return text, keyboards.get_deal_actions(deal['id'], deal['status'], role)
+
+    async def get(self, deal_id: int, user_id: int) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+        """Карточка сделки для пользователя; None - сделки нет или она ему недоступна"""
+        self.stats['views'] += 1
+        version = await self.db.get_deal_version(deal_id)
+        if not version:
+            return None
+        role = self.viewer_role(version, user_id)
+        if not role:
+            return None
+
+        key = (deal_id, self.version(version), role)
+        card = self.cards.get(key)
+        if card:
+            self.cards.move_to_end(key)
+            self.stats['hits'] += 1
+            return card
+
+        started = time.perf_counter()
+        deal = await self.db.get_deal_by_id(deal_id)
+        if not deal:
+            return None
+        card = self.render(deal, role, user_id)
+        self.stats['renders'] += 1
+        self.stats['render_ms'] += (time.perf_counter() - started) * 1000
+
+        # Ключ по версии из строки, которую отрисовали: если сделка изменилась
+        # между двумя запросами, следующий показ увидит новую версию
+        key = (deal_id, self.version(deal), role)
+        self.cards[key] = card
+        if len(self.cards) > self.max_size:
+            self.cards.popitem(last=False)
+            self.stats['evicted'] += 1
+        return card
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['size'] = len(self.cards)
+        stats['hit_rate'] = stats['hits'] / stats['views'] if stats['views'] else 0.0
+        stats['avg_render_ms'] = stats['render_ms'] / stats['renders'] if stats['renders'] else 0.0
+        return stats
+
+# Создание глобального экземпляра карточек сделок
+deal_cards = DealCards()
@@ -0,0 +1,190 @@
+import aiomysql
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional
+from database import db
+from db_pool import DatabaseBusyError
+from config import (
+    DEAL_CHAT_FLUSH_INTERVAL_MS, DEAL_CHAT_FLUSH_SIZE, DEAL_CHAT_MAX_PENDING,
+    DEAL_CHAT_RETRY_BACKOFF, DEAL_CHAT_RETRY_BACKOFF_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запись стоит повторить целиком: база недоступна или занята.
+# Остальные (нарушение внешнего ключа, неверные данные) относятся к конкретной строке
+TRANSIENT_ERRORS = (
+    DatabaseBusyError, aiomysql.OperationalError, aiomysql.InterfaceError,
+    sqlite3.OperationalError, OSError, asyncio.TimeoutError
+)
+
+class DealMessageBuffer:
+    """Отложенная запись сообщений сделок в deal_messages
+
+    Сообщения копятся в памяти и сбрасываются одним многострочным INSERT
+    каждые DEAL_CHAT_FLUSH_INTERVAL_MS миллисекунд или при накоплении
+    DEAL_CHAT_FLUSH_SIZE сообщений - что наступит раньше.
+
+    Если база недоступна, пакет возвращается в очередь, а следующая попытка
+    откладывается на DEAL_CHAT_RETRY_BACKOFF секунд, вдвое дольше после каждой
+    новой неудачи (до DEAL_CHAT_RETRY_BACKOFF_MAX). Очередь не растет больше
+    DEAL_CHAT_MAX_PENDING: при переполнении теряются самые старые. Если пакет отклонен из-за данных, сообщения пишутся по одному, а
+    отклоненные строки отбрасываются и не блокируют остальные.
+    """
+
+    def __init__(self, flush_interval_ms: int = DEAL_CHAT_FLUSH_INTERVAL_MS,
+                 flush_size: int = DEAL_CHAT_FLUSH_SIZE):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_size = flush_size
+        self._pending: List[tuple] = []
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self.stats = {'messages': 0, 'flushes': 0, 'rows_written': 0, 'dropped': 0, 'rejected': 0, 'backoffs': 0}
+
+    def add(self, deal_id: int, user_id: int, message_type: str = 'user',
+            message_text: str = None, file_id: str = None):
+        """Постановка сообщения в очередь на запись"""
+        self._pending.append((deal_id, user_id, message_type, message_text, file_id))
+        self.stats['messages'] += 1
+        self._trim()
+        # Пока база недоступна, новые сообщения не запускают внеочередную попытку
+        if len(self._pending) >= self.flush_size and self._flush_requested and not self.backing_off():
+            self._flush_requested.set()
+
+    def has_pending(self, deal_id: int) -> bool:
+        """Есть ли незаписанные сообщения сделки"""
+        return any(message[0] == deal_id for message in self._pending)
+
+    def backing_off(self) -> bool:
+        """Идет пауза после ошибки подключения к базе"""
+        return time.monotonic() < self._retry_at
+
+    async def flush(self, force: bool = False):
+        """Запись всех накопленных сообщений (во время паузы после ошибки - только force)"""
+        async with self._flush_lock:
+            if self.backing_off() and not force:
+                return
+            while self._pending:
+                batch = self._pending[:self.flush_size]
+                del self._pending[:self.flush_size]
+                try:
+                    await db.add_deal_messages(batch)
+                except TRANSIENT_ERRORS as e:
+                    self._requeue(batch)
+                    self._back_off(e)
+                    return
+                except Exception as e:
+                    logger.warning(f"Deal messages batch rejected, writing one by one: {e}")
+                    if not await self._write_each(batch):
+                        return
+                    continue
+                self._failures = 0
+                self.stats['flushes'] += 1
+                self.stats['rows_written'] += len(batch)
+
+    async def _write_each(self, batch: List[tuple]) -> bool:
+        """Запись пакета по одному сообщению (False - база недоступна, остаток в очереди)"""
+        for index, message in enumerate(batch):
+            try:
+                await db.add_deal_messages([message])
+            except TRANSIENT_ERRORS as e:
+                self._requeue(batch[index:])
+                self._back_off(e)
+                return False
+            except Exception as e:
+                self.stats['rejected'] += 1
+                logger.error(f"Deal message for deal {message[0]} rejected and dropped: {e}")
+                continue
+            self.stats['rows_written'] += 1
+        self._failures = 0
+        self.stats['flushes'] += 1
+        return True
+
+    def _back_off(self, error: Exception):
+        """Пауза перед следующей попыткой, вдвое дольше после каждой неудачи подряд"""
+        delay = min(DEAL_CHAT_RETRY_BACKOFF * 2 ** self._failures, DEAL_CHAT_RETRY_BACKOFF_MAX)
+        self._failures += 1
+        self._retry_at = time.monotonic() + delay
+        self.stats['backoffs'] += 1
+        logger.error(
+            f"Deal messages flush error, retry in {delay} s "
+            f"({len(self._pending)} pending, {self.stats['dropped']} dropped so far): {error}"
+        )
+
+    def _requeue(self, batch: List[tuple]):
+        """Возврат пакета в начало очереди"""
+        self._pending[:0] = batch
+        self._trim()
+
+    def _trim(self):
+        """Отбрасывание самых старых сообщений сверх DEAL_CHAT_MAX_PENDING"""
+        overflow = len(self._pending) - DEAL_CHAT_MAX_PENDING
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.stats['dropped'] += overflow
+
+    async def _run(self):
+        while not self._stopping:
+            timeout = max(self.flush_interval, self._retry_at - time.monotonic())
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    def start(self):
+        """Запуск фоновой записи"""
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка с записью оставшихся сообщений"""
+        if self._task:
+            # Задача не отменяется: пакет, который пишется сейчас, иначе потерялся бы
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+            await self.flush(force=True)
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, 'pending': len(self._pending)}
+
+class DealChat:
+    """Чат участников сделки"""
+
+    def __init__(self, buffer: DealMessageBuffer):
+        self.buffer = buffer
+
+    @staticmethod
+    def get_counterpart_id(deal: Dict, user_id: int) -> Optional[int]:
+        """ID второго участника сделки (None - пользователь не участник)"""
+        if deal['creator_id'] == user_id:
+            return deal['participant_id']
+        if deal['participant_id'] == user_id:
+            return deal['creator_id']
+        return None
+
+    def record(self, deal_id: int, user_id: int, message_text: str = None,
+               file_id: str = None, message_type: str = 'user'):
+        """Сохранение сообщения сделки"""
+        self.buffer.add(deal_id, user_id, message_type, message_text, file_id)
+
+    async def get_history(self, deal_id: int, before_id: int = None, limit: int = 10) -> List[Dict]:
+        """Страница истории сделки, включая еще не записанные сообщения"""
+        if self.buffer.has_pending(deal_id):
+            await self.buffer.flush()
+        return await db.get_deal_messages(deal_id, before_id, limit)
+
+# Создание глобальных экземпляров чата сделок
+deal_message_buffer = DealMessageBuffer()
+deal_chat = DealChat(deal_message_buffer)
@@ -0,0 +1,109 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+from config import EXPORT_MAX_CONCURRENT, EXPORT_GZIP_LEVEL, EXPORT_MAX_FILE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Форматы выгрузки
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Поля выгрузки в порядке DEAL_EXPORT_COLUMNS
+EXPORT_FIELDS = [
+    'id', 'deal_code', 'creator_id', 'participant_id', 'creator_role', 'amount_usd', 'deal_conditions',
+    'status', 'payment_method', 'payment_proof', 'created_at', 'updated_at', 'completed_at'
+]
+
+class ExportTooLargeError(Exception):
+    """Сжатый файл выгрузки превысил EXPORT_MAX_FILE_SIZE"""
+
+class DealExporter:
+    """Выгрузка сделок в CSV или JSONL со сжатием gzip
+
+    Пакеты строк из stream_deals_export кодируются и сжимаются по мере
+    чтения во временный файл, поэтому память не зависит от числа сделок.
+    Одновременно идет не больше EXPORT_MAX_CONCURRENT выгрузок: каждая
+    держит соединение с базой до конца чтения.
+    """
+
+    def __init__(self, max_concurrent: int = EXPORT_MAX_CONCURRENT):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.stats = {'exports': 0, 'rows': 0, 'bytes': 0, 'too_large': 0, 'last_export_ms': 0.0}
+
+    @staticmethod
+    def _encode_jsonl(rows: List[tuple]) -> str:
+        # Decimal и datetime записываются строками: "16.00", "2025-01-31 12:00:00"
+        return ''.join(
+            json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False, default=str) + '\n'
+            for row in rows
+        )
+
+    async def write(self, batches: AsyncIterator[List[tuple]], fmt: str, fileobj) -> int:
+        """Кодирование пакетов строк в gzip-поток fileobj, возвращает число строк"""
+        count = 0
+        # BOM помогает Excel распознать кодировку CSV
+        encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+        with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=EXPORT_GZIP_LEVEL) as archive:
+            text = io.TextIOWrapper(archive, encoding=encoding, newline='')
+            try:
+                if fmt == 'csv':
+                    writer = csv.writer(text)
+                    writer.writerow(EXPORT_FIELDS)
+                async for rows in batches:
+                    if fmt == 'csv':
+                        writer.writerows(rows)
+                    else:
+                        text.write(self._encode_jsonl(rows))
+                    count += len(rows)
+                    if fileobj.tell() > EXPORT_MAX_FILE_SIZE:
+                        raise ExportTooLargeError(f"Export exceeds {EXPORT_MAX_FILE_SIZE} bytes")
+            finally:
+                # Поток gzip закрывает with, TextIOWrapper только сбрасывает буфер
+                text.flush()
+                text.detach()
+        return count
+
+    @asynccontextmanager
+    async def export(self, batches: AsyncIterator[List[tuple]], fmt: str):
+        """Выгрузка во временный файл: блок получает (путь, число строк), потом файл удаляется"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+
+        fd, path = tempfile.mkstemp(prefix='deals_', suffix=f'.{fmt}.gz')
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    with os.fdopen(fd, 'wb') as fileobj:
+                        rows = await self.write(batches, fmt, fileobj)
+                        size = fileobj.tell()
+                except ExportTooLargeError:
+                    self.stats['too_large'] += 1
+                    raise
+                finally:
+                    # Досрочно прерванный поток закрывается сразу, освобождая соединение
+                    await batches.aclose()
+
+                self.stats['exports'] += 1
+                self.stats['rows'] += rows
+                self.stats['bytes'] += size
+                self.stats['last_export_ms'] = (time.perf_counter() - started) * 1000
+                logger.info(f"Exported {rows} deals as {fmt}: {size} bytes in {self.stats['last_export_ms']:.0f} ms")
+
+            yield path, rows
+        finally:
+            os.remove(path)
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats)
+
+# Создание глобального экземпляра выгрузки сделок
+deal_exporter = DealExporter()
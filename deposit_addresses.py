@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+from database import db
+from config import (
+    TRC20_XPUB, DEPOSIT_POOL_TARGET, DEPOSIT_POOL_LOW_WATERMARK,
+    DEPOSIT_POOL_BATCH, DEPOSIT_POOL_CHECK_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+class TronAddressDeriver:
+    """Деривация TRC20 адресов из расширенного публичного ключа аккаунта
+
+    Адрес с индексом i берется по пути 0/i от ключа m/44'/195'/0'.
+    Требует пакет bip_utils.
+    """
+
+    network = 'TRC20'
+
+    def __init__(self, xpub: str):
+        from bip_utils import Bip32Secp256k1
+        # Внешняя цепочка (change = 0) вычисляется один раз
+        self._external = Bip32Secp256k1.FromExtendedKey(xpub).ChildKey(0)
+
+    def derive(self, start: int, count: int) -> List[tuple]:
+        """Адреса с индексами [start, start + count)"""
+        from bip_utils import TrxAddrEncoder
+        return [
+            (index, TrxAddrEncoder.EncodeKey(self._external.ChildKey(index).PublicKey().KeyObject()))
+            for index in range(start, start + count)
+        ]
+
+class DepositAddressPool:
+    """Пул заранее выведенных депозитных адресов
+
+    Фоновый воркер держит не меньше DEPOSIT_POOL_LOW_WATERMARK свободных
+    адресов, дополняя пул до DEPOSIT_POOL_TARGET пакетами. Деривация идет
+    в отдельном потоке, поэтому на обработку апдейтов не влияет. Выбор
+    способа оплаты только занимает готовый адрес.
+    """
+
+    def __init__(self):
+        self.derivers: Dict[str, object] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._refill_requested: Optional[asyncio.Event] = None
+        self.stats = {
+            'claims': 0,
+            'pool_empty': 0,
+            'derived': 0,
+            'refills': 0,
+            'last_refill_ms': 0.0,
+            'depth': {}
+        }
+
+        if TRC20_XPUB:
+            try:
+                self.derivers['TRC20'] = TronAddressDeriver(TRC20_XPUB)
+            except ImportError:
+                logger.error("TRC20_XPUB is set but bip_utils is not installed, deposit pool disabled")
+            except Exception as e:
+                logger.error(f"Invalid TRC20_XPUB: {e}")
+
+    def supports(self, network: str) -> bool:
+        return network in self.derivers
+
+    async def claim(self, deal_id: int, network: str) -> Optional[str]:
+        """Депозитный адрес для сделки (None - пул недоступен или пуст)"""
+        if not self.supports(network):
+            return None
+
+        address = await db.claim_deposit_address(deal_id, network)
+        if address:
+            self.stats['claims'] += 1
+        else:
+            self.stats['pool_empty'] += 1
+            logger.warning(f"Deposit address pool for {network} is empty")
+        if self._refill_requested:
+            self._refill_requested.set()
+        return address
+
+    async def refill(self, network: str) -> int:
+        """Дополнение пула до целевого размера, возвращает число новых адресов"""
+        depth = await db.count_unused_deposit_addresses(network)
+        self.stats['depth'][network] = depth
+        if depth >= DEPOSIT_POOL_LOW_WATERMARK:
+            return 0
+
+        started = time.perf_counter()
+        added = 0
+        last_index = await db.get_last_derivation_index(network)
+        next_index = 0 if last_index is None else last_index + 1
+
+        while depth + added < DEPOSIT_POOL_TARGET:
+            count = min(DEPOSIT_POOL_BATCH, DEPOSIT_POOL_TARGET - depth - added)
+            addresses = await asyncio.to_thread(self.derivers[network].derive, next_index, count)
+            await db.add_deposit_addresses(network, addresses)
+            next_index += count
+            added += count
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats['derived'] += added
+        self.stats['refills'] += 1
+        self.stats['last_refill_ms'] = elapsed_ms
+        self.stats['depth'][network] = depth + added
+        logger.info(f"Deposit pool {network} refilled with {added} addresses in {elapsed_ms:.0f} ms")
+        return added
+
+    async def _run(self):
+        while True:
+            for network in self.derivers:
+                try:
+                    await self.refill(network)
+                except Exception as e:
+                    logger.error(f"Deposit pool refill error ({network}): {e}")
+
+            try:
+                await asyncio.wait_for(self._refill_requested.wait(), DEPOSIT_POOL_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_requested.clear()
+
+    def start(self):
+        """Запуск фонового пополнения"""
+        if not self.derivers:
+            logger.info("Deposit address pool disabled: no extended public keys configured")
+            return
+        self._refill_requested = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        """Глубина пула и скорость пополнения"""
+        return dict(self.stats)
+
+# Создание глобального экземпляра пула адресов
+deposit_pool = DepositAddressPool()
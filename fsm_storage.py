@@ -0,0 +1,171 @@
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Set
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from database import db
+from config import FSM_STORAGE, FSM_CACHE_SIZE, REDIS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Пользователи, чьи изменения FSM ждут записи в конце текущего апдейта
+current_fsm_batch: ContextVar[Optional[Set[int]]] = ContextVar('current_fsm_batch', default=None)
+
+class SessionEntry:
+    """Состояние и данные FSM пользователя в кэше"""
+
+    __slots__ = ('state', 'data', 'dirty')
+
+    def __init__(self, state: Optional[str] = None, data: Dict[str, Any] = None):
+        self.state = state
+        self.data = data or {}
+        self.dirty = False
+
+class DatabaseStorage(BaseStorage):
+    """Хранилище FSM в таблице user_sessions
+
+    Состояние хранится в current_action, данные - в session_data. Чтения идут
+    из локального кэша (в том числе «сессии нет»), в базу - только при
+    первом обращении к пользователю. Изменения внутри апдейта
+    (update_data, set_state, clear) копятся в кэше и записываются одним
+    upsert в конце апдейта (FSMWriteBehindMiddleware); пустая сессия
+    удаляется. Вне апдейта изменения пишутся сразу.
+
+    Кэш локальный для процесса, поэтому один пользователь должен
+    обслуживаться одним процессом (один экземпляр бота или многопроцессный
+    режим с шардированием по пользователю). Ключ - пользователь: бот
+    работает в личных чатах.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, database=db):
+        self.cache_size = cache_size
+        self.db = database
+        self.cache: OrderedDict = OrderedDict()
+        self.stats = {'hits': 0, 'loads': 0, 'changes': 0, 'writes': 0, 'deletes': 0, 'errors': 0, 'evicted': 0}
+
+    @staticmethod
+    def _state_name(state: StateType) -> Optional[str]:
+        return state.state if isinstance(state, State) else state
+
+    async def _entry(self, user_id: int) -> SessionEntry:
+        entry = self.cache.get(user_id)
+        if entry is not None:
+            self.cache.move_to_end(user_id)
+            self.stats['hits'] += 1
+            return entry
+
+        session = await self.db.get_user_session(user_id)
+        self.stats['loads'] += 1
+        entry = self.cache.get(user_id)
+        if entry is None:
+            if session:
+                entry = SessionEntry(session['current_action'], session['session_data'])
+            else:
+                entry = SessionEntry()
+            self.cache[user_id] = entry
+            self._evict()
+        return entry
+
+    def _evict(self):
+        """Вытеснение давно не использованных записей, кроме незаписанных"""
+        overflow = len(self.cache) - self.cache_size
+        if overflow <= 0:
+            return
+        evicted = []
+        for user_id, entry in self.cache.items():
+            if not entry.dirty:
+                evicted.append(user_id)
+                if len(evicted) == overflow:
+                    break
+        for user_id in evicted:
+            del self.cache[user_id]
+        self.stats['evicted'] += len(evicted)
+
+    async def _changed(self, user_id: int, entry: SessionEntry):
+        self.stats['changes'] += 1
+        entry.dirty = True
+        batch = current_fsm_batch.get()
+        if batch is not None:
+            batch.add(user_id)
+        else:
+            await self.flush_user(user_id)
+
+    async def flush_user(self, user_id: int):
+        """Запись сессии пользователя одним запросом"""
+        entry = self.cache.get(user_id)
+        if entry is None or not entry.dirty:
+            return
+        entry.dirty = False
+        try:
+            if entry.state is None and not entry.data:
+                await self.db.clear_user_session(user_id)
+                self.stats['deletes'] += 1
+            else:
+                await self.db.set_user_session(user_id, entry.state, entry.data)
+                self.stats['writes'] += 1
+        except Exception as e:
+            # Запись повторится при следующем изменении или закрытии хранилища
+            entry.dirty = True
+            self.stats['errors'] += 1
+            logger.error(f"FSM session write error for user {user_id}: {e}")
+
+    @asynccontextmanager
+    async def batch(self):
+        """Отложенная запись изменений FSM до конца блока"""
+        users: Set[int] = set()
+        token = current_fsm_batch.set(users)
+        try:
+            yield
+        finally:
+            current_fsm_batch.reset(token)
+            for user_id in users:
+                await self.flush_user(user_id)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key.user_id)
+        state = self._state_name(state)
+        if entry.state != state:
+            entry.state = state
+            await self._changed(key.user_id, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key.user_id)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key.user_id)
+        if entry.data != data:
+            entry.data = data.copy()
+            await self._changed(key.user_id, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key.user_id)).data.copy()
+
+    async def close(self) -> None:
+        """Запись всех отложенных изменений"""
+        for user_id in [user_id for user_id, entry in self.cache.items() if entry.dirty]:
+            await self.flush_user(user_id)
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['cached'] = len(self.cache)
+        lookups = stats['hits'] + stats['loads']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+def create_fsm_storage(backend: str = FSM_STORAGE) -> BaseStorage:
+    """Создание хранилища FSM по имени бэкенда из конфигурации"""
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'database':
+        return DatabaseStorage()
+    if backend == 'redis':
+        from aiogram.fsm.storage.redis import RedisStorage
+        from redis.asyncio import Redis
+        return RedisStorage(Redis(**REDIS_CONFIG))
+    raise ValueError(f"Unknown FSM storage backend: {backend}")
+
+# Создание глобального хранилища FSM
+fsm_storage = create_fsm_storage()
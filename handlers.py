@@ -1,17 +1,36 @@
 import logging
+from html import escape
 from datetime import datetime, timedelta
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, BufferedInputFile
-from aiogram.filters import Command, StateFilter
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, BufferedInputFile, FSInputFile, ErrorEvent, User
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, StateFilter, ExceptionTypeFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from database import db
+from db_pool import DatabaseBusyError
 from captcha import captcha_system
+from captcha_bank import captcha_bank
 from keyboards import keyboards
 from utils import utils
-from config import SUPPORT_USERNAME
+from deal_chat import deal_chat
+from payment_watcher import payment_watcher
+from deposit_addresses import deposit_pool
+from rate_oracle import rate_oracle, PAYMENT_ASSETS, RateUnavailableError
+from leaderboard import leaderboard
+from passwords import password_hasher
+from deal_export import deal_exporter, EXPORT_FORMATS, ExportTooLargeError
+from deal_cards import deal_cards
+from deal_cache import deal_cache
+from texts import texts, Markup
+from throttling import throttler
+from retention import retention_engine
+from config import (
+    SUPPORT_USERNAME, DEAL_CHAT_HISTORY_PAGE, ADMIN_IDS, DEAL_SEARCH_PAGE,
+    CAPTCHA_IMAGE_ENABLED, CAPTCHA_IMAGE_TIMEOUT, MAX_CAPTCHA_ATTEMPTS, ALLOW_UNVERIFIED_COMPLETION
+)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +49,12 @@ class DealStates(StatesGroup):
 class CaptchaStates(StatesGroup):
     waiting_for_captcha = State()
 
+class DealChatStates(StatesGroup):
+    in_chat = State()
+
+class SearchStates(StatesGroup):
+    waiting_for_query = State()
+
 # === КОМАНДЫ ===
 
 @router.message(Command("start"))
@@ -59,6 +84,26 @@ async def cmd_start(message: Message, state: FSMContext):
 
 async def start_captcha_verification(message: Message, state: FSMContext):
     """Запуск процесса верификации капчей"""
+    # Капча-картинка берется готовой из банка; если банк пуст - капча с кнопками
+    challenge = captcha_bank.pop() if CAPTCHA_IMAGE_ENABLED else None
+    if challenge:
+        image, answer = challenge
+        await db.create_captcha_session(
+            user_id=message.from_user.id,
+            captcha_type='image',
+            correct_answer=answer,
+            expires_at=datetime.now() + timedelta(seconds=CAPTCHA_IMAGE_TIMEOUT)
+        )
+        await message.answer_photo(
+            BufferedInputFile(image, filename="captcha.png"),
+            caption="🛡️ **Добро пожаловать в OZER GARANT!**\n\n"
+                    "Для продолжения работы пройдите проверку:\n\n"
+                    "🔤 Отправьте символы с картинки одним сообщением.",
+            parse_mode="Markdown"
+        )
+        await state.set_state(CaptchaStates.waiting_for_captcha)
+        return
+    
     captcha_data = captcha_system.generate_captcha()
     
     # Сохраняем капчу в базу данных
@@ -73,9 +118,7 @@ async def start_captcha_verification(message: Message, state: FSMContext):
     keyboard = keyboards.get_captcha_keyboard(captcha_data['emoji_options'])
     
     await message.answer(
-        f"🛡️ **Добро пожаловать в OZER GARANT!**\n\n"
-        f"Для продолжения работы пройдите проверку:\n\n"
-        f"{captcha_data['question']}",
+        texts.render('captcha_prompt', message.from_user.language_code, question=captcha_data['question']),
         reply_markup=keyboard,
         parse_mode="Markdown"
     )
@@ -84,19 +127,7 @@ async def start_captcha_verification(message: Message, state: FSMContext):
 
 async def show_welcome_message(message: Message):
     """Показ приветственного сообщения"""
-    welcome_text = f"""
-🎉 **Добро пожаловать в OZER GARANT!**
-
-🔐 Безопасная площадка для проведения сделок с гарантией!
-
-💼 **Возможности бота:**
-• Создание безопасных сделок
-• Гарантийная система
-• Поддержка TRC20 USDT и TON
-• 24/7 техническая поддержка
-
-👇 Используйте меню для навигации:
-"""
+    welcome_text = texts.render('welcome', message.from_user.language_code)
     
     await message.answer(
         welcome_text,
@@ -158,6 +189,50 @@ async def process_captcha_answer(callback: CallbackQuery, state: FSMContext):
                 show_alert=True
             )
 
+@router.message(StateFilter(CaptchaStates.waiting_for_captcha), F.text, ~F.text.startswith("/"))
+async def process_image_captcha_answer(message: Message, state: FSMContext):
+    """Обработка ответа на капчу-картинку"""
+    user_id = message.from_user.id
+    captcha_session = await db.get_captcha_session(user_id)
+    
+    if not captcha_session:
+        await message.answer("❌ Сессия капчи истекла!")
+        await state.clear()
+        await start_captcha_verification(message, state)
+        return
+    
+    if captcha_session['captcha_type'] != 'image':
+        await message.answer("👆 Выберите ответ кнопкой под вопросом.")
+        return
+    
+    if captcha_system.verify_answer(message.text, captcha_session['correct_answer']):
+        await db.solve_captcha(captcha_session['id'])
+        await db.verify_user(user_id)
+        
+        await message.answer(
+            "✅ **Капча пройдена успешно!**\n\n"
+            "Теперь вы можете пользоваться всеми функциями бота.",
+            parse_mode="Markdown"
+        )
+        
+        await show_welcome_message(message)
+        await state.clear()
+        return
+    
+    attempts = captcha_session['attempts'] + 1
+    await db.update_captcha_attempts(captcha_session['id'], attempts)
+    
+    if attempts >= MAX_CAPTCHA_ATTEMPTS:
+        await message.answer(
+            "❌ **Капча не пройдена!**\n\n"
+            "Превышено максимальное количество попыток.\n"
+            "Нажмите /start для повторной попытки.",
+            parse_mode="Markdown"
+        )
+        await state.clear()
+    else:
+        await message.answer(f"❌ Неправильный ответ! Осталось попыток: {MAX_CAPTCHA_ATTEMPTS - attempts}")
+
 # === ГЛАВНОЕ МЕНЮ ===
 
 @router.message(F.text == "💼 Создать сделку")
@@ -190,6 +265,77 @@ async def show_profile(message: Message):
     else:
         await message.answer("❌ Профиль не найден. Нажмите /start для регистрации.")
 
+@router.message(F.text == "🏆 Топ участников")
+async def show_leaderboard(message: Message):
+    """Показ топа участников по рейтингу"""
+    await message.answer(await leaderboard.get_text(), parse_mode="HTML")
+
+@router.message(Command("admin_top"))
+async def show_admin_leaderboard(message: Message):
+    """Расширенный топ участников для администраторов"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await message.answer(await leaderboard.get_text(admin=True), parse_mode="HTML")
+
+@router.message(Command("admin_stats"))
+async def show_admin_stats(message: Message):
+    """Счетчики нагрузки, банка капч, кэша сделок, пулов БД и очистки таблиц для администраторов"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    stats = throttler.get_stats()
+    lines = [
+        "📈 <b>Нагрузка</b>\n",
+        f"В обработке: {stats['in_flight']} (максимум {stats['max_in_flight']}, лимит {throttler.max_concurrent})",
+        f"Пропущено: {stats['allowed']}",
+        f"Отклонено по лимиту: {stats['throttled']}",
+        f"Сброшено при перегрузке: {stats['shed']}",
+        f"Мьютов: {stats['mutes']} (сейчас {stats['muted_users']}), отброшено: {stats['muted_dropped']}",
+        f"Пользователей в памяти: {stats['users']}\n",
+        "<b>По классам</b> (пропущено / отклонено):"
+    ]
+    for kind, counters in stats['by_kind'].items():
+        lines.append(f"• {kind}: {counters['allowed']} / {counters['throttled']}")
+    
+    bank = captcha_bank.get_stats()
+    lines += [
+        "\n🖼 <b>Банк капч</b>\n",
+        f"Готово: {bank['size']} из {captcha_bank.size}",
+        f"Попадания: {bank['hits']} из {bank['requests']} ({bank['hit_rate']:.0%})",
+        f"Нарисовано: {bank['rendered']}, ошибок: {bank['errors']}",
+        f"Пакет: p50 {bank['batch_p50_ms']:.0f} мс, максимум {bank['batch_max_ms']:.0f} мс",
+        f"Последнее пополнение: {bank['last_refill_ms']:.0f} мс"
+    ]
+    
+    cache = deal_cache.get_stats()
+    lines += [
+        "\n🔗 <b>Кэш сделок</b>\n",
+        f"Попадания: {cache['hits']} из {cache['hits'] + cache['misses']} ({cache['hit_rate']:.0%})",
+        f"Запросов к БД: {cache['loads']}, общих ожиданий: {cache['shared']}",
+        f"Сбросов: {cache['invalidations']}, записей: {cache['size']}"
+    ]
+    
+    pools = db.get_pool_stats()
+    if pools:
+        lines.append("\n🗄 <b>Пулы соединений</b>\n")
+    for pool in pools:
+        lines.append(
+            f"• {pool['name']}: выдано {pool['in_use']} из {pool['limit']} "
+            f"({pool['min_size']}-{pool['max_size']}), ждут {pool['waiting']}, "
+            f"соединений {pool['connections']} (свободно {pool['free_connections']})"
+        )
+        lines.append(
+            f"  Ожидание: среднее {pool['avg_wait_ms']:.1f} мс, максимум {pool['max_wait_ms']:.0f} мс; "
+            f"таймаутов {pool['timeouts']}, рост {pool['grows']}, снижение {pool['shrinks']}"
+        )
+    
+    retention = retention_engine.get_stats()
+    lines.append("\n🧹 <b>Очистка временных таблиц</b>\n")
+    lines.append(f"Проходов: {retention['runs']}, удалено всего: {retention['purged']}, ошибок: {retention['errors']}")
+    for table, rows in retention['last_report'].items():
+        lines.append(f"• {table}: {rows} за последний проход")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
 @router.message(F.text == "📋 Мои сделки")
 async def show_my_deals(message: Message):
     """Показ сделок пользователя"""
@@ -213,24 +359,7 @@ async def show_my_deals(message: Message):
 @router.message(F.text == "🆘 Поддержка")
 async def show_support(message: Message):
     """Показ информации о поддержке"""
-    support_text = f"""
-🆘 **Техническая поддержка**
-
-📞 **Контакты поддержки:**
-• Telegram: @{SUPPORT_USERNAME}
-• Время работы: 24/7
-
-❓ **Часто задаваемые вопросы:**
-• Как создать сделку?
-• Как отменить сделку?
-• Сколько времени обрабатывается спор?
-• Какие комиссии?
-
-💡 **Полезные советы:**
-• Всегда проверяйте данные партнера
-• Не передавайте пароли сделки третьим лицам
-• Сохраняйте доказательства оплаты
-"""
+    support_text = texts.render('support', message.from_user.language_code, support_username=SUPPORT_USERNAME)
     
     await message.answer(
         support_text,
@@ -245,24 +374,16 @@ async def process_role_selection(callback: CallbackQuery, state: FSMContext):
     """Обработка выбора роли"""
     role = callback.data.split("_")[1]
     
-    if role == "buyer":
-        role_text = "💰 Покупатель"
-        role_value = "buyer"
-    elif role == "seller":
-        role_text = "💎 Продавец"
-        role_value = "seller"
-    else:
+    if role not in ("buyer", "seller"):
         await callback.message.edit_text("❌ Создание сделки отменено.")
         return
     
     # Сохраняем роль в состоянии
-    await state.update_data(role=role_value)
+    await state.update_data(role=role)
     
+    language_code = callback.from_user.language_code
     await callback.message.edit_text(
-        f"💼 **Создание сделки**\n\n"
-        f"👤 Роль: {role_text}\n\n"
-        f"💰 Введите сумму сделки в USD:\n"
-        f"(Минимум: $1, Максимум: $100,000)",
+        texts.render('deal_role_chosen', language_code, role=texts.role(role, language_code)),
         reply_markup=keyboards.get_cancel_keyboard(),
         parse_mode="Markdown"
     )
@@ -286,10 +407,7 @@ async def process_deal_amount(message: Message, state: FSMContext):
     await state.update_data(amount=amount)
     
     await message.answer(
-        f"💼 **Создание сделки**\n\n"
-        f"💰 Сумма: ${amount}\n\n"
-        f"📋 Введите условия сделки:\n"
-        f"(Опишите что продаете/покупаете, условия передачи товара/услуги)",
+        texts.render('deal_amount_entered', message.from_user.language_code, amount=amount),
         reply_markup=keyboards.get_cancel_keyboard(),
         parse_mode="Markdown"
     )
@@ -321,10 +439,7 @@ async def process_deal_conditions(message: Message, state: FSMContext):
     await state.update_data(conditions=conditions)
     
     await message.answer(
-        f"💼 **Создание сделки**\n\n"
-        f"📋 Условия: {conditions[:100]}...\n\n"
-        f"🔐 Введите пароль для сделки:\n"
-        f"(4-50 символов, этот пароль понадобится партнеру для присоединения)",
+        texts.render('deal_conditions_entered', message.from_user.language_code, conditions=conditions[:100]),
         reply_markup=keyboards.get_cancel_keyboard(),
         parse_mode="Markdown"
     )
@@ -347,11 +462,13 @@ async def process_deal_password(message: Message, state: FSMContext, bot: Bot):
     # Получаем данные из состояния
     data = await state.get_data()
     
-    # Генерируем код сделки
+    # Генерируем код сделки, не совпадающий ни с одной сделкой, в том числе архивной
     deal_code = utils.generate_deal_code()
+    while await db.deal_code_exists(deal_code):
+        deal_code = utils.generate_deal_code()
     
     # Хешируем пароль
-    hashed_password = utils.hash_password(password)
+    hashed_password = await password_hasher.hash_async(password)
     
     # Создаем сделку в базе данных
     expires_at = utils.get_deal_expiry_time()
@@ -370,27 +487,16 @@ async def process_deal_password(message: Message, state: FSMContext, bot: Bot):
     bot_info = await bot.get_me()
     deal_link = utils.create_deal_link(bot_info.username, deal_code)
     
-    role_text = "💰 Покупатель" if data['role'] == "buyer" else "💎 Продавец"
-    
-    success_text = f"""
-✅ **Сделка создана успешно!**
-
-💼 **Код сделки:** `{deal_code}`
-👤 **Ваша роль:** {role_text}
-💰 **Сумма:** ${data['amount']}
-📋 **Условия:** {data['conditions'][:100]}...
-🔐 **Пароль:** `{password}`
-
-🔗 **Ссылка для партнера:**
-{deal_link}
-
-⏰ **Сделка активна до:** {expires_at.strftime('%d.%m.%Y %H:%M')}
-
-📝 **Как пригласить партнера:**
-1. Отправьте ему ссылку выше
-2. Партнер должен ввести пароль: `{password}`
-3. После присоединения начнется процесс сделки
-"""
+    success_text = texts.render(
+        'deal_created', message.from_user.language_code,
+        deal_code=deal_code,
+        role=texts.role(data['role'], message.from_user.language_code),
+        amount=data['amount'],
+        conditions=data['conditions'][:100],
+        password=password,
+        deal_link=deal_link,
+        expires_at=expires_at
+    )
     
     await message.answer(
         success_text,
@@ -404,8 +510,8 @@ async def process_deal_password(message: Message, state: FSMContext, bot: Bot):
 
 async def handle_deal_join(message: Message, deal_code: str, state: FSMContext):
     """Обработка присоединения к сделке"""
-    # Получаем сделку по коду
-    deal = await db.get_deal_by_code(deal_code)
+    # Получаем сделку по коду; наплыв переходов по одной ссылке читает ее из кэша
+    deal = await deal_cache.get_by_code(deal_code)
     
     if not deal:
         await message.answer(
@@ -443,20 +549,16 @@ async def handle_deal_join(message: Message, deal_code: str, state: FSMContext):
         return
     
     # Показываем информацию о сделке и запрашиваем пароль
-    role_text = "💰 Покупатель" if deal['creator_role'] == "buyer" else "💎 Продавец"
-    partner_role = "💎 Продавец" if deal['creator_role'] == "buyer" else "💰 Покупатель"
-    
-    deal_info = f"""
-💼 **Присоединение к сделке #{deal_code}**
-
-👤 **Роль создателя:** {role_text}
-👤 **Ваша роль:** {partner_role}
-💰 **Сумма:** ${deal['amount_usd']}
-📋 **Условия:** {deal['deal_conditions']}
-⏰ **Истекает:** {deal['expires_at'].strftime('%d.%m.%Y %H:%M')}
-
-🔐 **Введите пароль сделки для присоединения:**
-"""
+    language_code = message.from_user.language_code
+    deal_info = texts.render(
+        'join_prompt', language_code,
+        deal_code=deal_code,
+        creator_role=texts.role(deal['creator_role'], language_code),
+        role=texts.role(deal['creator_role'], language_code, partner=True),
+        amount=deal['amount_usd'],
+        conditions=deal['deal_conditions'],
+        expires_at=deal['expires_at']
+    )
     
     await message.answer(
         deal_info,
@@ -476,63 +578,58 @@ async def process_join_password(message: Message, state: FSMContext, bot: Bot):
     deal_code = data['deal_code']
     
     # Получаем сделку
-    deal = await db.get_deal_by_code(deal_code)
+    deal = await deal_cache.get_by_code(deal_code)
     
     if not deal:
         await message.answer("❌ Сделка не найдена!")
         await state.clear()
         return
     
-    # Проверяем пароль
-    if not utils.verify_password(password, deal['deal_password']):
+    # Проверяем пароль; хеш со старыми параметрами заменяется на новый
+    password_ok, new_hash = await password_hasher.verify_and_update_async(password, deal['deal_password'])
+    if not password_ok:
         await message.answer(
             "❌ Неверный пароль!\n\n"
             "Попробуйте еще раз:",
             reply_markup=keyboards.get_cancel_keyboard()
         )
         return
+    if new_hash:
+        await db.update_deal_password(deal['id'], new_hash)
     
     # Присоединяемся к сделке
-    await db.join_deal(deal['id'], message.from_user.id)
-    
-    # Уведомляем создателя сделки
-    creator_role = "💰 Покупатель" if deal['creator_role'] == "buyer" else "💎 Продавец"
-    participant_role = "💎 Продавец" if deal['creator_role'] == "buyer" else "💰 Покупатель"
+    if not await db.join_deal(deal['id'], message.from_user.id):
+        await message.answer("❌ К этой сделке уже присоединились или она недоступна.")
+        await state.clear()
+        return
     
-    creator_notification = f"""
-🎉 **К вашей сделке присоединился партнер!**
-
-💼 **Сделка:** #{deal_code}
-👤 **Партнер:** {message.from_user.first_name}
-💰 **Сумма:** ${deal['amount_usd']}
-📋 **Условия:** {deal['deal_conditions'][:100]}...
-
-🔄 **Следующий шаг:**
-Если вы покупатель - выберите способ оплаты.
-Если вы продавец - ожидайте оплату от покупателя.
-"""
+    # Уведомляем создателя сделки; его язык неизвестен, поэтому локаль по умолчанию
+    creator_notification = texts.render(
+        'partner_joined',
+        deal_code=deal_code,
+        partner=message.from_user.first_name,
+        amount=deal['amount_usd'],
+        conditions=deal['deal_conditions'][:100]
+    )
     
     try:
         await bot.send_message(
             deal['creator_id'],
             creator_notification,
+            reply_markup=keyboards.get_open_chat_keyboard(deal['id']),
             parse_mode="Markdown"
         )
     except:
         pass  # Игнорируем ошибки отправки
     
     # Уведомляем присоединившегося
-    participant_notification = f"""
-✅ **Вы успешно присоединились к сделке!**
-
-💼 **Сделка:** #{deal_code}
-👤 **Ваша роль:** {participant_role}
-💰 **Сумма:** ${deal['amount_usd']}
-📋 **Условия:** {deal['deal_conditions'][:100]}...
-
-🔄 **Что дальше:**
-Ожидайте действий от партнера. Вы получите уведомление при изменении статуса сделки.
-"""
+    participant_notification = texts.render(
+        'joined', message.from_user.language_code,
+        deal_code=deal_code,
+        role=texts.role(deal['creator_role'], message.from_user.language_code, partner=True),
+        amount=deal['amount_usd'],
+        conditions=deal['deal_conditions'][:100]
+    )
     
     await message.answer(
         participant_notification,
@@ -542,16 +639,7 @@ async def process_join_password(message: Message, state: FSMContext, bot: Bot):
     
     # Если создатель - покупатель, предлагаем выбрать способ оплаты
     if deal['creator_role'] == 'buyer':
-        payment_text = f"""
-💳 **Выберите способ оплаты для сделки #{deal_code}**
-
-💰 **Сумма к оплате:** ${deal['amount_usd']}
-
-🔗 **TRC20 USDT** - USDT в сети TRON
-💎 **TON** - The Open Network
-
-Выберите удобный для вас способ:
-"""
+        payment_text = texts.render('choose_payment', deal_code=deal_code, amount=deal['amount_usd'])
         
         try:
             await bot.send_message(
@@ -567,17 +655,13 @@ async def process_join_password(message: Message, state: FSMContext, bot: Bot):
 
 # === ОБРАБОТКА ОПЛАТЫ ===
 
-@router.callback_query(F.data.startswith("payment_"))
+@router.callback_query(F.data.in_(["payment_TRC20", "payment_TON"]))
 async def process_payment_method(callback: CallbackQuery, bot: Bot):
     """Обработка выбора способа оплаты"""
     payment_method = callback.data.split("_")[1]
     
-    if payment_method == "cancel":
-        await callback.message.edit_text("❌ Выбор способа оплаты отменен.")
-        return
-    
     # Получаем активную сделку пользователя (где он покупатель)
-    user_deals = await db.get_user_deals(callback.from_user.id)
+    user_deals = await db.get_user_deals(callback.from_user.id, include_archive=False)
     active_deal = None
     
     for deal in user_deals:
@@ -591,29 +675,48 @@ async def process_payment_method(callback: CallbackQuery, bot: Bot):
         await callback.answer("❌ Активная сделка не найдена!", show_alert=True)
         return
     
+    # Фиксируем сумму в монете по курсу из кэша, повторный выбор того же способа ее не меняет
+    quote = await db.get_payment_quote(active_deal['id'])
+    if not quote or quote['payment_method'] != payment_method:
+        try:
+            crypto_amount, rate = await rate_oracle.quote(active_deal['amount_usd'], payment_method)
+        except RateUnavailableError as e:
+            logger.error(f"Payment quote error: {e}")
+            await callback.answer("❌ Курс временно недоступен, попробуйте позже", show_alert=True)
+            return
+        await db.lock_payment_quote(active_deal['id'], payment_method, crypto_amount, rate)
+    else:
+        crypto_amount, rate = quote['crypto_amount'], quote['rate']
+    asset = PAYMENT_ASSETS[payment_method]
+    
     # Устанавливаем способ оплаты
-    await db.set_payment_method(active_deal['id'], payment_method)
+    if not await db.set_payment_method(active_deal['id'], payment_method):
+        await callback.answer("❌ Сделка уже не ожидает выбора оплаты!", show_alert=True)
+        return
     
-    # Получаем адрес для оплаты
-    payment_address = utils.get_payment_address(payment_method)
+    # Получаем адрес для оплаты: собственный адрес сделки из пула или общий
+    payment_address = (
+        await deposit_pool.claim(active_deal['id'], payment_method)
+        or utils.get_payment_address(payment_method)
+    )
     
     # Генерируем QR код
-    qr_code = utils.generate_qr_code(payment_address, active_deal['amount_usd'], payment_method)
-    
-    payment_text = f"""
-💳 **Оплата сделки #{active_deal['deal_code']}**
-
-💰 **Сумма:** ${active_deal['amount_usd']}
-🔗 **Способ:** {payment_method}
-📍 **Адрес:** `{payment_address}`
-
-⚠️ **ВАЖНО:**
-• Переводите ТОЧНУЮ сумму: ${active_deal['amount_usd']}
-• Сохраните чек/подтверждение оплаты
-• После оплаты нажмите "✅ Я оплатил"
-
-📱 **QR код для быстрой оплаты:**
-"""
+    payment_memo = payment_watcher.get_deal_memo(active_deal['deal_code'], payment_method)
+    qr_code = utils.generate_qr_code(payment_address, crypto_amount, payment_method, payment_memo)
+    language_code = callback.from_user.language_code
+    memo_line = texts.render('payment_memo_line', language_code, memo=payment_memo) if payment_memo else Markup()
+    
+    payment_text = texts.render(
+        'payment_details', language_code,
+        deal_code=active_deal['deal_code'],
+        amount=active_deal['amount_usd'],
+        crypto_amount=crypto_amount,
+        asset=asset,
+        rate=rate,
+        payment_method=payment_method,
+        address=payment_address,
+        memo_line=memo_line
+    )
     
     # Отправляем QR код
     qr_photo = BufferedInputFile(qr_code.read(), filename="payment_qr.png")
@@ -627,15 +730,14 @@ async def process_payment_method(callback: CallbackQuery, bot: Bot):
     
     # Уведомляем продавца
     seller_id = active_deal['participant_id']
-    seller_notification = f"""
-💳 **Покупатель выбрал способ оплаты**
-
-💼 **Сделка:** #{active_deal['deal_code']}
-💰 **Сумма:** ${active_deal['amount_usd']}
-🔗 **Способ:** {payment_method}
-
-⏳ Ожидайте подтверждения оплаты от покупателя.
-"""
+    seller_notification = texts.render(
+        'payment_method_chosen',
+        deal_code=active_deal['deal_code'],
+        amount=active_deal['amount_usd'],
+        crypto_amount=crypto_amount,
+        asset=asset,
+        payment_method=payment_method
+    )
     
     try:
         await bot.send_message(
@@ -652,7 +754,7 @@ async def process_payment_method(callback: CallbackQuery, bot: Bot):
 async def process_payment_completed(callback: CallbackQuery, bot: Bot):
     """Обработка подтверждения оплаты"""
     # Получаем активную сделку пользователя
-    user_deals = await db.get_user_deals(callback.from_user.id)
+    user_deals = await db.get_user_deals(callback.from_user.id, include_archive=False)
     active_deal = None
     
     for deal in user_deals:
@@ -666,44 +768,73 @@ async def process_payment_completed(callback: CallbackQuery, bot: Bot):
         await callback.answer("❌ Активная сделка не найдена!", show_alert=True)
         return
     
+    await confirm_deal_payment(callback, bot, active_deal)
+
+@router.callback_query(F.data.startswith("confirm_payment_"))
+async def process_confirm_payment(callback: CallbackQuery, bot: Bot):
+    """Подтверждение оплаты из карточки сделки"""
+    deal = await db.get_deal_by_id(int(callback.data.split("_")[2]))
+    
+    if (not deal or deal['archived'] or deal['status'] != 'payment_pending'
+            or deal['creator_id'] != callback.from_user.id):
+        await callback.answer("❌ Активная сделка не найдена!", show_alert=True)
+        return
+    
+    await confirm_deal_payment(callback, bot, deal)
+
+async def confirm_deal_payment(callback: CallbackQuery, bot: Bot, active_deal: dict):
+    """Завершение сделки после подтверждения оплаты покупателем"""
+    # Оплата подтверждается только найденным в блокчейне переводом
+    if payment_watcher.enabled:
+        payment_watcher.poke()
+        await callback.answer(
+            "⏳ Проверяем поступление оплаты в блокчейне.\n"
+            "Сделка завершится автоматически, как только перевод будет найден.",
+            show_alert=True
+        )
+        return
+    
+    # Без индексатора перевод проверить нечем: завершение по одному слову
+    # покупателя допускается только явной настройкой
+    if not ALLOW_UNVERIFIED_COMPLETION:
+        await callback.answer(
+            "⚠️ Автоматическая проверка оплаты сейчас недоступна.\n"
+            f"Для завершения сделки обратитесь в поддержку: @{SUPPORT_USERNAME}",
+            show_alert=True
+        )
+        return
+    
     # Обновляем статус сделки
-    await db.update_deal_status(active_deal['id'], 'completed')
+    if not await db.update_deal_status(active_deal['id'], 'completed'):
+        await callback.answer("❌ Сделка уже завершена или отменена!", show_alert=True)
+        return
+    leaderboard.invalidate()
     
     # Уведомляем покупателя
-    buyer_notification = f"""
-✅ **Оплата подтверждена!**
-
-💼 **Сделка #{active_deal['deal_code']} завершена**
-💰 **Сумма:** ${active_deal['amount_usd']}
-
-🎉 Спасибо за использование OZER GARANT!
-Ваша сделка успешно завершена.
-
-⭐ Не забудьте оценить качество сервиса!
-"""
+    buyer_notification = texts.render(
+        'buyer_completed', callback.from_user.language_code,
+        deal_code=active_deal['deal_code'],
+        amount=active_deal['amount_usd']
+    )
     
     await callback.message.edit_text(
         buyer_notification,
+        reply_markup=keyboards.get_rate_deal_keyboard(active_deal['id']),
         parse_mode="Markdown"
     )
     
     # Уведомляем продавца
-    seller_notification = f"""
-✅ **Сделка завершена!**
-
-💼 **Сделка #{active_deal['deal_code']}**
-💰 **Сумма:** ${active_deal['amount_usd']}
-
-🎉 Покупатель подтвердил оплату!
-Сделка успешно завершена.
-
-💼 Вы можете передать товар/услугу покупателю.
-"""
+    seller_notification = texts.render(
+        'seller_completed',
+        deal_code=active_deal['deal_code'],
+        amount=active_deal['amount_usd']
+    )
     
     try:
         await bot.send_message(
             active_deal['participant_id'],
             seller_notification,
+            reply_markup=keyboards.get_rate_deal_keyboard(active_deal['id']),
             parse_mode="Markdown"
         )
     except:
@@ -711,6 +842,319 @@ async def process_payment_completed(callback: CallbackQuery, bot: Bot):
     
     await callback.answer("✅ Сделка завершена успешно!", show_alert=True)
 
+# === ОЦЕНКА СДЕЛКИ ===
+
+@router.callback_query(F.data.startswith("rate_deal_"))
+async def rate_deal(callback: CallbackQuery):
+    """Оценка партнера по завершенной сделке"""
+    _, _, deal_id, score = callback.data.split("_")
+    score = int(score)
+    deal = await db.get_deal_by_id(int(deal_id))
+    rated_id = deal_chat.get_counterpart_id(deal, callback.from_user.id) if deal else None
+    
+    if not deal or deal['status'] != 'completed' or rated_id is None or not 1 <= score <= 5:
+        await callback.answer("❌ Оценка этой сделки недоступна!", show_alert=True)
+        return
+    
+    if not await db.rate_deal(deal['id'], callback.from_user.id, rated_id, score):
+        await callback.answer("ℹ️ Вы уже оценили эту сделку.", show_alert=True)
+        return
+    leaderboard.invalidate()
+    
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer(f"✅ Спасибо! Ваша оценка: {'⭐' * score}")
+
+# === ПОИСК СДЕЛОК ===
+
+async def send_search_results(message: Message, user_id: int, query: str, page: int, edit: bool = False):
+    """Страница результатов поиска: администраторы ищут по всем сделкам, остальные - по своим"""
+    scope_user_id = None if user_id in ADMIN_IDS else user_id
+    deals = await db.search_deals(query, scope_user_id, DEAL_SEARCH_PAGE + 1, page * DEAL_SEARCH_PAGE)
+    has_next = len(deals) > DEAL_SEARCH_PAGE
+    deals = deals[:DEAL_SEARCH_PAGE]
+    
+    if deals:
+        text = f"🔍 <b>Поиск:</b> «{escape(query)}»\n\nСтраница {page + 1}. Выберите сделку для просмотра:"
+    else:
+        text = f"🔍 <b>Поиск:</b> «{escape(query)}»\n\nНичего не найдено."
+    reply_markup = keyboards.get_search_results_keyboard(deals, page, has_next)
+    
+    if edit:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=reply_markup, parse_mode="HTML")
+
+async def run_deal_search(message: Message, state: FSMContext, query: str):
+    """Проверка запроса и показ первой страницы"""
+    query = query.strip()
+    if len(query) < 3:
+        await state.set_state(SearchStates.waiting_for_query)
+        await message.answer(
+            "❌ Запрос слишком короткий!\n\n"
+            "Введите минимум 3 символа:",
+            reply_markup=keyboards.get_cancel_keyboard()
+        )
+        return
+    
+    # Запрос хранится в данных FSM для перелистывания страниц
+    await state.set_state(None)
+    await state.update_data(search_query=query)
+    await send_search_results(message, message.from_user.id, query, 0)
+
+@router.message(F.text == "🔍 Поиск сделок")
+async def start_deal_search(message: Message, state: FSMContext):
+    """Начало поиска сделок"""
+    await state.set_state(SearchStates.waiting_for_query)
+    await message.answer(
+        "🔍 **Поиск сделок**\n\n"
+        "Введите слова из условий сделки:",
+        reply_markup=keyboards.get_cancel_keyboard(),
+        parse_mode="Markdown"
+    )
+
+@router.message(Command("search"))
+async def search_command(message: Message, command: CommandObject, state: FSMContext):
+    """Поиск сделок командой /search текст"""
+    if not command.args:
+        await start_deal_search(message, state)
+        return
+    await run_deal_search(message, state, command.args)
+
+@router.message(StateFilter(SearchStates.waiting_for_query))
+async def process_search_query(message: Message, state: FSMContext):
+    """Обработка поискового запроса"""
+    await run_deal_search(message, state, message.text or "")
+
+@router.callback_query(F.data.startswith("search_page_"))
+async def search_page(callback: CallbackQuery, state: FSMContext):
+    """Перелистывание результатов поиска"""
+    query = (await state.get_data()).get('search_query')
+    if not query:
+        await callback.answer("❌ Поиск устарел, начните новый.", show_alert=True)
+        return
+    
+    page = int(callback.data.split("_")[2])
+    await send_search_results(callback.message, callback.from_user.id, query, page, edit=True)
+    await callback.answer()
+
+# === КАРТОЧКА СДЕЛКИ ===
+
+@router.callback_query(F.data.startswith("view_deal_"))
+async def view_deal(callback: CallbackQuery):
+    """Карточка сделки из списка сделок или результатов поиска"""
+    card = await deal_cards.get(int(callback.data.split("_")[2]), callback.from_user.id)
+    if not card:
+        await callback.answer("❌ Сделка не найдена!", show_alert=True)
+        return
+    
+    text, markup = card
+    await callback.message.answer(text, reply_markup=markup, parse_mode="Markdown")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("refresh_deal_"))
+async def refresh_deal(callback: CallbackQuery):
+    """Обновление карточки сделки"""
+    card = await deal_cards.get(int(callback.data.split("_")[2]), callback.from_user.id)
+    if not card:
+        await callback.answer("❌ Сделка не найдена!", show_alert=True)
+        return
+    
+    text, markup = card
+    try:
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode="Markdown")
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+        await callback.answer("🔄 Изменений нет")
+        return
+    await callback.answer("✅ Статус обновлен")
+
+# === ВЫГРУЗКА СДЕЛОК ===
+
+async def send_deals_export(message: Message, batches, fmt: str, filename: str, caption: str):
+    """Выгрузка сделок и отправка файлом"""
+    try:
+        async with deal_exporter.export(batches, fmt) as (path, rows):
+            if not rows:
+                await message.answer("📭 Сделок для выгрузки нет.")
+                return
+            await message.answer_document(
+                FSInputFile(path, filename=f"{filename}.{fmt}.gz"),
+                caption=f"{caption}\n\nСделок: {rows}"
+            )
+    except ExportTooLargeError:
+        await message.answer("❌ Выгрузка слишком большая для отправки. Выберите период короче.")
+
+@router.message(Command("export"))
+async def export_my_deals(message: Message, command: CommandObject):
+    """Выгрузка своих сделок: /export [csv|jsonl]"""
+    fmt = (command.args or 'csv').strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("❌ Формат: /export csv или /export jsonl")
+        return
+    
+    user_id = message.from_user.id
+    await send_deals_export(
+        message, db.stream_deals_export(user_id=user_id), fmt,
+        f"deals_{user_id}", "📄 Выписка по вашим сделкам"
+    )
+
+@router.message(Command("admin_export"))
+async def export_deals_by_period(message: Message, command: CommandObject):
+    """Выгрузка сделок за период для администраторов: /admin_export ДД.ММ.ГГГГ ДД.ММ.ГГГГ [csv|jsonl]"""
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    args = (command.args or '').split()
+    try:
+        date_from = datetime.strptime(args[0], '%d.%m.%Y')
+        date_to = datetime.strptime(args[1], '%d.%m.%Y')
+        fmt = args[2].lower() if len(args) > 2 else 'csv'
+    except (IndexError, ValueError):
+        fmt = None
+    if fmt not in EXPORT_FORMATS or date_from > date_to:
+        await message.answer("❌ Формат: /admin_export 01.01.2025 31.01.2025 [csv|jsonl]")
+        return
+    
+    # Конечная дата включается целиком
+    batches = db.stream_deals_export(created_from=date_from, created_to=date_to + timedelta(days=1))
+    await send_deals_export(
+        message, batches, fmt,
+        f"deals_{date_from:%Y%m%d}_{date_to:%Y%m%d}",
+        f"📄 Сделки с {args[0]} по {args[1]}"
+    )
+
+# === ЧАТ СДЕЛКИ ===
+
+async def enter_deal_chat(message: Message, deal: dict, user: User, state: FSMContext):
+    """Вход в чат сделки"""
+    if deal_chat.get_counterpart_id(deal, user.id) is None:
+        await message.answer("❌ Чат доступен только участникам сделки после присоединения партнера.")
+        return
+    
+    if deal['archived']:
+        await message.answer("📦 Сделка перенесена в архив, чат по ней закрыт.")
+        return
+    
+    await state.set_state(DealChatStates.in_chat)
+    await state.update_data(chat_deal_id=deal['id'])
+    
+    await message.answer(
+        texts.render('deal_chat_opened', user.language_code, deal_code=deal['deal_code']),
+        reply_markup=keyboards.get_deal_chat_keyboard(deal['id']),
+        parse_mode="Markdown"
+    )
+
+@router.message(Command("chat"))
+async def cmd_chat(message: Message, state: FSMContext):
+    """Открытие чата сделки по коду"""
+    args = message.text.split()
+    if len(args) < 2:
+        await message.answer("💬 Укажите код сделки: /chat КОД")
+        return
+    
+    deal = await db.get_deal_by_code(args[1].upper())
+    if not deal:
+        await message.answer("❌ Сделка не найдена!")
+        return
+    
+    await enter_deal_chat(message, deal, message.from_user, state)
+
+@router.callback_query(F.data.startswith("open_chat_"))
+async def open_deal_chat(callback: CallbackQuery, state: FSMContext):
+    """Открытие чата сделки по кнопке"""
+    deal = await db.get_deal_by_id(int(callback.data.split("_")[2]))
+    if not deal:
+        await callback.answer("❌ Сделка не найдена!", show_alert=True)
+        return
+    
+    await enter_deal_chat(callback.message, deal, callback.from_user, state)
+    await callback.answer()
+
+@router.message(Command("exit"), StateFilter(DealChatStates.in_chat))
+async def cmd_exit_chat(message: Message, state: FSMContext):
+    """Выход из чата сделки"""
+    await state.clear()
+    await message.answer("🚪 Вы вышли из чата сделки.", reply_markup=keyboards.get_main_menu())
+
+@router.callback_query(F.data == "close_deal_chat")
+async def close_deal_chat(callback: CallbackQuery, state: FSMContext):
+    """Выход из чата сделки по кнопке"""
+    await state.clear()
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.message.answer("🚪 Вы вышли из чата сделки.", reply_markup=keyboards.get_main_menu())
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("chat_history_"))
+async def show_deal_chat_history(callback: CallbackQuery):
+    """Показ истории чата сделки постранично"""
+    _, _, deal_id, before_id = callback.data.split("_")
+    deal = await db.get_deal_by_id(int(deal_id))
+    
+    if not deal or deal_chat.get_counterpart_id(deal, callback.from_user.id) is None:
+        await callback.answer("❌ История недоступна!", show_alert=True)
+        return
+    
+    messages = await deal_chat.get_history(deal['id'], int(before_id) or None, DEAL_CHAT_HISTORY_PAGE)
+    if not messages:
+        await callback.answer("📜 Сообщений больше нет", show_alert=True)
+        return
+    
+    lines = []
+    for chat_message in reversed(messages):
+        author = "Вы" if chat_message['user_id'] == callback.from_user.id else "Партнер"
+        text = escape(chat_message['message_text'] or '') or "📎 Вложение"
+        lines.append(f"<b>{author}</b> ({chat_message['created_at'].strftime('%d.%m %H:%M')}): {text}")
+    
+    await callback.message.answer(
+        f"📜 <b>История сделки #{deal['deal_code']}</b>\n\n" + "\n".join(lines),
+        reply_markup=keyboards.get_deal_chat_keyboard(deal['id'], messages[-1]['id']),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+@router.message(StateFilter(DealChatStates.in_chat))
+async def relay_deal_message(message: Message, state: FSMContext, bot: Bot):
+    """Пересылка сообщения партнеру по сделке"""
+    data = await state.get_data()
+    deal = await db.get_deal_by_id(data['chat_deal_id'])
+    counterpart_id = deal_chat.get_counterpart_id(deal, message.from_user.id) if deal else None
+    
+    if counterpart_id is None or deal['archived']:
+        await state.clear()
+        await message.answer("❌ Чат сделки недоступен.", reply_markup=keyboards.get_main_menu())
+        return
+    
+    header = f"💬 <b>Сделка #{deal['deal_code']}</b> — {escape(message.from_user.first_name or '')}:"
+    text = message.text or message.caption
+    file_id = None
+    if message.photo:
+        file_id = message.photo[-1].file_id
+    elif message.document:
+        file_id = message.document.file_id
+    
+    try:
+        if message.text:
+            await bot.send_message(
+                counterpart_id,
+                f"{header}\n\n{escape(message.text)}",
+                reply_markup=keyboards.get_open_chat_keyboard(deal['id']),
+                parse_mode="HTML"
+            )
+        else:
+            await message.copy_to(
+                counterpart_id,
+                caption=f"{header}\n\n{escape(text or '')}",
+                reply_markup=keyboards.get_open_chat_keyboard(deal['id']),
+                parse_mode="HTML"
+            )
+    except Exception as e:
+        logger.error(f"Deal chat relay error: {e}")
+        await message.answer("❌ Не удалось доставить сообщение партнеру.")
+        return
+    
+    deal_chat.record(deal['id'], message.from_user.id, text, file_id)
+
 # === ОТМЕНА ДЕЙСТВИЙ ===
 
 @router.callback_query(F.data.in_(["cancel_action", "cancel_deal_creation", "cancel_payment"]))
@@ -770,5 +1214,17 @@ A: Сервис бесплатный, комиссия только сети.
         parse_mode="Markdown"
     )
 
+# === ОБРАБОТКА ОШИБОК ===
+
+@router.errors(ExceptionTypeFilter(DatabaseBusyError))
+async def handle_database_busy(event: ErrorEvent):
+    """Быстрый ответ при перегрузке базы данных"""
+    busy_text = "⏳ Сервис сейчас перегружен. Попробуйте еще раз через несколько секунд."
+    
+    if event.update.callback_query:
+        await event.update.callback_query.answer(busy_text, show_alert=True)
+    elif event.update.message:
+        await event.update.message.answer(busy_text)
+
 # Экспорт роутера
 __all__ = ['router']
\ No newline at end of file
@@ -0,0 +1,97 @@
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from config import IDEMPOTENCY_BACKEND, REDIS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Значение ключа, пока первый обработчик не завершился
+PENDING = 'pending'
+
+class MemoryIdempotencyStore:
+    """Ключи обработанных апдейтов в памяти процесса
+
+    Подходит для одного экземпляра бота. Просроченные ключи удаляются
+    проходом по словарю не чаще раза в sweep_interval секунд.
+    """
+
+    def __init__(self, sweep_interval: float = 60):
+        self.entries: Dict[str, Tuple[float, str]] = {}
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now: float):
+        self.entries = {key: entry for key, entry in self.entries.items() if entry[0] > now}
+        self._last_sweep = now
+
+    async def claim(self, key: str, ttl: float) -> Tuple[bool, Optional[str]]:
+        """Захват ключа: (True, None) для первого вызова, иначе (False, сохраненное значение)"""
+        now = time.monotonic()
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(now)
+
+        entry = self.entries.get(key)
+        if entry and entry[0] > now:
+            return False, entry[1]
+        self.entries[key] = (now + ttl, PENDING)
+        return True, None
+
+    async def complete(self, key: str, value: str, ttl: float):
+        """Сохранение результата обработки"""
+        self.entries[key] = (time.monotonic() + ttl, value)
+
+    async def release(self, key: str):
+        """Освобождение ключа после ошибки, чтобы повтор обработался заново"""
+        self.entries.pop(key, None)
+
+    async def close(self):
+        pass
+
+class RedisIdempotencyStore:
+    """Ключи обработанных апдейтов в Redis
+
+    Общие для нескольких экземпляров бота. Захват - атомарный SET NX с
+    временем жизни, просроченные ключи удаляет сам Redis.
+    """
+
+    def __init__(self, prefix: str = 'idempotency:'):
+        from redis.asyncio import Redis
+        self.redis = Redis(**REDIS_CONFIG, decode_responses=True)
+        self.prefix = prefix
+
+    async def claim(self, key: str, ttl: float) -> Tuple[bool, Optional[str]]:
+        key = self.prefix + key
+        if await self.redis.set(key, PENDING, nx=True, px=int(ttl * 1000)):
+            return True, None
+        return False, await self.redis.get(key)
+
+    async def complete(self, key: str, value: str, ttl: float):
+        await self.redis.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    async def release(self, key: str):
+        await self.redis.delete(self.prefix + key)
+
+    async def close(self):
+        await self.redis.aclose()
+
+def create_idempotency_store(backend: str = IDEMPOTENCY_BACKEND):
+    """Создание хранилища ключей по имени бэкенда из конфигурации"""
+    if backend == 'memory':
+        return MemoryIdempotencyStore()
+    if backend == 'redis':
+        return RedisIdempotencyStore()
+    raise ValueError(f"Unknown idempotency backend: {backend}")
+
+def encode_answer(text: Optional[str] = None, show_alert: Optional[bool] = None) -> str:
+    """Ответ на нажатие кнопки в виде значения ключа"""
+    return json.dumps({'text': text, 'show_alert': show_alert}, ensure_ascii=False)
+
+def decode_answer(value: Optional[str]) -> Dict:
+    """Сохраненный ответ; для незавершенной обработки - пустой ответ"""
+    if not value or value == PENDING:
+        return {}
+    return json.loads(value)
+
+# Создание глобального хранилища ключей идемпотентности
+idempotency_store = create_idempotency_store()
@@ -15,8 +15,10 @@ class BotKeyboards:
         builder.add(KeyboardButton(text="👤 Профиль"))
         builder.add(KeyboardButton(text="📋 Мои сделки"))
         builder.add(KeyboardButton(text="🆘 Поддержка"))
+        builder.add(KeyboardButton(text="🏆 Топ участников"))
+        builder.add(KeyboardButton(text="🔍 Поиск сделок"))
         
-        builder.adjust(2, 2)
+        builder.adjust(2, 2, 2)
         
         return builder.as_markup(
             resize_keyboard=True,
@@ -81,27 +83,27 @@ class BotKeyboards:
         return builder.as_markup()
     
     @staticmethod
-    def get_deal_actions(deal_status: str = None) -> InlineKeyboardMarkup:
+    def get_deal_actions(deal_id: int, deal_status: str = None, role: str = 'creator') -> InlineKeyboardMarkup:
         """Действия в сделке"""
         builder = InlineKeyboardBuilder()
         
-        if deal_status == "payment_pending":
+        if deal_status == "payment_pending" and role == 'creator':
             builder.add(InlineKeyboardButton(
                 text="✅ Подтвердить оплату",
-                callback_data="confirm_payment"
+                callback_data=f"confirm_payment_{deal_id}"
             ))
         
-        builder.add(InlineKeyboardButton(
-            text="❌ Отменить сделку",
-            callback_data="cancel_deal"
-        ))
-        
-        if deal_status == "payment_pending":
+        if role != 'admin':
             builder.add(InlineKeyboardButton(
-                text="🔄 Обновить статус",
-                callback_data="refresh_deal"
+                text="❌ Отменить сделку",
+                callback_data="cancel_deal"
             ))
         
+        builder.add(InlineKeyboardButton(
+            text="🔄 Обновить статус",
+            callback_data=f"refresh_deal_{deal_id}"
+        ))
+        
         builder.adjust(1)
         return builder.as_markup()
     
@@ -229,5 +231,78 @@ class BotKeyboards:
         builder.adjust(1, 2)
         return builder.as_markup()
 
+    @staticmethod
+    def get_open_chat_keyboard(deal_id: int) -> InlineKeyboardMarkup:
+        """Кнопка перехода в чат сделки"""
+        builder = InlineKeyboardBuilder()
+        
+        builder.add(InlineKeyboardButton(
+            text="💬 Чат сделки",
+            callback_data=f"open_chat_{deal_id}"
+        ))
+        
+        return builder.as_markup()
+    
+    @staticmethod
+    def get_deal_chat_keyboard(deal_id: int, before_id: int = None) -> InlineKeyboardMarkup:
+        """Клавиатура чата сделки"""
+        builder = InlineKeyboardBuilder()
+        
+        builder.add(InlineKeyboardButton(
+            text="📜 История" if before_id is None else "⬅️ Ранее",
+            callback_data=f"chat_history_{deal_id}_{before_id or 0}"
+        ))
+        builder.add(InlineKeyboardButton(
+            text="🚪 Выйти из чата",
+            callback_data="close_deal_chat"
+        ))
+        
+        builder.adjust(2)
+        return builder.as_markup()
+    
+    @staticmethod
+    def get_search_results_keyboard(deals: List[Dict], page: int, has_next: bool) -> InlineKeyboardMarkup:
+        """Страница результатов поиска сделок"""
+        builder = InlineKeyboardBuilder()
+        
+        for deal in deals:
+            status_emoji = {
+                'created': '🟡',
+                'joined': '🔵',
+                'payment_pending': '🟠',
+                'completed': '✅',
+                'cancelled': '❌',
+                'disputed': '🔴'
+            }.get(deal['status'], '❓')
+            
+            builder.row(InlineKeyboardButton(
+                text=f"{status_emoji} {deal['deal_code']} - ${deal['amount_usd']}",
+                callback_data=f"view_deal_{deal['id']}"
+            ))
+        
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"search_page_{page - 1}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"search_page_{page + 1}"))
+        if navigation:
+            builder.row(*navigation)
+        
+        return builder.as_markup()
+    
+    @staticmethod
+    def get_rate_deal_keyboard(deal_id: int) -> InlineKeyboardMarkup:
+        """Оценка партнера по завершенной сделке"""
+        builder = InlineKeyboardBuilder()
+        
+        for score in range(1, 6):
+            builder.add(InlineKeyboardButton(
+                text=f"{score}⭐",
+                callback_data=f"rate_deal_{deal_id}_{score}"
+            ))
+        
+        builder.adjust(5)
+        return builder.as_markup()
+
 # Создание экземпляра класса
 keyboards = BotKeyboards()
\ No newline at end of file
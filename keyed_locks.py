@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional
+from config import KEYED_LOCK_SHARDS, KEYED_LOCK_IDLE_TTL, KEYED_LOCK_SWEEP_INTERVAL, KEYED_LOCK_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class LockEntry:
+    """Блокировка ключа и число апдейтов, которые ее держат или ждут"""
+
+    __slots__ = ('lock', 'refs', 'last_used')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+        self.last_used = time.monotonic()
+
+class KeyedLocks:
+    """Блокировки по ключам (пользователь, сделка)
+
+    Апдейты с общим ключом выполняются по очереди, с разными - параллельно.
+    Ключи распределены по шардам; фоновая очистка обходит шарды по одному и
+    удаляет блокировки, которые никто не держит дольше KEYED_LOCK_IDLE_TTL.
+    Несколько ключей захватываются в отсортированном порядке, поэтому
+    взаимных блокировок нет.
+    """
+
+    def __init__(self, shards: int = KEYED_LOCK_SHARDS, idle_ttl: float = KEYED_LOCK_IDLE_TTL):
+        self.shards: List[Dict[str, LockEntry]] = [{} for _ in range(shards)]
+        self.idle_ttl = idle_ttl
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'acquires': 0,
+            'contended': 0,
+            'timeouts': 0,
+            'removed': 0,
+            'max_wait_ms': 0.0,
+            'total_wait_ms': 0.0
+        }
+
+    def _entry(self, key: str) -> LockEntry:
+        shard = self.shards[hash(key) % len(self.shards)]
+        entry = shard.get(key)
+        if entry is None:
+            entry = shard[key] = LockEntry()
+        entry.refs += 1
+        return entry
+
+    @staticmethod
+    async def _acquire(lock: asyncio.Lock, timeout: float):
+        """Захват блокировки не дольше timeout секунд (иначе asyncio.TimeoutError)
+
+        wait_for(lock.acquire()) может сообщить о таймауте, когда блокировка уже
+        получена, и она осталась бы занятой навсегда. Поэтому захват идет в
+        отдельной задаче, и если ее перестали ждать, полученная ею блокировка
+        сразу отпускается.
+        """
+        task = asyncio.ensure_future(lock.acquire())
+
+        def release_if_acquired(done: asyncio.Task):
+            if not done.cancelled():
+                lock.release()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout)
+        except BaseException:
+            task.cancel()
+            task.add_done_callback(release_if_acquired)
+            raise
+
+    @asynccontextmanager
+    async def hold(self, keys: Iterable[str], timeout: float = KEYED_LOCK_TIMEOUT):
+        """Выполнение блока под блокировками всех ключей
+
+        Если блокировки не получены за timeout секунд (зависший обработчик),
+        блок выполняется без них, чтобы не терять апдейты пользователя.
+        """
+        entries = [self._entry(key) for key in sorted(set(keys))]
+        acquired = []
+        started = time.perf_counter()
+        try:
+            try:
+                for entry in entries:
+                    if entry.lock.locked():
+                        self.stats['contended'] += 1
+                        remaining = timeout - (time.perf_counter() - started)
+                        await self._acquire(entry.lock, max(remaining, 0))
+                    else:
+                        await entry.lock.acquire()
+                    acquired.append(entry)
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                logger.warning(f"Keyed lock timeout after {timeout} s: {sorted(set(keys))}")
+                for entry in acquired:
+                    entry.lock.release()
+                acquired = []
+
+            wait_ms = (time.perf_counter() - started) * 1000
+            self.stats['acquires'] += 1
+            self.stats['total_wait_ms'] += wait_ms
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+
+            yield
+        finally:
+            for entry in acquired:
+                entry.lock.release()
+            now = time.monotonic()
+            for entry in entries:
+                entry.refs -= 1
+                entry.last_used = now
+
+    def sweep(self, shard: Dict[str, LockEntry]) -> int:
+        """Удаление простаивающих блокировок шарда"""
+        cutoff = time.monotonic() - self.idle_ttl
+        idle = [key for key, entry in shard.items() if not entry.refs and entry.last_used < cutoff]
+        for key in idle:
+            del shard[key]
+        self.stats['removed'] += len(idle)
+        return len(idle)
+
+    async def _run(self):
+        # Полный обход всех шардов занимает KEYED_LOCK_SWEEP_INTERVAL
+        pause = KEYED_LOCK_SWEEP_INTERVAL / len(self.shards)
+        while True:
+            for shard in self.shards:
+                await asyncio.sleep(pause)
+                self.sweep(shard)
+
+    def start(self):
+        """Запуск фоновой очистки"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['keys'] = sum(len(shard) for shard in self.shards)
+        stats['avg_wait_ms'] = stats['total_wait_ms'] / stats['acquires'] if stats['acquires'] else 0.0
+        return stats
+
+# Создание глобального экземпляра блокировок по ключам
+keyed_locks = KeyedLocks()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from html import escape
+from typing import Dict, List, Optional
+from database import db
+from config import (
+    LEADERBOARD_SIZE, LEADERBOARD_ADMIN_SIZE, LEADERBOARD_REFRESH_INTERVAL, LEADERBOARD_REFRESH_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+class Leaderboard:
+    """Топ пользователей по рейтингу и успешным сделкам
+
+    Готовые тексты (для пользователей и для администраторов) хранятся в
+    памяти и перестраиваются одним запросом по индексу раз в
+    LEADERBOARD_REFRESH_INTERVAL секунд или вскоре после изменения счетчиков.
+    Показ топа к базе не обращается.
+    """
+
+    def __init__(self):
+        self.texts: Dict[str, str] = {}
+        self._refresh_lock: Optional[asyncio.Lock] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'views': 0, 'cache_misses': 0, 'refreshes': 0, 'last_refresh_ms': 0.0}
+
+    @staticmethod
+    def _display_name(user: Dict) -> str:
+        if user['username']:
+            return f"@{escape(user['username'])}"
+        return escape(user['first_name'] or f"ID {user['user_id']}")
+
+    def render(self, users: List[Dict]) -> str:
+        """Топ для пользователей"""
+        if not users:
+            return "🏆 <b>Топ участников</b>\n\nПока нет завершенных сделок."
+
+        lines = ["🏆 <b>Топ участников</b>\n"]
+        medals = {1: '🥇', 2: '🥈', 3: '🥉'}
+        for place, user in enumerate(users[:LEADERBOARD_SIZE], start=1):
+            lines.append(
+                f"{medals.get(place, f'{place}.')} {self._display_name(user)} — "
+                f"⭐ {user['rating']} · ✅ {user['successful_deals']}"
+            )
+        return "\n".join(lines)
+
+    def render_admin(self, users: List[Dict]) -> str:
+        """Топ для администраторов: больше строк и служебные поля"""
+        lines = [f"🏆 <b>Топ участников</b> (первые {LEADERBOARD_ADMIN_SIZE})\n"]
+        for place, user in enumerate(users[:LEADERBOARD_ADMIN_SIZE], start=1):
+            success_rate = user['successful_deals'] * 100 // user['deals_count'] if user['deals_count'] else 0
+            lines.append(
+                f"{place}. <code>{user['user_id']}</code> {self._display_name(user)} — "
+                f"⭐ {user['rating']} ({user['ratings_count']} оц.) · "
+                f"✅ {user['successful_deals']}/{user['deals_count']} ({success_rate}%)"
+            )
+        if not users:
+            lines.append("Пока нет завершенных сделок.")
+        return "\n".join(lines)
+
+    async def _load(self):
+        started = time.perf_counter()
+        users = await db.get_top_users(max(LEADERBOARD_SIZE, LEADERBOARD_ADMIN_SIZE))
+        self.texts = {'user': self.render(users), 'admin': self.render_admin(users)}
+        self.stats['refreshes'] += 1
+        self.stats['last_refresh_ms'] = (time.perf_counter() - started) * 1000
+
+    async def refresh(self):
+        """Перестроение кэша"""
+        async with self._refresh_lock:
+            await self._load()
+
+    async def get_text(self, admin: bool = False) -> str:
+        """Текст топа из кэша"""
+        self.stats['views'] += 1
+        if not self.texts:
+            # Кэш еще не построен: параллельные показы ждут одну загрузку
+            async with self._refresh_lock:
+                if not self.texts:
+                    self.stats['cache_misses'] += 1
+                    await self._load()
+        return self.texts['admin' if admin else 'user']
+
+    def invalidate(self):
+        """Счетчики изменились: топ перестроится после небольшой задержки"""
+        if self._changed:
+            self._changed.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Leaderboard refresh error: {e}")
+
+            try:
+                await asyncio.wait_for(self._changed.wait(), LEADERBOARD_REFRESH_INTERVAL)
+                # Изменения за время задержки попадут в одно обновление
+                await asyncio.sleep(LEADERBOARD_REFRESH_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+
+    def start(self):
+        """Запуск фонового обновления"""
+        self._refresh_lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats)
+
+# Создание глобального экземпляра топа пользователей
+leaderboard = Leaderboard()
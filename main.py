@@ -4,11 +4,27 @@ import sys
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, CAPTCHA_IMAGE_ENABLED
+from telegram_session import TunedAiohttpSession
 from database import db
+from deal_chat import deal_message_buffer
+from payment_watcher import payment_watcher
+from deposit_addresses import deposit_pool
+from rate_oracle import rate_oracle
+from leaderboard import leaderboard
+from deal_archiver import deal_archiver
+from captcha_bank import captcha_bank
+from retention import retention_engine
 from handlers import router
+from middlewares import (
+    ThrottlingMiddleware, UserDatabaseContextMiddleware, UpdateSerializationMiddleware,
+    FSMWriteBehindMiddleware, CallbackIdempotencyMiddleware, CallbackAnswerRecorder
+)
+from fsm_storage import fsm_storage, DatabaseStorage
+from keyed_locks import keyed_locks
+from throttling import throttler
+from idempotency import idempotency_store
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,6 +37,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def create_bot() -> Bot:
+    """Бот с настроенной HTTP-сессией и записью ответов на нажатия кнопок"""
+    bot = Bot(
+        token=BOT_TOKEN,
+        session=TunedAiohttpSession(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    bot.session.middleware(CallbackAnswerRecorder())
+    return bot
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер с хранилищем FSM, middleware и обработчиками"""
+    # Хранилище FSM выбирается в конфигурации (FSM_STORAGE)
+    dp = Dispatcher(storage=fsm_storage)
+    
+    # Лимиты частоты и общей нагрузки проверяются до любой обработки
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    
+    # Чтения пользователя после его записи идут в основную БД, а не в реплику
+    dp.update.outer_middleware(UserDatabaseContextMiddleware())
+    
+    # Апдейты одного пользователя и одной сделки обрабатываются по очереди
+    dp.update.outer_middleware(UpdateSerializationMiddleware())
+    
+    # Изменения FSM в базе записываются одним запросом в конце апдейта
+    if isinstance(fsm_storage, DatabaseStorage):
+        dp.update.outer_middleware(FSMWriteBehindMiddleware(fsm_storage))
+    
+    # Повторные нажатия кнопок отвечают сохраненным ответом без повторной обработки
+    dp.callback_query.outer_middleware(CallbackIdempotencyMiddleware())
+    
+    # Подключаем роутер с обработчиками
+    dp.include_router(router)
+    return dp
+
+async def start_services(bot: Bot, singletons: bool = True):
+    """Подключение к базе данных и запуск фоновых задач
+
+    singletons=False - без задач, которые должны работать в одном процессе
+    (пополнение пула адресов, архивация, очистка, проверка оплат), для воркеров
+    многопроцессного режима кроме первого.
+    """
+    # Подключаемся к базе данных
+    logger.info("Connecting to database...")
+    await db.connect()
+    logger.info("Database connected successfully!")
+    
+    # Запускаем отложенную запись сообщений сделок
+    deal_message_buffer.start()
+    
+    rate_oracle.start()
+    leaderboard.start()
+    keyed_locks.start()
+    throttler.start()
+    
+    # Капчи-картинки рисуются заранее в отдельных процессах
+    if CAPTCHA_IMAGE_ENABLED:
+        captcha_bank.start()
+    
+    # Запускаем пополнение пула депозитных адресов, архивацию, очистку и проверку оплат
+    if singletons:
+        deposit_pool.start()
+        deal_archiver.start()
+        retention_engine.start()
+        await payment_watcher.start(bot)
+
+async def stop_services(bot: Bot):
+    """Остановка фоновых задач и закрытие соединений"""
+    await payment_watcher.stop()
+    await deposit_pool.stop()
+    await rate_oracle.stop()
+    await leaderboard.stop()
+    await deal_archiver.stop()
+    await retention_engine.stop()
+    await keyed_locks.stop()
+    await throttler.stop()
+    await captcha_bank.stop()
+    await deal_message_buffer.stop()
+    await idempotency_store.close()
+    await fsm_storage.close()
+    await db.close()
+    await bot.session.close()
+
 async def main():
     """Главная функция запуска бота"""
     
@@ -30,23 +129,11 @@ async def main():
         return
     
     # Создаем бота и диспетчер
-    bot = Bot(
-        token=BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
-    
-    # Используем MemoryStorage для FSM
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
-    
-    # Подключаем роутер с обработчиками
-    dp.include_router(router)
+    bot = create_bot()
+    dp = create_dispatcher()
     
     try:
-        # Подключаемся к базе данных
-        logger.info("Connecting to database...")
-        await db.connect()
-        logger.info("Database connected successfully!")
+        await start_services(bot)
         
         # Получаем информацию о боте
         bot_info = await bot.get_me()
@@ -76,8 +163,7 @@ async def main():
         logger.error(f"Error starting bot: {e}")
     finally:
         # Закрываем соединения
-        await db.close()
-        await bot.session.close()
+        await stop_services(bot)
         logger.info("Bot stopped and connections closed")
 
 if __name__ == "__main__":
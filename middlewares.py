@@ -0,0 +1,235 @@
+import logging
+import re
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.types import TelegramObject, CallbackQuery, Update
+
+from database import current_user_id
+from idempotency import idempotency_store, encode_answer, decode_answer
+from keyed_locks import keyed_locks
+from throttling import throttler, MUTED, MUTE_STARTED, THROTTLED
+from config import IDEMPOTENCY_TTL, IDEMPOTENCY_UPDATE_TTL, IDEMPOTENCY_SKIP_PREFIXES, ADMIN_IDS
+
+logger = logging.getLogger(__name__)
+
+class UserDatabaseContextMiddleware(BaseMiddleware):
+    """Привязка обработки апдейта к пользователю для маршрутизации чтений БД"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        token = current_user_id.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_user_id.reset(token)
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты апдейтов пользователя и общей нагрузки
+
+    Стоит первым: отклоненный апдейт не доходит до блокировок, FSM и БД.
+    Пользователь получает короткий ответ об ограничении не чаще раза в
+    THROTTLE_NOTICE_INTERVAL секунд, апдейты во время мьюта отбрасываются
+    молча. Администраторы не ограничиваются.
+    """
+
+    def __init__(self, limiter=throttler):
+        self.limiter = limiter
+
+    @staticmethod
+    def _kind(event: Update) -> Optional[str]:
+        if event.callback_query:
+            return 'callback'
+        if event.message:
+            text = event.message.text or ''
+            if text.startswith('/start'):
+                return 'start'
+            if text.startswith('/'):
+                return 'command'
+            return 'message'
+        return None
+
+    @staticmethod
+    async def _reply(event: Update, text: str):
+        try:
+            if event.callback_query:
+                await event.callback_query.answer(text)
+            else:
+                await event.message.answer(text)
+        except Exception as e:
+            logger.debug(f"Throttle notice failed: {e}")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        kind = self._kind(event)
+        if not user or not kind or user.id in ADMIN_IDS:
+            return await handler(event, data)
+
+        decision = self.limiter.check(user.id, kind)
+        if decision == MUTED:
+            return None
+        if decision == MUTE_STARTED:
+            await self._reply(
+                event, f"🔇 Слишком много запросов. Бот не отвечает вам {self.limiter.mute_remaining(user.id)} сек."
+            )
+            return None
+        if decision == THROTTLED:
+            if self.limiter.should_notify(user.id):
+                await self._reply(event, "⏳ Слишком часто, подождите пару секунд.")
+            return None
+
+        if not self.limiter.admit():
+            if self.limiter.should_notify(user.id):
+                await self._reply(event, "⚠️ Бот перегружен, повторите через минуту.")
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self.limiter.release()
+
+# Кнопки с ID сделки: view_deal_42, refresh_deal_42, confirm_payment_42, open_chat_42, rate_deal_42_5, chat_history_42_0
+DEAL_ID_CALLBACK = re.compile(r'^(?:view_deal|refresh_deal|confirm_payment|open_chat|rate_deal|chat_history)_(\d+)')
+
+class UpdateSerializationMiddleware(BaseMiddleware):
+    """Последовательная обработка апдейтов одного пользователя и одной сделки
+
+    Апдейт выполняется под блокировками пользователя и сделки, к которой он
+    относится (из данных кнопки или чата сделки в FSM), поэтому быстрый ввод
+    и повторные нажатия не перемешивают update_data и записи в БД. Просмотр
+    сделки по ссылке и присоединение к ней сделку не блокируют: переход в
+    joined проверяется в самом UPDATE (transition_deal), и проверка пароля
+    одних участников не задерживает других. Апдейты разных пользователей по
+    разным сделкам идут параллельно.
+    """
+
+    def __init__(self, locks=keyed_locks):
+        self.locks = locks
+
+    async def _keys(self, event: Update, data: Dict[str, Any]) -> List[str]:
+        user = data.get('event_from_user')
+        if not user:
+            return []
+        keys = [f"user:{user.id}"]
+
+        if event.callback_query and event.callback_query.data:
+            match = DEAL_ID_CALLBACK.match(event.callback_query.data)
+            if match:
+                keys.append(f"deal:{match.group(1)}")
+
+        state = data.get('state')
+        if state:
+            state_data = await state.get_data()
+            if 'chat_deal_id' in state_data:
+                keys.append(f"deal:{state_data['chat_deal_id']}")
+        return keys
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        keys = await self._keys(event, data)
+        if not keys:
+            return await handler(event, data)
+        async with self.locks.hold(keys):
+            return await handler(event, data)
+
+# Ответ на обрабатываемое нажатие кнопки (заполняется CallbackAnswerRecorder)
+current_callback_answer: ContextVar[Optional[Dict]] = ContextVar('current_callback_answer', default=None)
+
+class FSMWriteBehindMiddleware(BaseMiddleware):
+    """Запись изменений FSM одним запросом в конце апдейта
+
+    Стоит внутри блокировок пользователя, поэтому следующий апдейт того же
+    пользователя начинается после записи.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.storage.batch():
+            return await handler(event, data)
+
+class CallbackIdempotencyMiddleware(BaseMiddleware):
+    """Однократная обработка нажатий кнопок
+
+    Повторно доставленный апдейт (тот же update_id) отбрасывается. Повторное
+    нажатие той же кнопки того же сообщения в течение IDEMPOTENCY_TTL секунд
+    не запускает обработчик: пользователь получает сохраненный ответ первого
+    нажатия (или пустой, если оно еще обрабатывается). После ошибки ключи
+    освобождаются, и нажатие можно повторить.
+    """
+
+    def __init__(self, store=idempotency_store):
+        self.store = store
+        self.stats = {'processed': 0, 'duplicate_updates': 0, 'duplicate_taps': 0}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any]
+    ) -> Any:
+        if event.data and event.data.startswith(IDEMPOTENCY_SKIP_PREFIXES):
+            return await handler(event, data)
+
+        update_key = f"update:{data['event_update'].update_id}"
+        claimed, _ = await self.store.claim(update_key, IDEMPOTENCY_UPDATE_TTL)
+        if not claimed:
+            # На исходный апдейт уже ответили
+            self.stats['duplicate_updates'] += 1
+            return None
+
+        message_id = event.message.message_id if event.message else event.inline_message_id
+        tap_key = f"callback:{event.from_user.id}:{message_id}:{event.data}"
+        claimed, value = await self.store.claim(tap_key, IDEMPOTENCY_TTL)
+        if not claimed:
+            self.stats['duplicate_taps'] += 1
+            await event.answer(**decode_answer(value))
+            return None
+
+        answer = {}
+        token = current_callback_answer.set(answer)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await self.store.release(tap_key)
+            await self.store.release(update_key)
+            raise
+        finally:
+            current_callback_answer.reset(token)
+
+        await self.store.complete(tap_key, encode_answer(**answer), IDEMPOTENCY_TTL)
+        self.stats['processed'] += 1
+        return result
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats)
+
+class CallbackAnswerRecorder(BaseRequestMiddleware):
+    """Запоминание ответа обработчика на нажатие для повторных нажатий"""
+
+    async def __call__(self, make_request, bot, method):
+        answer = current_callback_answer.get()
+        if answer is not None and isinstance(method, AnswerCallbackQuery):
+            answer.update(text=method.text, show_alert=method.show_alert)
+        return await make_request(bot, method)
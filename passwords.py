@@ -0,0 +1,176 @@
+"""Хеширование паролей сделок с версионированным форматом
+
+Хеш хранит алгоритм, параметры и соль:
+
+    $scrypt$n=16384,r=8,p=1$<соль base64>$<хеш base64>
+    $pbkdf2-sha256$i=600000$<соль base64>$<хеш base64>
+
+Старый формат `хеш_hex:соль` (PBKDF2-SHA256, 100000 итераций) проверяется
+как раньше. Хеши со старым форматом или устаревшими параметрами заменяются
+на хеш с текущими параметрами после успешной проверки пароля.
+
+Подбор параметров под целевое время хеширования на этом сервере:
+
+    python passwords.py calibrate --target-ms 100
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Dict, Optional, Tuple
+from config import PASSWORD_ALGORITHM, PASSWORD_PBKDF2_ITERATIONS, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+
+# Параметры хешей формата `хеш_hex:соль`
+LEGACY_PBKDF2_ITERATIONS = 100000
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip('=')
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+def _derive(algorithm: str, params: Dict[str, int], password: str, salt: bytes) -> bytes:
+    if algorithm == 'pbkdf2-sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['i'], HASH_BYTES)
+    if algorithm == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        # Память scrypt - 128 * n * r байт, лимит по умолчанию (32 МБ) берется с запасом
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=HASH_BYTES
+        )
+    raise ValueError(f"Unknown password algorithm: {algorithm}")
+
+class PasswordHasher:
+    """Хеширование и проверка паролей с текущими параметрами из конфигурации"""
+
+    def __init__(self, algorithm: str = PASSWORD_ALGORITHM, params: Dict[str, int] = None):
+        self.algorithm = algorithm
+        if params is None:
+            params = (
+                {'i': PASSWORD_PBKDF2_ITERATIONS} if algorithm == 'pbkdf2-sha256'
+                else {'n': PASSWORD_SCRYPT_N, 'r': PASSWORD_SCRYPT_R, 'p': PASSWORD_SCRYPT_P}
+            )
+        self.params = params
+        self.stats = {'hashed': 0, 'verified': 0, 'rehashed': 0}
+
+    @staticmethod
+    def _format_params(params: Dict[str, int]) -> str:
+        return ','.join(f"{key}={value}" for key, value in params.items())
+
+    @staticmethod
+    def _parse(hashed: str) -> Tuple[str, Dict[str, int], bytes, bytes]:
+        """Разбор хеша: (алгоритм, параметры, соль, хеш)"""
+        if not hashed.startswith('$'):
+            password_hash, salt = hashed.split(':')
+            return 'pbkdf2-sha256', {'i': LEGACY_PBKDF2_ITERATIONS}, salt.encode(), bytes.fromhex(password_hash)
+
+        _, algorithm, params, salt, password_hash = hashed.split('$')
+        params = {key: int(value) for key, value in (item.split('=') for item in params.split(','))}
+        return algorithm, params, _b64decode(salt), _b64decode(password_hash)
+
+    def hash(self, password: str) -> str:
+        """Хеш пароля с текущими параметрами"""
+        salt = secrets.token_bytes(SALT_BYTES)
+        password_hash = _derive(self.algorithm, self.params, password, salt)
+        self.stats['hashed'] += 1
+        return f"${self.algorithm}${self._format_params(self.params)}${_b64encode(salt)}${_b64encode(password_hash)}"
+
+    def verify(self, password: str, hashed: str) -> bool:
+        """Проверка пароля (сравнение за постоянное время)"""
+        try:
+            algorithm, params, salt, password_hash = self._parse(hashed)
+            candidate = _derive(algorithm, params, password, salt)
+        except Exception:
+            return False
+        self.stats['verified'] += 1
+        return hmac.compare_digest(candidate, password_hash)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Хеш в старом формате или с параметрами, отличными от текущих"""
+        if not hashed.startswith('$'):
+            return True
+        _, algorithm, params, _, _ = hashed.split('$')
+        return algorithm != self.algorithm or params != self._format_params(self.params)
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Проверка пароля: (верен ли пароль, новый хеш, если старый нужно заменить)"""
+        if not self.verify(password, hashed):
+            return False, None
+        if self.needs_rehash(hashed):
+            self.stats['rehashed'] += 1
+            return True, self.hash(password)
+        return True, None
+
+    # Хеширование занимает десятки миллисекунд; hashlib отпускает GIL,
+    # поэтому в отдельном потоке оно не останавливает обработку апдейтов
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.to_thread(self.hash, password)
+
+    async def verify_and_update_async(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return await asyncio.to_thread(self.verify_and_update, password, hashed)
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats)
+
+# Создание глобального экземпляра хеширования паролей
+password_hasher = PasswordHasher()
+
+# === КАЛИБРОВКА ===
+
+def _measure_ms(algorithm: str, params: Dict[str, int], rounds: int = 3) -> float:
+    """Лучшее время хеширования из нескольких замеров, мс"""
+    salt = secrets.token_bytes(SALT_BYTES)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        _derive(algorithm, params, 'calibration-password', salt)
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+def calibrate_pbkdf2(target_ms: float) -> Tuple[Dict[str, int], float]:
+    """Число итераций PBKDF2 для целевого времени (время растет линейно)"""
+    probe = 100000
+    iterations = int(probe * target_ms / _measure_ms('pbkdf2-sha256', {'i': probe}))
+    # Округление до тысяч, чтобы параметры читались в .env
+    params = {'i': max(round(iterations, -3), 1000)}
+    return params, _measure_ms('pbkdf2-sha256', params)
+
+def calibrate_scrypt(target_ms: float, r: int = 8, p: int = 1) -> Tuple[Dict[str, int], float]:
+    """Наибольшая степень двойки n, при которой scrypt укладывается в целевое время"""
+    params = {'n': 2 ** 12, 'r': r, 'p': p}
+    elapsed = _measure_ms('scrypt', params)
+    while True:
+        candidate = dict(params, n=params['n'] * 2)
+        candidate_ms = _measure_ms('scrypt', candidate)
+        if candidate_ms > target_ms:
+            return params, elapsed
+        params, elapsed = candidate, candidate_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Параметры хеширования паролей сделок")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = subparsers.add_parser('calibrate', help="подбор параметров под целевое время")
+    calibrate_parser.add_argument('--target-ms', type=float, default=100, help="время хеширования, мс")
+    args = parser.parse_args()
+
+    pbkdf2_params, pbkdf2_ms = calibrate_pbkdf2(args.target_ms)
+    scrypt_params, scrypt_ms = calibrate_scrypt(args.target_ms)
+    print(f"⏱️ pbkdf2-sha256 i={pbkdf2_params['i']}: {pbkdf2_ms:.0f} мс")
+    print(f"⏱️ scrypt n={scrypt_params['n']} r={scrypt_params['r']} p={scrypt_params['p']}: "
+          f"{scrypt_ms:.0f} мс, {128 * scrypt_params['n'] * scrypt_params['r'] // 1024 // 1024} МБ памяти")
+    print("\nПараметры для .env:")
+    print("PASSWORD_ALGORITHM=scrypt")
+    print(f"PASSWORD_SCRYPT_N={scrypt_params['n']}")
+    print(f"PASSWORD_SCRYPT_R={scrypt_params['r']}")
+    print(f"PASSWORD_SCRYPT_P={scrypt_params['p']}")
+    print(f"PASSWORD_PBKDF2_ITERATIONS={pbkdf2_params['i']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+import aiohttp
+import asyncio
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+from aiogram import Bot
+
+from database import db
+from keyboards import keyboards
+from leaderboard import leaderboard
+from rate_oracle import PAYMENT_PRECISION
+from texts import texts
+from config import (
+    TRC20_ADDRESS, TON_ADDRESS, CHAIN_INDEXER_URL, CHAIN_INDEXER_API_KEY,
+    PAYMENT_POLL_INTERVAL, PAYMENT_POLL_PAGE_SIZE, PAYMENT_POLL_MAX_PAGES
+)
+
+logger = logging.getLogger(__name__)
+
+# Имя позиции сканирования в таблице payment_cursors
+CURSOR_NAME = 'chain_indexer'
+
+class PaymentWatcher:
+    """Фоновая проверка поступления оплаты по сделкам
+
+    За один цикл делается один запрос к индексатору по всем нашим адресам,
+    сколько бы сделок ни ожидало оплаты. Переводы сопоставляются со сделками
+    по депозитному адресу сделки или, для общих адресов, через индекс в
+    памяти по (способ оплаты, сумма, memo); найденные сделки
+    завершаются автоматически. Позиция сканирования хранится в БД, поэтому
+    после перезапуска история не сканируется заново.
+
+    API индексатора:
+    GET {CHAIN_INDEXER_URL}/transfers?addresses=A,B&cursor=C&limit=N ->
+    {"transfers": [{"tx_hash", "network", "to", "amount", "memo"}], "next_cursor", "has_more"}
+    """
+
+    def __init__(self, base_url: str = CHAIN_INDEXER_URL, poll_interval: int = PAYMENT_POLL_INTERVAL):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.poll_interval = poll_interval
+        self.bot: Optional[Bot] = None
+        self.cursor: Optional[str] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.stats = {
+            'polls': 0,
+            'poll_errors': 0,
+            'transfers_seen': 0,
+            'matched': 0,
+            'unmatched': 0,
+            'ambiguous': 0,
+            'last_poll_ms': 0.0,
+            'total_poll_ms': 0.0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.base_url)
+
+    @staticmethod
+    def get_watched_addresses(deals: List[Dict]) -> List[str]:
+        """Адреса, на которые принимаются платежи: общие и депозитные адреса сделок"""
+        addresses = [address for address in (TRC20_ADDRESS, TON_ADDRESS) if address]
+        addresses.extend(deal['deposit_address'] for deal in deals if deal.get('deposit_address'))
+        return addresses
+
+    @staticmethod
+    def normalize_amount(amount, payment_method: str = None) -> Optional[Decimal]:
+        try:
+            return Decimal(str(amount)).quantize(PAYMENT_PRECISION.get(payment_method, Decimal('0.01')))
+        except (InvalidOperation, ValueError):
+            return None
+
+    @staticmethod
+    def get_deal_memo(deal_code: str, payment_method: str) -> Optional[str]:
+        """Memo, которое покупатель указывает в переводе (только TON поддерживает комментарий)"""
+        return deal_code if payment_method == 'TON' else None
+
+    def get_expected_amount(self, deal: Dict) -> Optional[Decimal]:
+        """Сумма перевода, которую ожидаем по сделке
+
+        Берется сумма в монете, зафиксированная при выборе способа оплаты;
+        у сделок без нее - сумма в долларах.
+        """
+        amount = deal.get('payment_amount')
+        if amount is None:
+            amount = deal['amount_usd']
+        return self.normalize_amount(amount, deal['payment_method'])
+
+    def build_index(self, deals: List[Dict]) -> Tuple[Dict[str, Dict], Dict[Tuple, List[Dict]]]:
+        """Индексы ожидающих оплаты сделок
+
+        Сделки с собственным депозитным адресом сопоставляются по адресу,
+        остальные - по (способ, сумма, memo).
+        """
+        by_address: Dict[str, Dict] = {}
+        by_key: Dict[Tuple, List[Dict]] = {}
+        for deal in deals:
+            if deal.get('deposit_address'):
+                by_address[deal['deposit_address']] = deal
+                continue
+            key = (
+                deal['payment_method'],
+                self.get_expected_amount(deal),
+                self.get_deal_memo(deal['deal_code'], deal['payment_method'])
+            )
+            by_key.setdefault(key, []).append(deal)
+        return by_address, by_key
+
+    def match(self, transfer: Dict, by_address: Dict[str, Dict], by_key: Dict[Tuple, List[Dict]]) -> Optional[Dict]:
+        """Сделка, которую оплачивает перевод"""
+        amount = self.normalize_amount(transfer.get('amount'), transfer.get('network'))
+        deal = by_address.get(transfer.get('to'))
+        if deal:
+            expected = self.get_expected_amount(deal)
+            return deal if amount is not None and amount >= expected else None
+
+        candidates = by_key.get((transfer.get('network'), amount, transfer.get('memo') or None), [])
+        if len(candidates) > 1:
+            # Одинаковая сумма без memo: оплату нельзя однозначно отнести к сделке
+            self.stats['ambiguous'] += 1
+            logger.warning(f"Ambiguous transfer {transfer.get('tx_hash')} matches {len(candidates)} deals")
+            return None
+        return candidates[0] if candidates else None
+
+    async def fetch_transfers(self, addresses: List[str]) -> Tuple[List[Dict], Optional[str]]:
+        """Новые переводы на наши адреса и позиция, до которой они прочитаны"""
+        headers = {'X-API-Key': CHAIN_INDEXER_API_KEY} if CHAIN_INDEXER_API_KEY else {}
+        transfers = []
+        cursor = self.cursor
+
+        for _ in range(PAYMENT_POLL_MAX_PAGES):
+            params = {
+                'addresses': ','.join(addresses),
+                'limit': PAYMENT_POLL_PAGE_SIZE
+            }
+            if cursor:
+                params['cursor'] = cursor
+
+            async with self._session.get(f"{self.base_url}/transfers", params=params, headers=headers) as response:
+                response.raise_for_status()
+                payload = await response.json()
+
+            transfers.extend(payload.get('transfers', []))
+            cursor = payload.get('next_cursor') or cursor
+            if not payload.get('has_more'):
+                break
+
+        return transfers, cursor
+
+    async def poll_once(self) -> int:
+        """Один цикл проверки, возвращает количество завершенных сделок"""
+        started = time.perf_counter()
+
+        # Запрос делается и без ожидающих сделок, чтобы позиция не отставала
+        deals = await db.get_pending_payment_deals()
+        by_address, by_key = self.build_index(deals)
+        transfers, cursor = await self.fetch_transfers(self.get_watched_addresses(deals))
+        completed = 0
+        completed_ids = set()
+
+        for transfer in transfers:
+            self.stats['transfers_seen'] += 1
+            deal = self.match(transfer, by_address, by_key)
+            if not deal or deal['id'] in completed_ids:
+                self.stats['unmatched'] += 1
+                continue
+
+            if await db.complete_deal_payment(deal['id'], transfer.get('tx_hash')):
+                completed_ids.add(deal['id'])
+                completed += 1
+                self.stats['matched'] += 1
+                logger.info(f"Deal {deal['deal_code']} paid by transfer {transfer.get('tx_hash')}")
+                leaderboard.invalidate()
+                await self.notify_completed(deal)
+
+        # Позицию сдвигаем только после обработки переводов
+        if cursor != self.cursor:
+            await db.set_payment_cursor(CURSOR_NAME, cursor)
+            self.cursor = cursor
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats['polls'] += 1
+        self.stats['last_poll_ms'] = elapsed_ms
+        self.stats['total_poll_ms'] += elapsed_ms
+        return completed
+
+    async def notify_completed(self, deal: Dict):
+        """Уведомление участников о подтвержденной оплате"""
+        if not self.bot:
+            return
+
+        # Язык участников не хранится, поэтому локаль по умолчанию
+        text = texts.render('payment_received', deal_code=deal['deal_code'], amount=deal['amount_usd'])
+        for user_id in (deal['creator_id'], deal['participant_id']):
+            if not user_id:
+                continue
+            try:
+                await self.bot.send_message(
+                    user_id, text,
+                    reply_markup=keyboards.get_rate_deal_keyboard(deal['id']),
+                    parse_mode="Markdown"
+                )
+            except Exception as e:
+                logger.error(f"Payment notification error: {e}")
+
+    def poke(self):
+        """Внеочередная проверка (например, после нажатия «Я оплатил»)"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                self.stats['poll_errors'] += 1
+                logger.error(f"Payment watcher error: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self, bot: Bot):
+        """Запуск фоновой проверки оплат"""
+        if not self.enabled:
+            logger.info("Payment watcher disabled: CHAIN_INDEXER_URL is not set")
+            return
+
+        self.bot = bot
+        self.cursor = await db.get_payment_cursor(CURSOR_NAME)
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Payment watcher started from cursor {self.cursor}")
+
+    async def stop(self):
+        """Остановка фоновой проверки"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def get_stats(self) -> Dict:
+        """Метрики пропускной способности"""
+        polls = self.stats['polls']
+        total_seconds = self.stats['total_poll_ms'] / 1000
+        return {
+            **self.stats,
+            'avg_poll_ms': self.stats['total_poll_ms'] / polls if polls else 0.0,
+            'transfers_per_second': self.stats['transfers_seen'] / total_seconds if total_seconds else 0.0
+        }
+
+# Создание глобального экземпляра наблюдателя за оплатами
+payment_watcher = PaymentWatcher()
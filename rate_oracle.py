@@ -0,0 +1,151 @@
+import aiohttp
+import asyncio
+import logging
+import time
+from decimal import Decimal, InvalidOperation, ROUND_UP
+from typing import Dict, Optional, Tuple
+from config import RATE_FEED_URL, RATE_TTL, RATE_STALE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Монета, которой оплачивается сделка, для каждого способа оплаты
+PAYMENT_ASSETS = {
+    'TRC20': 'USDT',
+    'TON': 'TON'
+}
+
+# Точность суммы перевода для каждого способа оплаты
+PAYMENT_PRECISION = {
+    'TRC20': Decimal('0.01'),
+    'TON': Decimal('0.0001')
+}
+
+class RateUnavailableError(Exception):
+    """Курс не удалось получить ни из кэша, ни из источника"""
+
+class RateOracle:
+    """Курсы монет к USD с кэшированием
+
+    Свежий курс (моложе RATE_TTL) отдается из кэша. Устаревший, но не старше
+    RATE_STALE_TTL, тоже отдается сразу, а обновление запускается в фоне.
+    Параллельные запросы курса ждут один общий запрос к источнику. Фоновое
+    обновление держит кэш свежим, поэтому нажатие кнопки оплаты не ждет сеть.
+
+    Источник: GET {RATE_FEED_URL}?symbols=USDT,TON -> {"USDT": "1.0", "TON": "5.43"}
+    """
+
+    def __init__(self, feed_url: str = RATE_FEED_URL, ttl: int = RATE_TTL, stale_ttl: int = RATE_STALE_TTL):
+        self.feed_url = feed_url
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._rates: Dict[str, Tuple[Decimal, float]] = {}
+        self._inflight: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'fetches': 0, 'fetch_errors': 0, 'coalesced': 0}
+
+    async def _fetch(self) -> Dict[str, Decimal]:
+        """Один запрос к источнику за всеми курсами"""
+        self.stats['fetches'] += 1
+        symbols = ','.join(sorted(set(PAYMENT_ASSETS.values())))
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+
+        try:
+            async with self._session.get(self.feed_url, params={'symbols': symbols}) as response:
+                response.raise_for_status()
+                payload = await response.json()
+        except Exception as e:
+            self.stats['fetch_errors'] += 1
+            logger.error(f"Rate feed error: {e}")
+            raise
+
+        now = time.monotonic()
+        rates = {}
+        for symbol, value in payload.items():
+            try:
+                rate = Decimal(str(value))
+            except (InvalidOperation, ValueError):
+                continue
+            if rate > 0:
+                rates[symbol] = rate
+                self._rates[symbol] = (rate, now)
+        return rates
+
+    def refresh(self) -> asyncio.Task:
+        """Общий для всех вызывающих запрос обновления курсов"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._fetch())
+            # Ошибка фонового обновления не должна теряться молча
+            self._inflight.add_done_callback(lambda task: task.cancelled() or task.exception())
+        else:
+            self.stats['coalesced'] += 1
+        return self._inflight
+
+    async def get_rate(self, symbol: str) -> Decimal:
+        """Курс монеты в USD"""
+        if symbol == 'USDT' and not self.feed_url:
+            # Без источника курсов считаем USDT равным доллару
+            return Decimal('1')
+
+        cached = self._rates.get(symbol)
+        if cached:
+            rate, fetched_at = cached
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                return rate
+            if age < self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                self.refresh()
+                return rate
+
+        self.stats['misses'] += 1
+        if not self.feed_url:
+            raise RateUnavailableError(f"No rate feed configured for {symbol}")
+        try:
+            await asyncio.shield(self.refresh())
+        except Exception as e:
+            raise RateUnavailableError(f"Rate for {symbol} is unavailable: {e}")
+
+        if symbol not in self._rates:
+            raise RateUnavailableError(f"Rate feed has no {symbol}")
+        return self._rates[symbol][0]
+
+    async def quote(self, amount_usd, payment_method: str) -> Tuple[Decimal, Decimal]:
+        """Сумма к оплате в монете способа оплаты и использованный курс
+
+        Сумма округляется вверх, чтобы перевод покрывал сделку.
+        """
+        rate = await self.get_rate(PAYMENT_ASSETS[payment_method])
+        amount = (Decimal(str(amount_usd)) / rate).quantize(PAYMENT_PRECISION[payment_method], rounding=ROUND_UP)
+        return amount, rate
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                pass
+            await asyncio.sleep(max(self.ttl / 2, 1))
+
+    def start(self):
+        """Запуск фонового обновления курсов"""
+        if not self.feed_url:
+            logger.info("Rate oracle disabled: RATE_FEED_URL is not set")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats)
+
+# Создание глобального экземпляра источника курсов
+rate_oracle = RateOracle()
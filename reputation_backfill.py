@@ -0,0 +1,60 @@
+"""Пересчет счетчиков репутации пользователей по истории сделок
+
+Пользователи обходятся пакетами по возрастанию user_id, для каждого пакета
+счетчики считаются двумя агрегирующими запросами по индексам и записываются
+одной транзакцией. Между пакетами делается пауза, чтобы не нагружать базу.
+
+Запускается один раз после обновления (дальше счетчики ведутся при смене
+статуса сделок), пока бот остановлен:
+
+    python reputation_backfill.py --batch-size 500 --pause 0.1
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+async def backfill(batch_size: int = 500, pause: float = 0.1) -> int:
+    """Пересчет всех пользователей, возвращает их количество"""
+    started = time.perf_counter()
+    last_user_id = 0
+    processed = 0
+
+    while True:
+        user_ids = await db.get_user_ids_page(last_user_id, batch_size)
+        if not user_ids:
+            break
+
+        totals = await db.get_reputation_totals(user_ids)
+        await db.set_reputation(totals)
+
+        processed += len(user_ids)
+        last_user_id = user_ids[-1]
+        logger.info(f"Reputation backfill: {processed} users, last user_id {last_user_id}")
+
+        if pause:
+            await asyncio.sleep(pause)
+
+    logger.info(f"Reputation backfill finished: {processed} users in {time.perf_counter() - started:.1f} s")
+    return processed
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пересчет счетчиков репутации пользователей")
+    parser.add_argument('--batch-size', type=int, default=500, help="пользователей в пакете")
+    parser.add_argument('--pause', type=float, default=0.1, help="пауза между пакетами, секунд")
+    args = parser.parse_args()
+
+    await db.connect()
+    try:
+        await backfill(args.batch_size, args.pause)
+    finally:
+        await db.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""Очистка временных таблиц по политикам хранения
+
+Политика таблицы (RETENTION_POLICIES в config.py) задает столбец возраста,
+срок хранения в днях и SQL-условие строк, которые не удаляются никогда.
+Строки удаляются пакетами по RETENTION_BATCH одним DELETE ... LIMIT с паузой
+между пакетами, чтобы не держать блокировки и не создавать отставание
+реплик. В боте очистка запускается раз в RETENTION_INTERVAL секунд.
+
+Разовый запуск и оценка без удаления:
+
+    python retention.py --dry-run
+    python retention.py --table captcha_sessions --batch-size 500 --pause 1
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from database import db
+from config import RETENTION_POLICIES, RETENTION_BATCH, RETENTION_PAUSE, RETENTION_MAX_BATCHES, RETENTION_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class RetentionEngine:
+    """Удаление устаревших строк временных таблиц по политикам хранения"""
+
+    def __init__(self, policies: Dict[str, Dict] = RETENTION_POLICIES, batch_size: int = RETENTION_BATCH,
+                 pause: float = RETENTION_PAUSE):
+        self.policies = policies
+        self.batch_size = batch_size
+        self.pause = pause
+        self._task: Optional[asyncio.Task] = None
+        self.last_report: Dict[str, int] = {}
+        self.stats = {'runs': 0, 'batches': 0, 'purged': 0, 'errors': 0, 'last_run_ms': 0.0}
+        self.purged_by_table = {table: 0 for table in policies}
+
+    async def purge_table(self, table: str, dry_run: bool = False) -> int:
+        """Очистка одной таблицы; в dry_run - число строк, которые были бы удалены"""
+        policy = self.policies[table]
+        cutoff = datetime.now() - timedelta(days=policy['keep_days'])
+        if dry_run:
+            return await db.count_purgeable(table, policy['age_column'], cutoff, policy['keep'])
+
+        purged = 0
+        for _ in range(RETENTION_MAX_BATCHES):
+            deleted = await db.purge_batch(table, policy['age_column'], cutoff, self.batch_size, policy['keep'])
+            purged += deleted
+            self.stats['batches'] += 1
+            if deleted < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+        self.stats['purged'] += purged
+        self.purged_by_table[table] += purged
+        return purged
+
+    async def run_once(self, dry_run: bool = False, tables=None) -> Dict[str, int]:
+        """Один проход по всем политикам; отчет - число строк по таблицам"""
+        started = time.perf_counter()
+        report = {}
+        for table in tables or self.policies:
+            try:
+                report[table] = await self.purge_table(table, dry_run)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Retention error for {table}: {e}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not dry_run:
+            self.stats['runs'] += 1
+            self.stats['last_run_ms'] = elapsed_ms
+            self.last_report = report
+        summary = ', '.join(f"{table}: {rows}" for table, rows in report.items())
+        logger.info(f"Retention {'dry run' if dry_run else 'run'} in {elapsed_ms:.0f} ms - {summary}")
+        return report
+
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(RETENTION_INTERVAL)
+
+    def start(self):
+        """Запуск фоновой очистки"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['last_report'] = dict(self.last_report)
+        stats['purged_by_table'] = dict(self.purged_by_table)
+        return stats
+
+# Создание глобального экземпляра очистки
+retention_engine = RetentionEngine()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Очистка временных таблиц по политикам хранения")
+    parser.add_argument('--dry-run', action='store_true', help="только посчитать строки к удалению")
+    parser.add_argument('--table', action='append', choices=list(RETENTION_POLICIES), help="таблица (можно несколько)")
+    parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH, help="строк в одном DELETE")
+    parser.add_argument('--pause', type=float, default=RETENTION_PAUSE, help="пауза между пакетами, секунд")
+    args = parser.parse_args()
+
+    engine = RetentionEngine(batch_size=args.batch_size, pause=args.pause)
+    await db.connect()
+    try:
+        report = await engine.run_once(args.dry_run, args.table)
+    finally:
+        await db.close()
+
+    title = "Будет удалено" if args.dry_run else "Удалено"
+    print(f"🧹 {title}:")
+    for table, rows in report.items():
+        print(f"  {table}: {rows}")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(main())
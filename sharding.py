@@ -0,0 +1,354 @@
+"""Многопроцессный режим: апдейты обрабатываются N воркерами, разделенными по user_id
+
+Фронт-процесс получает апдейты одним поллером и по консистентному хешу
+user_id отправляет каждый одному из воркеров через Unix-сокет. Воркер - это
+обычный бот (роутер из handlers.py, свой пул соединений с БД), которому
+апдейты подаются через dp.feed_raw_update. Все апдейты пользователя попадают
+в один воркер, поэтому FSM в памяти и блокировки по пользователю работают
+как в одном процессе.
+
+Воркер подтверждает каждый апдейт после обработки. Неподтвержденные апдейты
+фронт хранит и после перезапуска воркера отправляет заново, поэтому упавший
+или перезапущенный воркер не теряет апдейты (обработка - «хотя бы один раз»,
+повторы нажатий отсекает слой идемпотентности, общий для процессов при
+IDEMPOTENCY_BACKEND=redis). Фоновые задачи, которые должны работать в одном
+экземпляре (проверка оплат, пул адресов, архивация), запускает воркер 0.
+
+    python sharding.py run --workers 4
+    python sharding.py bench --workers 1 2 4 --updates 20000
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from config import (
+    BOT_TOKEN, SHARD_WORKERS, SHARD_SOCKET, SHARD_VIRTUAL_NODES, SHARD_RESTART_DELAY, SHARD_MAX_UNACKED
+)
+
+logger = logging.getLogger(__name__)
+
+class HashRing:
+    """Консистентный хеш: при изменении числа воркеров переезжает ~1/N пользователей"""
+
+    def __init__(self, nodes: int, replicas: int = SHARD_VIRTUAL_NODES):
+        points = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+    def node_for(self, key) -> int:
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._nodes[index]
+
+def update_user_id(update: Dict) -> Optional[int]:
+    """ID пользователя - автора апдейта (from или user в объекте события)"""
+    for key, event in update.items():
+        if key != 'update_id' and isinstance(event, dict):
+            user = event.get('from') or event.get('user')
+            if user:
+                return user['id']
+    return None
+
+# === ФРОНТ ===
+
+class WorkerLink:
+    """Воркер со стороны фронта: процесс, соединение и неподтвержденные апдейты"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.unacked: Dict[int, bytes] = {}
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.connected = asyncio.Event()
+        self.has_room = asyncio.Event()
+        self.has_room.set()
+
+class ShardFront:
+    """Распределение апдейтов по воркерам и перезапуск упавших воркеров"""
+
+    def __init__(self, workers: int, socket_path: str = SHARD_SOCKET, worker_args: List[str] = None):
+        self.ring = HashRing(workers)
+        self.links = [WorkerLink(index) for index in range(workers)]
+        self.socket_path = socket_path
+        self.worker_args = worker_args or []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._supervisors: List[asyncio.Task] = []
+        self._stopping = False
+        self.stats = {'routed': 0, 'acked': 0, 'resent': 0, 'restarts': 0}
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = json.loads(await reader.readline())
+        link = self.links[hello['worker']]
+        link.writer = writer
+
+        # Апдейты, которые не подтвердил предыдущий процесс воркера
+        if link.unacked:
+            logger.info(f"Resending {len(link.unacked)} updates to worker {link.index}")
+            self.stats['resent'] += len(link.unacked)
+            for payload in list(link.unacked.values()):
+                writer.write(payload)
+        link.connected.set()
+
+        try:
+            while line := await reader.readline():
+                link.unacked.pop(json.loads(line)['ack'], None)
+                self.stats['acked'] += 1
+                if len(link.unacked) < SHARD_MAX_UNACKED:
+                    link.has_room.set()
+        except ConnectionError:
+            pass
+        finally:
+            if link.writer is writer:
+                link.writer = None
+                link.connected.clear()
+            writer.close()
+
+    async def dispatch(self, update: Dict):
+        """Отправка апдейта воркеру его пользователя"""
+        user_id = update_user_id(update)
+        link = self.links[self.ring.node_for(user_id) if user_id is not None else 0]
+
+        # Воркер не успевает или перезапускается: поллер ждет
+        if len(link.unacked) >= SHARD_MAX_UNACKED:
+            link.has_room.clear()
+            await link.has_room.wait()
+
+        payload = (json.dumps(update, ensure_ascii=False) + '\n').encode()
+        link.unacked[update['update_id']] = payload
+        self.stats['routed'] += 1
+
+        # Без соединения апдейт уйдет при подключении воркера
+        if link.writer:
+            try:
+                link.writer.write(payload)
+                await link.writer.drain()
+            except ConnectionError:
+                pass
+
+    async def _supervise(self, link: WorkerLink):
+        while True:
+            link.process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), 'worker',
+                '--index', str(link.index), '--socket', self.socket_path, *self.worker_args
+            )
+            code = await link.process.wait()
+            if self._stopping:
+                return
+            self.stats['restarts'] += 1
+            logger.warning(f"Worker {link.index} exited with code {code}, restarting")
+            await asyncio.sleep(SHARD_RESTART_DELAY)
+
+    async def start(self):
+        """Открытие сокета и запуск воркеров"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_worker, path=self.socket_path)
+        self._supervisors = [asyncio.create_task(self._supervise(link)) for link in self.links]
+        await asyncio.gather(*(link.connected.wait() for link in self.links))
+        logger.info(f"{len(self.links)} workers connected")
+
+    async def wait_acked(self):
+        """Ожидание подтверждения всех отправленных апдейтов"""
+        while any(link.unacked for link in self.links):
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        """Остановка воркеров: каждый дорабатывает полученные апдейты"""
+        self._stopping = True
+        for link in self.links:
+            if link.process and link.process.returncode is None:
+                link.process.terminate()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        if self._server:
+            self._server.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    async def poll(self, bot, allowed_updates: List[str]):
+        """Получение апдейтов одним поллером и распределение по воркерам"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Polling error: {e}")
+                await asyncio.sleep(SHARD_RESTART_DELAY)
+                continue
+            for update in updates:
+                await self.dispatch(update.model_dump(mode='json', exclude_none=True, by_alias=True))
+                offset = update.update_id + 1
+
+async def run_front(workers: int):
+    from aiogram import Bot
+    from main import create_dispatcher
+
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN not found! Please set it in .env file")
+        return
+
+    bot = Bot(token=BOT_TOKEN)
+    front = ShardFront(workers)
+    try:
+        await front.start()
+        await front.poll(bot, create_dispatcher().resolve_used_update_types())
+    finally:
+        await front.stop()
+        await bot.session.close()
+
+# === ВОРКЕР ===
+
+async def serve_worker(index: int, socket_path: str, handle):
+    """Обработка апдейтов от фронта до SIGTERM или закрытия соединения
+
+    Каждый апдейт выполняется отдельной задачей и подтверждается после
+    завершения, в том числе с ошибкой (иначе он приходил бы снова).
+    """
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write((json.dumps({'worker': index}) + '\n').encode())
+    in_flight = set()
+
+    async def process(update: Dict):
+        try:
+            await handle(update)
+        except Exception as e:
+            logger.error(f"Worker {index} update {update.get('update_id')} error: {e}")
+        writer.write((json.dumps({'ack': update['update_id']}) + '\n').encode())
+
+    async def read():
+        while line := await reader.readline():
+            task = asyncio.create_task(process(json.loads(line)))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+    reading = asyncio.create_task(read())
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, reading.cancel)
+    try:
+        await reading
+    except asyncio.CancelledError:
+        pass
+
+    # Полученные апдейты дорабатываются и подтверждаются до выхода
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()
+
+async def run_worker(index: int, socket_path: str):
+    from main import create_bot, create_dispatcher, start_services, stop_services
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    try:
+        await start_services(bot, singletons=index == 0)
+
+        async def handle(update: Dict):
+            await dp.feed_raw_update(bot, update)
+
+        await serve_worker(index, socket_path, handle)
+    finally:
+        await stop_services(bot)
+
+# === БЕНЧМАРК ===
+
+async def run_bench_worker(index: int, socket_path: str, work: int):
+    """Воркер бенчмарка: разбор апдейта и формирование ответа без сети и БД"""
+    from aiogram.types import Update
+    from benchmarks import SAMPLE_DEAL
+    from keyboards import keyboards
+    from utils import utils
+
+    async def handle(update: Dict):
+        for _ in range(work):
+            Update.model_validate(update)
+            utils.format_deal_info(SAMPLE_DEAL, SAMPLE_DEAL['creator_id'])
+            keyboards.get_deal_actions(SAMPLE_DEAL['id'], SAMPLE_DEAL['status'])
+
+    await serve_worker(index, socket_path, handle)
+
+def make_bench_update(update_id: int, user_id: int) -> Dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 1735725600,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Иван'},
+            'text': '📋 Мои сделки'
+        }
+    }
+
+async def run_bench(worker_counts: List[int], updates: int, users: int, work: int):
+    """Пропускная способность при разном числе воркеров"""
+    print(f"🖥️ Ядер: {os.cpu_count()}, апдейтов: {updates}, пользователей: {users}")
+    baseline = None
+    for workers in worker_counts:
+        socket_path = os.path.join(tempfile.gettempdir(), f"ozer_garant_bench_{os.getpid()}.sock")
+        front = ShardFront(workers, socket_path, ['--bench', '--work', str(work)])
+        await front.start()
+        try:
+            started = time.perf_counter()
+            for update_id in range(updates):
+                await front.dispatch(make_bench_update(update_id, update_id % users + 1))
+            await front.wait_acked()
+            elapsed = time.perf_counter() - started
+        finally:
+            await front.stop()
+
+        rate = updates / elapsed
+        baseline = baseline or rate / workers
+        print(f"⏱️ {workers:>3} воркеров: {rate:10.0f} апд/с   ускорение x{rate / baseline:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Многопроцессный режим бота")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="фронт с поллером и воркерами")
+    run_parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+
+    worker_parser = subparsers.add_parser('worker', help="воркер (запускается фронтом)")
+    worker_parser.add_argument('--index', type=int, required=True)
+    worker_parser.add_argument('--socket', default=SHARD_SOCKET)
+    worker_parser.add_argument('--bench', action='store_true')
+    worker_parser.add_argument('--work', type=int, default=20)
+
+    bench_parser = subparsers.add_parser('bench', help="масштабирование по числу воркеров")
+    bench_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    bench_parser.add_argument('--updates', type=int, default=20000)
+    bench_parser.add_argument('--users', type=int, default=1000)
+    bench_parser.add_argument('--work', type=int, default=20, help="повторов работы обработчика на апдейт")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        asyncio.run(run_front(args.workers))
+    elif args.command == 'worker' and args.bench:
+        asyncio.run(run_bench_worker(args.index, args.socket, args.work))
+    elif args.command == 'worker':
+        asyncio.run(run_worker(args.index, args.socket))
+    else:
+        asyncio.run(run_bench(args.workers, args.updates, args.users, args.work))
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,203 @@
+"""HTTP-сессия Bot API с настраиваемым пулом соединений
+
+Запросы к Telegram делятся на два класса: загрузка медиа (sendPhoto,
+sendDocument и т.п.) и остальные (текст, ответы на кнопки, правки). У
+каждого класса свой лимит одновременных запросов, поэтому медленные
+загрузки QR-кодов и выгрузок не занимают соединения, нужные тексту. Пул
+соединений, keep-alive и кэш DNS настраиваются в config.py, таймаут
+задается по методу.
+
+Сравнение со стандартной сессией aiogram на локальном фейковом API:
+
+    python telegram_session.py bench --requests 3000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import TelegramMethod
+from config import (
+    TELEGRAM_CONNECTION_LIMIT, TELEGRAM_KEEPALIVE_TIMEOUT, TELEGRAM_DNS_CACHE_TTL,
+    TELEGRAM_TIMEOUT, TELEGRAM_MEDIA_TIMEOUT, TELEGRAM_METHOD_TIMEOUTS,
+    TELEGRAM_TEXT_CONCURRENCY, TELEGRAM_MEDIA_CONCURRENCY
+)
+
+# Методы с загрузкой файлов
+MEDIA_METHODS = frozenset({
+    'sendPhoto', 'sendDocument', 'sendVideo', 'sendAudio', 'sendVoice',
+    'sendAnimation', 'sendVideoNote', 'sendMediaGroup', 'sendSticker'
+})
+
+# Последние замеры задержки для перцентилей
+LATENCY_WINDOW = 1000
+
+class TunedAiohttpSession(AiohttpSession):
+    """Сессия aiogram с лимитами по классам запросов и таймаутами по методам"""
+
+    def __init__(self, **kwargs):
+        super().__init__(limit=TELEGRAM_CONNECTION_LIMIT, timeout=TELEGRAM_TIMEOUT, **kwargs)
+        self._connector_init.update(
+            keepalive_timeout=TELEGRAM_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=TELEGRAM_DNS_CACHE_TTL
+        )
+        self._limits = {
+            'text': asyncio.Semaphore(TELEGRAM_TEXT_CONCURRENCY),
+            'media': asyncio.Semaphore(TELEGRAM_MEDIA_CONCURRENCY)
+        }
+        self.stats = {
+            kind: {'requests': 0, 'errors': 0, 'max_wait_ms': 0.0, 'latency_ms': deque(maxlen=LATENCY_WINDOW)}
+            for kind in self._limits
+        }
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        api_method = method.__api_method__
+        # Long polling ждет апдейты и идет со своим таймаутом вне лимитов
+        if api_method == 'getUpdates':
+            return await super().make_request(bot, method, timeout)
+
+        kind = 'media' if api_method in MEDIA_METHODS else 'text'
+        if timeout is None:
+            timeout = TELEGRAM_METHOD_TIMEOUTS.get(
+                api_method, TELEGRAM_MEDIA_TIMEOUT if kind == 'media' else TELEGRAM_TIMEOUT
+            )
+
+        stats = self.stats[kind]
+        started = time.perf_counter()
+        async with self._limits[kind]:
+            stats['max_wait_ms'] = max(stats['max_wait_ms'], (time.perf_counter() - started) * 1000)
+            try:
+                return await super().make_request(bot, method, timeout)
+            except Exception:
+                stats['errors'] += 1
+                raise
+            finally:
+                stats['requests'] += 1
+                stats['latency_ms'].append((time.perf_counter() - started) * 1000)
+
+    def get_stats(self) -> Dict:
+        """Число запросов, ошибки и перцентили задержки (с ожиданием лимита) по классам"""
+        result = {}
+        for kind, stats in self.stats.items():
+            latencies = sorted(stats['latency_ms'])
+            result[kind] = {
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'max_wait_ms': stats['max_wait_ms'],
+                'p50_ms': latencies[len(latencies) // 2] if latencies else 0.0,
+                'p99_ms': latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+            }
+        return result
+
+# === БЕНЧМАРК ===
+
+BENCH_TOKEN = '123456:bench'
+BENCH_MESSAGE = {
+    'message_id': 1,
+    'date': 1735725600,
+    'chat': {'id': 1, 'type': 'private'},
+    'photo': [{'file_id': 'f', 'file_unique_id': 'u', 'width': 1, 'height': 1}]
+}
+
+async def start_fake_api(text_delay: float, media_delay: float):
+    """Локальный сервер Bot API: текст отвечает за text_delay, загрузки - за media_delay"""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        await request.read()
+        if method in MEDIA_METHODS:
+            await asyncio.sleep(media_delay)
+            return web.json_response({'ok': True, 'result': BENCH_MESSAGE})
+        await asyncio.sleep(text_delay)
+        return web.json_response({'ok': True, 'result': True})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+async def run_load(session: AiohttpSession, requests: int, concurrency: int, media_share: float) -> Dict:
+    """Текстовые запросы на фоне загрузок фото
+
+    Доля media_share клиентов непрерывно загружает фото, остальные выполняют
+    requests текстовых запросов. Замеряется скорость и задержка текста.
+    """
+    from aiogram.types import BufferedInputFile
+
+    bot = Bot(BENCH_TOKEN, session=session)
+    photo = b'\x89PNG' + b'\x00' * 20000
+    media_clients = int(concurrency * media_share)
+    latencies = {'text': [], 'media': []}
+    queue = iter(range(requests))
+    text_done = asyncio.Event()
+
+    async def text_client():
+        for _ in queue:
+            started = time.perf_counter()
+            await bot.send_chat_action(1, 'typing')
+            latencies['text'].append((time.perf_counter() - started) * 1000)
+
+    async def media_client():
+        while not text_done.is_set():
+            started = time.perf_counter()
+            await bot.send_photo(1, BufferedInputFile(photo, 'qr.png'))
+            latencies['media'].append((time.perf_counter() - started) * 1000)
+
+    uploads = [asyncio.create_task(media_client()) for _ in range(media_clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(text_client() for _ in range(concurrency - media_clients)))
+    elapsed = time.perf_counter() - started
+    text_done.set()
+    await asyncio.gather(*uploads)
+    await bot.session.close()
+
+    def percentile(values, share):
+        values = sorted(values)
+        return values[min(int(len(values) * share), len(values) - 1)] if values else 0.0
+
+    return {
+        'text_rps': requests / elapsed,
+        'text_p50': percentile(latencies['text'], 0.5),
+        'text_p99': percentile(latencies['text'], 0.99),
+        'media_rps': len(latencies['media']) / elapsed,
+        'media_p99': percentile(latencies['media'], 0.99)
+    }
+
+async def run_bench(requests: int, concurrency: int, media_share: float, text_delay: float, media_delay: float):
+    runner, base_url = await start_fake_api(text_delay, media_delay)
+    api = TelegramAPIServer.from_base(base_url)
+    try:
+        print(f"🧪 Текстовых запросов: {requests}, клиентов: {concurrency} (загружают фото {media_share:.0%}), "
+              f"API: текст {text_delay * 1000:.0f} мс, загрузка {media_delay * 1000:.0f} мс")
+        for name, session in (('aiogram', AiohttpSession(api=api)), ('tuned', TunedAiohttpSession(api=api))):
+            result = await run_load(session, requests, concurrency, media_share)
+            print(f"⏱️ {name:<8} текст {result['text_rps']:6.0f} запр/с  p50 {result['text_p50']:6.1f} мс  "
+                  f"p99 {result['text_p99']:7.1f} мс   загрузки {result['media_rps']:5.0f} запр/с  "
+                  f"p99 {result['media_p99']:7.1f} мс")
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP-сессия Bot API")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('bench', help="сравнение со стандартной сессией на фейковом API")
+    bench_parser.add_argument('--requests', type=int, default=3000)
+    bench_parser.add_argument('--concurrency', type=int, default=200)
+    bench_parser.add_argument('--media-share', type=float, default=0.2, help="доля клиентов, загружающих фото")
+    bench_parser.add_argument('--text-delay', type=float, default=0.01, help="ответ API на текст, с")
+    bench_parser.add_argument('--media-delay', type=float, default=0.2, help="ответ API на загрузку, с")
+    args = parser.parse_args()
+    asyncio.run(run_bench(args.requests, args.concurrency, args.media_share, args.text_delay, args.media_delay))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Глобальные объекты модулей (db, хранилища) создаются при импорте, поэтому
+# окружение задается до него: тесты не трогают рабочую базу и Redis
+TEST_DIR = tempfile.mkdtemp(prefix='ozer_garant_tests_')
+os.environ['DATABASE_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = os.path.join(TEST_DIR, 'global.db')
+os.environ['FSM_STORAGE'] = 'memory'
+os.environ['IDEMPOTENCY_BACKEND'] = 'memory'
+
+# MySQL из MYSQL_CONFIG проверяется только по явному согласию: тесты очищают его таблицы
+TEST_MYSQL = os.getenv('TEST_MYSQL', '').lower() in ('1', 'true', 'yes')
+STORAGE_BACKENDS = ['sqlite'] + (['mysql'] if TEST_MYSQL else [])
+
+# Таблицы в порядке очистки (сначала зависимые)
+TABLES = (
+    'deal_ratings', 'deal_payment_quotes', 'deposit_addresses', 'deal_messages', 'deal_messages_archive',
+    'deals_archive', 'deals', 'captcha_sessions', 'user_sessions', 'payment_cursors', 'users'
+)
+
+def open_storage(backend: str, path: str):
+    """Хранилище бэкенда: SQLite - в файле (stream_query открывает второе соединение)"""
+    from database import Database
+    if backend == 'sqlite':
+        from database_sqlite import SQLiteDatabase
+        return SQLiteDatabase(path)
+    return Database()
+
+class StorageRunner:
+    """Запуск сценария на чистом хранилище в отдельном цикле событий"""
+
+    def __init__(self, backend: str, path: str):
+        self.backend = backend
+        self.path = path
+
+    def run(self, scenario):
+        async def main():
+            storage = open_storage(self.backend, self.path)
+            await storage.connect()
+            try:
+                for table in TABLES:
+                    await storage.execute_query(f"DELETE FROM {table}")
+                return await scenario(storage)
+            finally:
+                await storage.close()
+        return asyncio.run(main())
+
+@pytest.fixture(params=STORAGE_BACKENDS)
+def storage(request, tmp_path):
+    return StorageRunner(request.param, str(tmp_path / 'storage.db'))
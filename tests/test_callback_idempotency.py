@@ -0,0 +1,78 @@
+"""Повторные нажатия кнопок через диспетчер бота: обработчик выполняется один раз"""
+
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, F, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.types import CallbackQuery, Update
+
+from main import create_dispatcher
+from middlewares import CallbackAnswerRecorder
+
+class RecordingSession(BaseSession):
+    """Сессия без сети: запоминает вызовы Bot API и отвечает успехом"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+def _tap(update_id: int, callback_id: str) -> Update:
+    """Нажатие кнопки test_tap под сообщением 10 пользователем 1"""
+    user = {'id': 1, 'is_bot': False, 'first_name': 'Иван'}
+    return Update.model_validate({
+        'update_id': update_id,
+        'callback_query': {
+            'id': callback_id,
+            'from': user,
+            'chat_instance': 'chat',
+            'data': 'test_tap',
+            'message': {
+                'message_id': 10,
+                'date': int(datetime.now().timestamp()),
+                'chat': {'id': 1, 'type': 'private'},
+                'from': {'id': 42, 'is_bot': True, 'first_name': 'Бот'},
+                'text': 'Сделка'
+            }
+        }
+    })
+
+def test_duplicate_callbacks_run_handler_once():
+    calls = []
+    router = Router()
+
+    @router.callback_query(F.data == 'test_tap')
+    async def tap(callback: CallbackQuery):
+        calls.append(callback.id)
+        await callback.answer("✅ Принято", show_alert=True)
+
+    async def scenario():
+        session = RecordingSession()
+        session.middleware(CallbackAnswerRecorder())
+        bot = Bot(token='42:TEST', session=session)
+        dp = create_dispatcher()
+        dp.include_router(router)
+
+        await dp.feed_update(bot, _tap(1, 'first'))
+        # Повторная доставка того же апдейта и второе нажатие той же кнопки
+        await dp.feed_update(bot, _tap(1, 'first'))
+        await dp.feed_update(bot, _tap(2, 'second'))
+        return [
+            (method.callback_query_id, method.text, method.show_alert)
+            for method in session.requests if isinstance(method, AnswerCallbackQuery)
+        ]
+
+    answers = asyncio.run(scenario())
+    assert calls == ['first']
+    assert answers == [('first', "✅ Принято", True), ('second', "✅ Принято", True)]
@@ -0,0 +1,149 @@
+"""Адаптивный пул соединений: рост, снижение и таймаут получения"""
+
+import asyncio
+from collections import deque
+
+import pytest
+
+from db_pool import AdaptivePool, DatabaseBusyError
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakePool:
+    """Публичный интерфейс aiomysql.Pool без сервера"""
+
+    def __init__(self):
+        self.free = deque()
+        self.used = set()
+        self.opened = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.free) + len(self.used)
+
+    @property
+    def freesize(self) -> int:
+        return len(self.free)
+
+    async def acquire(self) -> FakeConnection:
+        if self.free:
+            conn = self.free.popleft()
+        else:
+            conn = FakeConnection()
+            self.opened += 1
+        self.used.add(conn)
+        return conn
+
+    async def release(self, conn: FakeConnection):
+        self.used.remove(conn)
+        if not conn.closed:
+            self.free.append(conn)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+def _run(scenario, **options):
+    async def main():
+        pool = AdaptivePool(FakePool(), **options)
+        try:
+            return await scenario(pool)
+        finally:
+            pool.close()
+    return asyncio.run(main())
+
+async def _hold(pool: AdaptivePool, count: int, release: asyncio.Event):
+    """count задач, держащих соединение до release"""
+    async def holder():
+        async with pool.acquire():
+            await release.wait()
+
+    tasks = [asyncio.create_task(holder()) for _ in range(count)]
+    await asyncio.sleep(0)
+    return tasks
+
+def test_waiters_grow_limit_and_get_connection():
+    async def scenario(pool):
+        release = asyncio.Event()
+        holders = await _hold(pool, 2, release)
+        waiter = asyncio.create_task(_hold(pool, 1, release))
+        await asyncio.sleep(0.01)
+        assert pool.get_stats()['waiting'] == 1
+
+        await pool._adjust()
+        holders += await waiter
+        await asyncio.sleep(0.01)
+        assert pool.limit == 3
+        assert pool.get_stats()['in_use'] == 3
+        release.set()
+        await asyncio.gather(*holders)
+        return pool.get_stats()
+
+    stats = _run(scenario, min_size=2, max_size=6, acquire_timeout=1)
+    assert stats['grows'] == 1
+    assert stats['timeouts'] == 0
+    assert (stats['in_use'], stats['free_connections']) == (0, 3)
+
+def test_idle_pool_shrinks_and_closes_only_excess_connections():
+    async def scenario(pool):
+        release = asyncio.Event()
+        pool.limit = 5
+        holders = await _hold(pool, 5, release)
+        release.set()
+        await asyncio.gather(*holders)
+        assert pool.pool.freesize == 5
+
+        # Интервал с пиком 5 лимит не трогает, два следующих без нагрузки снижают его по одному
+        for _ in range(3):
+            await pool._adjust()
+        return pool.get_stats()
+
+    stats = _run(scenario, min_size=2, max_size=6, acquire_timeout=1)
+    assert stats['limit'] == 3
+    assert stats['shrinks'] == 2
+    assert stats['free_connections'] == 3
+
+def test_acquire_times_out_at_max_size():
+    async def scenario(pool):
+        release = asyncio.Event()
+        holders = await _hold(pool, 2, release)
+        await pool._adjust()
+        assert pool.limit == 2
+        with pytest.raises(DatabaseBusyError):
+            async with pool.acquire():
+                pass
+        release.set()
+        await asyncio.gather(*holders)
+        return pool.get_stats()
+
+    stats = _run(scenario, min_size=2, max_size=2, acquire_timeout=0.05)
+    assert stats['timeouts'] == 1
+    assert stats['in_use'] == 0
+
+def test_cancelled_acquire_does_not_leak_granted_reservation():
+    async def scenario(pool):
+        release = asyncio.Event()
+        holders = await _hold(pool, 1, release)
+        waiter = asyncio.create_task(_hold(pool, 1, asyncio.Event()))
+        await asyncio.sleep(0.01)
+        waiting = (await waiter)[0]
+        await asyncio.sleep(0.01)
+        # Место освобождается в тот же момент, когда ожидающий запрос отменяют
+        release.set()
+        await asyncio.gather(*holders)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return waiting, pool.get_stats()
+
+    waiting, stats = _run(scenario, min_size=1, max_size=1, acquire_timeout=1)
+    assert waiting.cancelled()
+    assert stats['in_use'] == 0
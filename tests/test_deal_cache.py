@@ -0,0 +1,86 @@
+"""Кэш сделок для присоединения по ссылке"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import deal_cache
+from deal_cache import DealCache, _CountingDatabase
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.mark.parametrize('joiners', [10, 100, 1000])
+def test_concurrent_joiners_share_one_query_per_ttl(monkeypatch, joiners):
+    clock = Clock()
+    monkeypatch.setattr(deal_cache, 'time', SimpleNamespace(monotonic=clock))
+    database = _CountingDatabase(latency=0.005)
+    cache = DealCache(ttl=5, database=database)
+
+    async def burst():
+        deals = await asyncio.gather(*(cache.get_by_code('BENCH001') for _ in range(joiners)))
+        assert all(deal == database.deal for deal in deals)
+
+    async def scenario():
+        await burst()
+        assert database.queries == 1
+        clock.now += 4.9
+        await burst()
+        assert database.queries == 1
+        # Следующее окно TTL - снова один запрос на всех
+        clock.now += 0.2
+        await burst()
+        assert database.queries == 2
+
+    asyncio.run(scenario())
+    assert cache.stats['loads'] == 2
+    assert cache.stats['shared'] == 2 * (joiners - 1)
+
+def test_invalidate_by_id_drops_code_entry_after_id_entry_evicted():
+    database = _CountingDatabase(latency=0)
+    cache = DealCache(ttl=60, max_size=3, database=database)
+
+    async def scenario():
+        await cache.get_by_id(1)
+        # Чужие промахи вытесняют запись по ID, запись по коду остается
+        await cache.get_by_code('OTHER001')
+        await cache.get_by_code('BENCH001')
+        await cache.get_by_code('OTHER002')
+        assert ('id', 1) not in cache.entries
+        assert ('code', 'BENCH001') in cache.entries
+
+        database.deal['status'] = 'joined'
+        cache.invalidate(1)
+        return await cache.get_by_code('BENCH001')
+
+    assert asyncio.run(scenario())['status'] == 'joined'
+
+def test_invalidate_drops_only_loads_of_that_deal():
+    database = _CountingDatabase(latency=0.01)
+    cache = DealCache(ttl=60, database=database)
+
+    async def scenario():
+        first = asyncio.ensure_future(cache.get_by_code('BENCH001'))
+        await asyncio.sleep(0)
+        # Изменение другой сделки: новые промахи присоединяются к начатой загрузке
+        cache.invalidate(2, 'OTHER001')
+        await asyncio.gather(first, cache.get_by_code('BENCH001'))
+        assert database.queries == 1
+
+        cache.invalidate(1)
+        second = asyncio.ensure_future(cache.get_by_code('BENCH001'))
+        await asyncio.sleep(0)
+        # Изменение этой сделки: промах после него ждет уже новый запрос
+        database.deal['status'] = 'joined'
+        cache.invalidate(1, 'BENCH001')
+        deals = await asyncio.gather(second, cache.get_by_code('BENCH001'))
+        return deals, database.queries
+
+    deals, queries = asyncio.run(scenario())
+    assert queries == 3
+    assert deals[1]['status'] == 'joined'
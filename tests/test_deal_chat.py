@@ -0,0 +1,126 @@
+"""Отложенная запись сообщений сделок: отклоненные строки и остановка"""
+
+import asyncio
+
+import aiomysql
+
+import deal_chat
+from deal_chat import DealMessageBuffer
+
+class FakeMessages:
+    """add_deal_messages с отклонением строк сделки bad_deal_id и отключаемой базой"""
+
+    def __init__(self, bad_deal_id: int = None, latency: float = 0):
+        self.bad_deal_id = bad_deal_id
+        self.latency = latency
+        self.down = False
+        self.rows = []
+        self.calls = 0
+
+    async def add_deal_messages(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.down:
+            raise aiomysql.OperationalError(2013, 'Lost connection to MySQL server during query')
+        if any(message[0] == self.bad_deal_id for message in messages):
+            raise aiomysql.IntegrityError(1452, 'Cannot add or update a child row: a foreign key constraint fails')
+        self.rows.extend(messages)
+        return len(messages)
+
+def _run_buffer(monkeypatch, database, scenario, flush_size: int = 10):
+    monkeypatch.setattr(deal_chat, 'db', database)
+
+    async def main():
+        buffer = DealMessageBuffer(flush_interval_ms=60_000, flush_size=flush_size)
+        buffer.start()
+        try:
+            await scenario(buffer)
+        finally:
+            await buffer.stop()
+        return buffer
+
+    return asyncio.run(main())
+
+def test_rejected_row_does_not_block_later_messages(monkeypatch):
+    database = FakeMessages(bad_deal_id=2)
+
+    async def scenario(buffer):
+        for deal_id in (1, 2, 3):
+            buffer.add(deal_id, 100, message_text=f"сделка {deal_id}")
+        await buffer.flush()
+        buffer.add(4, 100, message_text="сделка 4")
+        await buffer.flush()
+
+    buffer = _run_buffer(monkeypatch, database, scenario)
+    assert [message[0] for message in database.rows] == [1, 3, 4]
+    assert buffer.stats['rejected'] == 1
+    assert buffer.get_stats()['pending'] == 0
+
+def test_unavailable_database_keeps_batch_queued(monkeypatch):
+    database = FakeMessages()
+
+    async def scenario(buffer):
+        database.down = True
+        buffer.add(1, 100, message_text="первое")
+        buffer.add(1, 100, message_text="второе")
+        await buffer.flush()
+        assert buffer.get_stats()['pending'] == 2
+        database.down = False
+
+    buffer = _run_buffer(monkeypatch, database, scenario)
+    assert [message[3] for message in database.rows] == ["первое", "второе"]
+    assert buffer.stats['rejected'] == 0
+
+def test_stop_waits_for_batch_in_flight(monkeypatch):
+    database = FakeMessages(latency=0.05)
+
+    async def scenario(buffer):
+        for index in range(3):
+            buffer.add(1, 100, message_text=str(index))
+        # Пакет достиг flush_size: фоновая задача начинает запись, и остановка приходит во время нее
+        await asyncio.sleep(0.01)
+        buffer.add(1, 100, message_text="после пакета")
+
+    _run_buffer(monkeypatch, database, scenario, flush_size=3)
+    assert [message[3] for message in database.rows] == ["0", "1", "2", "после пакета"]
+
+def test_unavailable_database_backs_off_instead_of_retrying_per_message(monkeypatch):
+    database = FakeMessages()
+
+    async def scenario(buffer):
+        database.down = True
+        for index in range(2):
+            buffer.add(1, 100, message_text=str(index))
+        await asyncio.sleep(0.01)
+        assert database.calls == 1
+        assert buffer.backing_off()
+
+        # Новые сообщения во время паузы не запускают новых попыток
+        for index in range(2, 30):
+            buffer.add(1, 100, message_text=str(index))
+            await asyncio.sleep(0)
+        await buffer.flush()
+        assert database.calls == 1
+        database.down = False
+
+    buffer = _run_buffer(monkeypatch, database, scenario, flush_size=2)
+    assert buffer.stats['backoffs'] == 1
+    assert [message[3] for message in database.rows] == [str(index) for index in range(30)]
+
+def test_pending_messages_are_capped_while_database_is_down(monkeypatch):
+    monkeypatch.setattr(deal_chat, 'DEAL_CHAT_MAX_PENDING', 5)
+    database = FakeMessages()
+
+    async def scenario(buffer):
+        database.down = True
+        for index in range(3):
+            buffer.add(1, 100, message_text=str(index))
+        await buffer.flush()
+        for index in range(3, 8):
+            buffer.add(1, 100, message_text=str(index))
+        assert buffer.get_stats()['pending'] == 5
+        database.down = False
+
+    buffer = _run_buffer(monkeypatch, database, scenario)
+    assert buffer.stats['dropped'] == 3
+    assert [message[3] for message in database.rows] == ['3', '4', '5', '6', '7']
@@ -0,0 +1,50 @@
+"""Блокировки по ключам: таймаут ожидания не оставляет блокировку занятой"""
+
+import asyncio
+
+from keyed_locks import KeyedLocks
+
+def test_timed_out_waiter_runs_without_lock_and_leaves_it_free():
+    locks = KeyedLocks(shards=1)
+    order = []
+
+    async def holder(release: asyncio.Event):
+        async with locks.hold(['user:1']):
+            order.append('holder')
+            await release.wait()
+
+    async def scenario():
+        release = asyncio.Event()
+        task = asyncio.create_task(holder(release))
+        await asyncio.sleep(0)
+        async with locks.hold(['user:1', 'deal:1'], timeout=0.01):
+            order.append('waiter')
+        release.set()
+        await task
+        entry = locks.shards[0]['user:1']
+        return entry.lock.locked()
+
+    assert asyncio.run(scenario()) is False
+    assert order == ['holder', 'waiter']
+    assert locks.stats['timeouts'] == 1
+
+def test_lock_granted_as_waiter_gives_up_is_released():
+    locks = KeyedLocks(shards=1)
+
+    async def scenario():
+        lock = asyncio.Lock()
+        await lock.acquire()
+        waiter = asyncio.create_task(locks._acquire(lock, 1))
+        await asyncio.sleep(0)
+        # Блокировка передается ожидающей задаче в тот же момент, когда ждать ее перестают
+        lock.release()
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return lock.locked()
+
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,194 @@
+"""Проверка оплат по переводам из индексатора
+
+Индексатор заменяет локальный HTTP-сервер с заданными страницами
+переводов; сделки, курсор и завершение - в хранилище из conftest.
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import payment_watcher as watcher_module
+from payment_watcher import CURSOR_NAME, PaymentWatcher
+
+SHARED_TRC20 = 'TSharedTrc20Address'
+SHARED_TON = 'UQSharedTonAddress'
+
+class StubIndexer:
+    """GET /transfers: страница по курсору запроса (None - первая)"""
+
+    def __init__(self, pages: dict):
+        self.pages = pages
+        self.requests = []
+        self.server = None
+
+    async def transfers(self, request: web.Request) -> web.Response:
+        self.requests.append(dict(request.query))
+        return web.json_response(self.pages[request.query.get('cursor')])
+
+    async def __aenter__(self) -> str:
+        app = web.Application()
+        app.router.add_get('/transfers', self.transfers)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        return str(self.server.make_url(''))
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+def _page(transfers: list, next_cursor: str = None, has_more: bool = False) -> dict:
+    return {'transfers': transfers, 'next_cursor': next_cursor, 'has_more': has_more}
+
+def _transfer(tx_hash: str, network: str, to: str, amount: str, memo: str = None) -> dict:
+    return {'tx_hash': tx_hash, 'network': network, 'to': to, 'amount': amount, 'memo': memo}
+
+async def _pending_deal(storage, code: str, method: str, amount_usd: str,
+                        crypto_amount: str = None, deposit_address: str = None) -> int:
+    """Сделка в статусе payment_pending с зафиксированной суммой и депозитным адресом"""
+    for user_id in (1, 2):
+        await storage.create_user(user_id, f'u{user_id}', 'Имя', None)
+    deal_id = await storage.create_deal(
+        1, 'buyer', Decimal(amount_usd), 'Условия', 'hash', code, datetime.now() + timedelta(hours=1)
+    )
+    await storage.join_deal(deal_id, 2)
+    await storage.set_payment_method(deal_id, method)
+    if crypto_amount:
+        await storage.lock_payment_quote(deal_id, method, Decimal(crypto_amount), Decimal('5.43'))
+    if deposit_address:
+        await storage.add_deposit_addresses(method, [(deal_id, deposit_address)])
+        assert await storage.claim_deposit_address(deal_id, method) == deposit_address
+    return deal_id
+
+async def _poll(storage, monkeypatch, pages: dict, polls: int = 1):
+    """polls циклов наблюдателя против заглушки индексатора; результаты циклов и запросы"""
+    monkeypatch.setattr(watcher_module, 'db', storage)
+    monkeypatch.setattr(watcher_module, 'TRC20_ADDRESS', SHARED_TRC20)
+    monkeypatch.setattr(watcher_module, 'TON_ADDRESS', SHARED_TON)
+    indexer = StubIndexer(pages)
+    async with indexer as url:
+        watcher = PaymentWatcher(base_url=url)
+        watcher.cursor = await storage.get_payment_cursor(CURSOR_NAME)
+        watcher._session = aiohttp.ClientSession()
+        try:
+            results = []
+            for _ in range(polls):
+                try:
+                    results.append(await watcher.poll_once())
+                except Exception as e:
+                    results.append(e)
+        finally:
+            await watcher._session.close()
+    return watcher, results, indexer.requests
+
+async def _status(storage, deal_id: int) -> tuple:
+    deal = await storage.get_deal_by_id(deal_id)
+    return deal['status'], deal['payment_proof']
+
+def test_matches_by_deposit_address_and_by_method_amount_memo(storage, monkeypatch):
+    async def scenario(storage):
+        by_address = await _pending_deal(storage, 'ADDR0001', 'TRC20', '150.00', deposit_address='TDeposit1')
+        underpaid = await _pending_deal(storage, 'ADDR0002', 'TRC20', '80.00', deposit_address='TDeposit2')
+        by_memo = await _pending_deal(storage, 'MEMO0001', 'TON', '150.00', crypto_amount='27.6244')
+        other_memo = await _pending_deal(storage, 'MEMO0002', 'TON', '150.00', crypto_amount='27.6244')
+        watcher, results, _ = await _poll(storage, monkeypatch, {None: _page([
+            _transfer('tx-addr', 'TRC20', 'TDeposit1', '150'),
+            _transfer('tx-under', 'TRC20', 'TDeposit2', '79.99'),
+            _transfer('tx-memo', 'TON', SHARED_TON, '27.62440', 'MEMO0001'),
+            _transfer('tx-stranger', 'TON', SHARED_TON, '27.6244', 'NOPE0000')
+        ], 'c1')})
+        return results, watcher.stats, [await _status(storage, deal_id) for deal_id in (
+            by_address, underpaid, by_memo, other_memo
+        )]
+
+    results, stats, statuses = storage.run(scenario)
+    assert results == [2]
+    assert (stats['matched'], stats['unmatched']) == (2, 2)
+    assert statuses == [
+        ('completed', 'tx-addr'), ('payment_pending', None), ('completed', 'tx-memo'), ('payment_pending', None)
+    ]
+
+def test_ambiguous_transfer_completes_no_deal(storage, monkeypatch):
+    async def scenario(storage):
+        first = await _pending_deal(storage, 'SAME0001', 'TRC20', '100.00')
+        second = await _pending_deal(storage, 'SAME0002', 'TRC20', '100.00')
+        watcher, results, _ = await _poll(storage, monkeypatch, {None: _page([
+            _transfer('tx-same', 'TRC20', SHARED_TRC20, '100.00')
+        ], 'c1')})
+        return results, watcher.stats['ambiguous'], [await _status(storage, deal_id) for deal_id in (first, second)]
+
+    results, ambiguous, statuses = storage.run(scenario)
+    assert results == [0]
+    assert ambiguous == 1
+    assert statuses == [('payment_pending', None)] * 2
+
+def test_pages_are_followed_while_has_more_and_cursor_persists(storage, monkeypatch):
+    async def scenario(storage):
+        first = await _pending_deal(storage, 'PAGE0001', 'TRC20', '10.00', deposit_address='TPage1')
+        second = await _pending_deal(storage, 'PAGE0002', 'TRC20', '20.00', deposit_address='TPage2')
+        pages = {
+            None: _page([_transfer('tx-1', 'TRC20', 'TPage1', '10')], 'c1', has_more=True),
+            'c1': _page([_transfer('tx-2', 'TRC20', 'TPage2', '20')], 'c2'),
+            'c2': _page([], None)
+        }
+        watcher, results, requests = await _poll(storage, monkeypatch, pages, polls=2)
+        return (
+            results, [request.get('cursor') for request in requests], watcher.cursor,
+            await storage.get_payment_cursor(CURSOR_NAME),
+            [await _status(storage, deal_id) for deal_id in (first, second)]
+        )
+
+    results, cursors, cursor, saved, statuses = storage.run(scenario)
+    assert results == [2, 0]
+    # Второй цикл продолжает с сохраненной позиции, пустая страница ее не сбрасывает
+    assert cursors == [None, 'c1', 'c2']
+    assert (cursor, saved) == ('c2', 'c2')
+    assert statuses == [('completed', 'tx-1'), ('completed', 'tx-2')]
+
+def test_cursor_is_saved_only_after_transfers_are_processed(storage, monkeypatch):
+    async def scenario(storage):
+        deal_id = await _pending_deal(storage, 'CURS0001', 'TRC20', '10.00', deposit_address='TCursor1')
+        complete_deal_payment = storage.complete_deal_payment
+        failures = [RuntimeError('database went away')]
+
+        async def failing_complete(*args):
+            if failures:
+                raise failures.pop()
+            return await complete_deal_payment(*args)
+
+        monkeypatch.setattr(storage, 'complete_deal_payment', failing_complete)
+        watcher, results, requests = await _poll(storage, monkeypatch, {
+            None: _page([_transfer('tx-cursor', 'TRC20', 'TCursor1', '10')], 'c1'),
+            'c1': _page([], None)
+        }, polls=2)
+        return (
+            results, [request.get('cursor') for request in requests],
+            await storage.get_payment_cursor(CURSOR_NAME), await _status(storage, deal_id)
+        )
+
+    results, cursors, saved, status = storage.run(scenario)
+    assert isinstance(results[0], RuntimeError)
+    # Неудачный цикл не сдвинул позицию: перевод прочитан и обработан повторно
+    assert results[1:] == [1]
+    assert cursors == [None, None]
+    assert saved == 'c1'
+    assert status == ('completed', 'tx-cursor')
+
+def test_transfer_seen_twice_completes_deal_once(storage, monkeypatch):
+    async def scenario(storage):
+        deal_id = await _pending_deal(storage, 'ONCE0001', 'TRC20', '10.00', deposit_address='TOnce1')
+        transfer = _transfer('tx-once', 'TRC20', 'TOnce1', '10')
+        # Индексатор повторно отдает тот же перевод и на следующей странице
+        watcher, results, _ = await _poll(storage, monkeypatch, {
+            None: _page([transfer, transfer], 'c1'),
+            'c1': _page([transfer], 'c2')
+        }, polls=2)
+        users = [await storage.get_user(user_id) for user_id in (1, 2)]
+        return results, await _status(storage, deal_id), [user['successful_deals'] for user in users]
+
+    results, status, successful = storage.run(scenario)
+    assert results == [1, 0]
+    assert status == ('completed', 'tx-once')
+    assert successful == [1, 1]
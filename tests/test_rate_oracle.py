@@ -0,0 +1,143 @@
+"""Курсы монет: кэш, устаревание, недоступный источник и точность суммы
+
+Источник курсов заменяет локальный HTTP-сервер, время - управляемые часы.
+"""
+
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import rate_oracle as oracle_module
+from rate_oracle import RateOracle, RateUnavailableError
+
+TTL = 60
+STALE_TTL = 900
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class StubFeed:
+    """GET /prices?symbols=...: курсы из rates или ответ с кодом status"""
+
+    def __init__(self, rates: dict):
+        self.rates = rates
+        self.status = 200
+        self.requests = []
+        self.server = None
+
+    async def prices(self, request: web.Request) -> web.Response:
+        self.requests.append(request.query.get('symbols'))
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response(self.rates)
+
+    async def __aenter__(self) -> str:
+        app = web.Application()
+        app.router.add_get('/prices', self.prices)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        return str(self.server.make_url('/prices'))
+
+    async def __aexit__(self, *exc_info):
+        await self.server.close()
+
+def _run(monkeypatch, rates: dict, scenario):
+    """Сценарий с оракулом, подключенным к заглушке источника"""
+    clock = Clock()
+    monkeypatch.setattr(oracle_module, 'time', SimpleNamespace(monotonic=clock))
+
+    async def main():
+        feed = StubFeed(rates)
+        async with feed as url:
+            oracle = RateOracle(feed_url=url, ttl=TTL, stale_ttl=STALE_TTL)
+            try:
+                return await scenario(oracle, feed, clock)
+            finally:
+                await oracle.stop()
+
+    return asyncio.run(main())
+
+def test_fresh_rate_is_served_from_cache(monkeypatch):
+    async def scenario(oracle, feed, clock):
+        first = await oracle.get_rate('TON')
+        clock.now += TTL - 1
+        second = await oracle.get_rate('TON')
+        return first, second, feed.requests, oracle.stats
+
+    first, second, requests, stats = _run(monkeypatch, {'TON': '5.43', 'USDT': '1.0'}, scenario)
+    assert first == second == Decimal('5.43')
+    assert requests == ['TON,USDT']
+    assert (stats['misses'], stats['hits']) == (1, 1)
+
+def test_stale_rate_is_served_while_refreshing_in_background(monkeypatch):
+    async def scenario(oracle, feed, clock):
+        await oracle.get_rate('TON')
+        feed.rates = {'TON': '5.50', 'USDT': '1.0'}
+        clock.now += TTL + 1
+        stale = await oracle.get_rate('TON')
+        await oracle.refresh()
+        return stale, await oracle.get_rate('TON'), len(feed.requests), oracle.stats['stale_hits']
+
+    stale, fresh, requests, stale_hits = _run(monkeypatch, {'TON': '5.43', 'USDT': '1.0'}, scenario)
+    assert (stale, fresh) == (Decimal('5.43'), Decimal('5.50'))
+    assert (requests, stale_hits) == (2, 1)
+
+def test_rate_older_than_stale_ttl_is_rejected(monkeypatch):
+    async def scenario(oracle, feed, clock):
+        await oracle.get_rate('TON')
+        feed.status = 503
+        clock.now += STALE_TTL + 1
+        with pytest.raises(RateUnavailableError):
+            await oracle.quote(Decimal('150'), 'TON')
+
+        # Как только источник ответил, курс снова свежий
+        feed.status = 200
+        feed.rates = {'TON': '6.00', 'USDT': '1.0'}
+        return await oracle.quote(Decimal('150'), 'TON'), oracle.stats['fetch_errors']
+
+    (amount, rate), fetch_errors = _run(monkeypatch, {'TON': '5.43', 'USDT': '1.0'}, scenario)
+    assert (amount, rate) == (Decimal('25.0000'), Decimal('6.00'))
+    assert fetch_errors == 1
+
+def test_rate_unavailable_without_feed_or_symbol(monkeypatch):
+    async def scenario(oracle, feed, clock):
+        feed.status = 500
+        with pytest.raises(RateUnavailableError):
+            await oracle.get_rate('TON')
+
+        # Источник отвечает, но без нужной монеты или с негодным курсом
+        feed.status = 200
+        with pytest.raises(RateUnavailableError):
+            await oracle.get_rate('TON')
+        return await oracle.get_rate('USDT')
+
+    usdt = _run(monkeypatch, {'TON': '0', 'USDT': '1.0', 'BTC': 'n/a'}, scenario)
+    assert usdt == Decimal('1.0')
+
+    async def without_feed():
+        oracle = RateOracle(feed_url=None)
+        with pytest.raises(RateUnavailableError):
+            await oracle.quote(Decimal('150'), 'TON')
+        # Без источника USDT считается равным доллару
+        return await oracle.quote(Decimal('150'), 'TRC20')
+
+    assert asyncio.run(without_feed()) == (Decimal('150.00'), Decimal('1'))
+
+def test_quote_precision_per_asset_rounds_up(monkeypatch):
+    async def scenario(oracle, feed, clock):
+        return await oracle.quote(Decimal('150.00'), 'TON'), await oracle.quote(Decimal('100.00'), 'TRC20')
+
+    (ton, ton_rate), (usdt, usdt_rate) = _run(monkeypatch, {'TON': '5.43', 'USDT': '0.9997'}, scenario)
+    # 150 / 5.43 = 27.624309..., 100 / 0.9997 = 100.030009...
+    assert (ton, ton_rate) == (Decimal('27.6244'), Decimal('5.43'))
+    assert ton.as_tuple().exponent == -4
+    assert (usdt, usdt_rate) == (Decimal('100.04'), Decimal('0.9997'))
+    assert usdt.as_tuple().exponent == -2
@@ -0,0 +1,166 @@
+"""Чтение с реплик, чтение своих записей с основного сервера и вывод отстающих реплик
+
+Маршрутизация проверяется на объектах-заглушках пулов. Проверка на двух
+настоящих серверах (основной и реплика из MYSQL_REPLICAS) выполняется при
+TEST_MYSQL=1 и заданном MYSQL_REPLICAS.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from conftest import TEST_MYSQL
+from config import MYSQL_REPLICAS, READ_YOUR_WRITES_WINDOW, REPLICA_MAX_LAG
+from database import Database, current_user_id
+from deal_cache import DealCache
+
+class FakePool:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+def _routed_database(replicas: int = 2) -> Database:
+    storage = Database()
+    storage.pool = FakePool('primary')
+    storage.replica_pools = [FakePool(f'replica{index}') for index in range(replicas)]
+    storage.healthy_replicas = list(storage.replica_pools)
+    return storage
+
+@pytest.fixture
+def user():
+    """Апдейт пользователя 1, как его выставляет UserContextMiddleware"""
+    token = current_user_id.set(1)
+    yield 1
+    current_user_id.reset(token)
+
+def test_reads_without_replicas_go_to_primary():
+    storage = _routed_database(replicas=0)
+    assert storage.read_pool() is storage.pool
+
+def test_reads_rotate_over_healthy_replicas():
+    storage = _routed_database()
+    assert [storage.read_pool() for _ in range(4)] == storage.replica_pools * 2
+
+def test_recent_writer_reads_from_primary(user):
+    storage = _routed_database()
+    storage._mark_write()
+    assert storage.read_pool() is storage.pool
+
+    # Другие пользователи и фоновые задачи без пользователя читают с реплик
+    token = current_user_id.set(2)
+    try:
+        assert storage.read_pool() in storage.replica_pools
+    finally:
+        current_user_id.reset(token)
+    token = current_user_id.set(None)
+    try:
+        assert storage.read_pool() in storage.replica_pools
+    finally:
+        current_user_id.reset(token)
+
+def test_stickiness_expires_after_window(user):
+    storage = _routed_database()
+    storage.recent_writers[user] = time.monotonic() - READ_YOUR_WRITES_WINDOW - 1
+    assert storage.read_pool() in storage.replica_pools
+
+def test_writes_are_not_tracked_without_replicas(user):
+    storage = _routed_database(replicas=0)
+    storage._mark_write()
+    assert storage.recent_writers == {}
+
+def test_lagging_replica_leaves_and_rejoins_rotation(user):
+    storage = _routed_database()
+    good, lagging = storage.replica_pools
+    lags = {good: 0, lagging: REPLICA_MAX_LAG + 1}
+
+    async def replica_lag(pool):
+        return lags[pool]
+
+    storage._replica_lag = replica_lag
+    asyncio.run(storage.check_replicas())
+    assert storage.healthy_replicas == [good]
+    assert {storage.read_pool() for _ in range(4)} == {good}
+
+    # Остановленная репликация (нет статуса) тоже выводит реплику
+    lags[lagging] = None
+    asyncio.run(storage.check_replicas())
+    assert storage.healthy_replicas == [good]
+
+    lags[lagging] = REPLICA_MAX_LAG
+    asyncio.run(storage.check_replicas())
+    assert storage.healthy_replicas == [good, lagging]
+
+def test_all_replicas_lagging_falls_back_to_primary():
+    storage = _routed_database()
+
+    async def replica_lag(pool):
+        return REPLICA_MAX_LAG + 10
+
+    storage._replica_lag = replica_lag
+    asyncio.run(storage.check_replicas())
+    assert storage.healthy_replicas == []
+    assert storage.read_pool() is storage.pool
+
+def test_check_replicas_forgets_old_writers():
+    storage = _routed_database()
+
+    async def replica_lag(pool):
+        return 0
+
+    storage._replica_lag = replica_lag
+    storage.recent_writers = {1: time.monotonic(), 2: time.monotonic() - READ_YOUR_WRITES_WINDOW - 1}
+    asyncio.run(storage.check_replicas())
+    assert list(storage.recent_writers) == [1]
+
+def test_deal_cache_misses_read_from_primary():
+    storage = _routed_database()
+    pools = []
+
+    async def execute_fetchone(query, params=None, pool=None):
+        pools.append(pool or storage.pool)
+        return None
+
+    storage.execute_fetchone = execute_fetchone
+    cache = DealCache(database=storage)
+    asyncio.run(cache.get_by_code('CODE0001'))
+    asyncio.run(cache.get_by_id(1))
+    # Отстающая реплика вернула бы строку до сброса, и она пролежала бы в кэше весь TTL
+    assert pools == [storage.pool] * 4
+    # Остальное чтение сделок по-прежнему идет с реплик
+    asyncio.run(storage.get_deal_by_id(1))
+    assert pools[4:] == [storage.replica_pools[0]] * 2
+
+@pytest.mark.skipif(not (TEST_MYSQL and MYSQL_REPLICAS), reason="нужны основной сервер и реплика (TEST_MYSQL=1, MYSQL_REPLICAS)")
+def test_two_servers_read_your_writes(user):
+    async def scenario():
+        storage = Database()
+        await storage.connect()
+        try:
+            assert await storage._replica_lag(storage.replica_pools[0]) is not None
+            await storage.check_replicas()
+            assert storage.healthy_replicas
+
+            # Запись идет на основной сервер, и сразу после нее пользователь читает оттуда же
+            await storage.create_user(user, 'replica_test', 'Иван', None)
+            assert storage.read_pool() is storage.pool
+            assert (await storage.get_user(user))['username'] == 'replica_test'
+
+            token = current_user_id.set(None)
+            try:
+                assert storage.read_pool() in storage.replica_pools
+                # Реплика догоняет основной сервер в пределах допустимого отставания
+                for _ in range(REPLICA_MAX_LAG * 10):
+                    if await storage.get_user(user):
+                        break
+                    await asyncio.sleep(0.1)
+                assert (await storage.get_user(user))['username'] == 'replica_test'
+            finally:
+                current_user_id.reset(token)
+            await storage.execute_query("DELETE FROM users WHERE user_id = %s", (user,))
+        finally:
+            await storage.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,317 @@
+"""Одинаковое поведение бэкендов хранилища
+
+Каждый сценарий выполняется на всех бэкендах из STORAGE_BACKENDS (SQLite
+всегда, MySQL из MYSQL_CONFIG при TEST_MYSQL=1) и возвращает результаты
+методов без значений, которые зависят от сервера (ID, время). Ожидаемые
+значения одни для всех бэкендов, поэтому переопределение в
+database_sqlite.py, разошедшееся с MySQL, ломает тест.
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from conftest import STORAGE_BACKENDS, StorageRunner
+from config import RETENTION_POLICIES
+
+NOW = datetime.now().replace(microsecond=0)
+LONG_AGO = NOW - timedelta(days=400)
+
+async def _deal(storage, code: str, creator_id: int = 1, conditions: str = 'Продажа аккаунта Premium',
+                amount=Decimal('150.00')) -> int:
+    return await storage.create_deal(creator_id, 'buyer', amount, conditions, 'hash', code, NOW + timedelta(hours=1))
+
+async def scenario_users(storage):
+    await storage.create_user(1, 'old_name', 'Иван', None)
+    await storage.create_user(1, 'new_name', 'Иван', 'Петров')
+    created = await storage.get_user(1)
+    await storage.verify_user(1)
+    verified = await storage.get_user(1)
+    return {
+        'user': {key: created[key] for key in (
+            'user_id', 'username', 'first_name', 'last_name', 'is_verified', 'deals_count',
+            'successful_deals', 'rating', 'is_banned'
+        )},
+        'timestamps': isinstance(created['created_at'], datetime) and isinstance(created['updated_at'], datetime),
+        'verified': verified['is_verified'],
+        'missing': await storage.get_user(2)
+    }
+
+async def scenario_captcha(storage):
+    await storage.create_user(1, 'user', 'Иван', None)
+    await storage.create_captcha_session(1, 'button', 'expired', NOW - timedelta(minutes=1))
+    await storage.create_captcha_session(1, 'button', 'first', NOW + timedelta(minutes=5))
+    # Вторая сессия в ту же секунду: выбирается последняя созданная
+    await storage.create_captcha_session(1, 'image', 'second', NOW + timedelta(minutes=5))
+    session = await storage.get_captcha_session(1)
+    await storage.update_captcha_attempts(session['id'], 2)
+    attempts = (await storage.get_captcha_session(1))['attempts']
+    await storage.solve_captcha(session['id'])
+    after_solve = await storage.get_captcha_session(1)
+    return {
+        'session': (session['captcha_type'], session['correct_answer'], session['attempts'], session['is_solved']),
+        'expires_at': session['expires_at'] == NOW + timedelta(minutes=5),
+        'attempts': attempts,
+        'after_solve': after_solve['correct_answer'] if after_solve else None
+    }
+
+async def scenario_deals(storage):
+    for user_id in (1, 2):
+        await storage.create_user(user_id, f'u{user_id}', 'Имя', None)
+    deal_id = await _deal(storage, 'CODE0001')
+    by_code = await storage.get_deal_by_code('CODE0001')
+    by_id = await storage.get_deal_by_id(deal_id)
+
+    joined = await storage.join_deal(deal_id, 2)
+    joined_again = await storage.join_deal(deal_id, 2)
+    invalid = await storage.update_deal_status(deal_id, 'completed')
+    await storage.execute_query("UPDATE deals SET updated_at = %s WHERE id = %s", (LONG_AGO, deal_id))
+    await storage.update_deal_password(deal_id, 'new-hash')
+    after_rehash = await storage.get_deal_by_id(deal_id)
+    version = await storage.get_deal_version(deal_id)
+    pending = await storage.set_payment_method(deal_id, 'TON')
+    pending_again = await storage.set_payment_method(deal_id, 'TRC20')
+    completed = await storage.complete_deal_payment(deal_id, 'tx-hash')
+    completed_deal = await storage.get_deal_by_id(deal_id)
+    users = [await storage.get_user(user_id) for user_id in (1, 2)]
+    return {
+        'deal': {key: by_code[key] for key in (
+            'deal_code', 'creator_id', 'participant_id', 'creator_role', 'amount_usd', 'deal_conditions',
+            'deal_password', 'status', 'payment_method', 'payment_proof', 'completed_at', 'archived'
+        )},
+        'same_by_id': by_id == by_code and by_code['id'] == deal_id,
+        'missing': await storage.get_deal_by_code('NOPE0000'),
+        'transitions': (joined, joined_again, invalid, pending, pending_again, completed),
+        'rehash': (after_rehash['deal_password'], after_rehash['updated_at'] == LONG_AGO),
+        'version': (version['participant_id'], version['status'], version['updated_at'] == LONG_AGO, version['archived']),
+        'completed': (completed_deal['status'], completed_deal['payment_method'], completed_deal['payment_proof'],
+                      isinstance(completed_deal['completed_at'], datetime)),
+        'counters': [(user['deals_count'], user['successful_deals']) for user in users],
+        'user_deals': [(deal['deal_code'], deal['status']) for deal in await storage.get_user_deals(2)]
+    }
+
+async def scenario_sessions(storage):
+    await storage.create_user(1, 'user', 'Иван', None)
+    missing = await storage.get_user_session(1)
+    await storage.set_user_session(1, 'DealStates:waiting_for_amount', {'role': 'buyer'})
+    await storage.set_user_session(1, 'DealStates:waiting_for_password', {'role': 'buyer', 'amount': 150})
+    session = await storage.get_user_session(1)
+    await storage.set_user_session(1, None)
+    empty = await storage.get_user_session(1)
+    await storage.clear_user_session(1)
+    return {
+        'missing': missing,
+        'session': (session['user_id'], session['current_action'], session['session_data']),
+        'timestamps': isinstance(session['created_at'], datetime) and isinstance(session['updated_at'], datetime),
+        'empty': (empty['current_action'], empty['session_data']),
+        'cleared': await storage.get_user_session(1)
+    }
+
+async def scenario_archive(storage):
+    for user_id in (1, 2):
+        await storage.create_user(user_id, f'u{user_id}', 'Имя', None)
+    finished = await _deal(storage, 'DONE0001')
+    active = await _deal(storage, 'LIVE0001')
+    recent = await _deal(storage, 'LATE0001')
+    await storage.join_deal(finished, 2)
+    await storage.add_deal_messages([(finished, 2, 'user', 'первое', None), (finished, 1, 'user', 'второе', None)])
+    for deal_id in (finished, recent):
+        await storage.update_deal_status(deal_id, 'cancelled')
+    for deal_id in (finished, active):
+        await storage.execute_query("UPDATE deals SET updated_at = %s WHERE id = %s", (LONG_AGO, deal_id))
+
+    moved = await storage.archive_deals_batch(NOW - timedelta(days=1), 10)
+    moved_again = await storage.archive_deals_batch(NOW - timedelta(days=1), 10)
+    archived = await storage.get_deal_by_code('DONE0001')
+    messages = await storage.get_deal_messages(finished)
+    return {
+        'moved': (moved, moved_again),
+        'archived': (archived['id'] == finished, archived['status'], archived['archived'], archived['participant_id']),
+        'version': {key: (await storage.get_deal_version(finished))[key] for key in ('status', 'archived')},
+        'kept': [(await storage.get_deal_by_id(deal_id))['archived'] for deal_id in (active, recent)],
+        'messages': [(message['user_id'], message['message_text']) for message in messages],
+        'user_deals': sorted(deal['deal_code'] for deal in await storage.get_user_deals(1)),
+        'active_user_deals': sorted(deal['deal_code'] for deal in await storage.get_user_deals(1, include_archive=False)),
+        'codes_taken': [await storage.deal_code_exists(code) for code in ('DONE0001', 'LIVE0001', 'NOPE0000')]
+    }
+
+async def scenario_search(storage):
+    for user_id in (1, 2, 3):
+        await storage.create_user(user_id, f'u{user_id}', 'Имя', None)
+    codes = {}
+    for code, creator_id, conditions in (
+        ('SRCH0001', 1, 'Продажа аккаунта Premium с гарантией'),
+        ('SRCH0002', 1, 'Покупка домена example.com'),
+        ('SRCH0003', 2, 'Продажа ключа Premium'),
+        ('SRCH0004', 1, 'ПРОДАЖА АККАУНТА без гарантии'),
+    ):
+        codes[await _deal(storage, code, creator_id, conditions)] = code
+    await storage.join_deal(next(deal_id for deal_id, code in codes.items() if code == 'SRCH0003'), 1)
+
+    def found(results):
+        return sorted(codes[result['id']] for result in results)
+
+    page = await storage.search_deals('продажа', user_id=1, limit=2)
+    return {
+        'user_case_insensitive': found(await storage.search_deals('продажа аккаунта', user_id=1)),
+        'user_participant': found(await storage.search_deals('premium', user_id=1)),
+        'user_other': found(await storage.search_deals('premium', user_id=3)),
+        'all': found(await storage.search_deals('premium')),
+        'all_terms': found(await storage.search_deals('продажа гарантией')),
+        'page': len(page),
+        'page_fields': sorted(page[0]),
+        'next_page': len(await storage.search_deals('продажа', user_id=1, limit=2, offset=2)),
+        'no_terms': await storage.search_deals('%'),
+        'like_wildcard': found(await storage.search_deals('100%', user_id=1))
+    }
+
+async def scenario_retention(storage):
+    for user_id in (1, 2, 3):
+        await storage.create_user(user_id, f'u{user_id}', 'Имя', None)
+    for answer in ('a', 'b', 'c'):
+        await storage.create_captcha_session(1, 'button', answer, LONG_AGO)
+    await storage.create_captcha_session(1, 'button', 'fresh', NOW + timedelta(minutes=5))
+    cutoff = NOW - timedelta(days=1)
+    captcha = RETENTION_POLICIES['captcha_sessions']
+    counted = await storage.count_purgeable('captcha_sessions', captcha['age_column'], cutoff, captcha['keep'])
+    batches = [
+        await storage.purge_batch('captcha_sessions', captcha['age_column'], cutoff, 2, captcha['keep'])
+        for _ in range(3)
+    ]
+
+    # Сессия пользователя с незавершенной сделкой хранится бессрочно
+    await _deal(storage, 'KEEP0001', creator_id=2)
+    for user_id in (1, 2, 3):
+        await storage.set_user_session(user_id, 'idle', {'n': user_id})
+    await storage.execute_query("UPDATE user_sessions SET updated_at = %s WHERE user_id IN (1, 2)", (LONG_AGO,))
+    sessions = RETENTION_POLICIES['user_sessions']
+    session_count = await storage.count_purgeable('user_sessions', sessions['age_column'], cutoff, sessions['keep'])
+    session_purged = await storage.purge_batch('user_sessions', sessions['age_column'], cutoff, 10, sessions['keep'])
+    return {
+        'captcha': (counted, batches, (await storage.get_captcha_session(1))['correct_answer']),
+        'sessions': (session_count, session_purged),
+        'left': [bool(await storage.get_user_session(user_id)) for user_id in (1, 2, 3)]
+    }
+
+async def scenario_deposits(storage):
+    await storage.create_user(1, 'user', 'Иван', None)
+    deals = [await _deal(storage, f'DEPO000{index}') for index in range(3)]
+    added = await storage.add_deposit_addresses('TRC20', [(0, 'T-addr-0'), (1, 'T-addr-1')])
+    await storage.add_deposit_addresses('TON', [(0, 'UQ-addr-0')])
+    claims = [await storage.claim_deposit_address(deal_id, 'TRC20') for deal_id in deals]
+    return {
+        'added': added,
+        'claims': claims,
+        'own': await storage.get_deal_deposit_address(deals[1], 'TRC20'),
+        'unused': (await storage.count_unused_deposit_addresses('TRC20'),
+                   await storage.count_unused_deposit_addresses('TON')),
+        'last_index': (await storage.get_last_derivation_index('TRC20'),
+                       await storage.get_last_derivation_index('TON'),
+                       await storage.get_last_derivation_index('NONE'))
+    }
+
+EXPECTED = {
+    scenario_users: {
+        'user': {
+            'user_id': 1, 'username': 'new_name', 'first_name': 'Иван', 'last_name': 'Петров', 'is_verified': 0,
+            'deals_count': 0, 'successful_deals': 0, 'rating': Decimal('0.00'), 'is_banned': 0
+        },
+        'timestamps': True,
+        'verified': 1,
+        'missing': None
+    },
+    scenario_captcha: {
+        'session': ('image', 'second', 0, 0),
+        'expires_at': True,
+        'attempts': 2,
+        'after_solve': 'first'
+    },
+    scenario_deals: {
+        'deal': {
+            'deal_code': 'CODE0001', 'creator_id': 1, 'participant_id': None, 'creator_role': 'buyer',
+            'amount_usd': Decimal('150.00'), 'deal_conditions': 'Продажа аккаунта Premium', 'deal_password': 'hash',
+            'status': 'created', 'payment_method': None, 'payment_proof': None, 'completed_at': None,
+            'archived': False
+        },
+        'same_by_id': True,
+        'missing': None,
+        'transitions': (True, False, False, True, False, True),
+        'rehash': ('new-hash', True),
+        'version': (2, 'joined', True, False),
+        'completed': ('completed', 'TON', 'tx-hash', True),
+        'counters': [(1, 1), (1, 1)],
+        'user_deals': [('CODE0001', 'completed')]
+    },
+    scenario_sessions: {
+        'missing': None,
+        'session': (1, 'DealStates:waiting_for_password', {'role': 'buyer', 'amount': 150}),
+        'timestamps': True,
+        'empty': (None, {}),
+        'cleared': None
+    },
+    scenario_archive: {
+        'moved': (1, 0),
+        'archived': (True, 'cancelled', True, 2),
+        'version': {'status': 'cancelled', 'archived': True},
+        'kept': [False, False],
+        'messages': [(1, 'второе'), (2, 'первое')],
+        'user_deals': ['DONE0001', 'LATE0001', 'LIVE0001'],
+        'active_user_deals': ['LATE0001', 'LIVE0001'],
+        'codes_taken': [True, True, False]
+    },
+    scenario_search: {
+        'user_case_insensitive': ['SRCH0001', 'SRCH0004'],
+        'user_participant': ['SRCH0001', 'SRCH0003'],
+        'user_other': [],
+        'all': ['SRCH0001', 'SRCH0003'],
+        'all_terms': ['SRCH0001'],
+        'page': 2,
+        'page_fields': ['amount_usd', 'created_at', 'deal_code', 'id', 'status'],
+        'next_page': 1,
+        'no_terms': [],
+        'like_wildcard': []
+    },
+    scenario_retention: {
+        'captcha': (3, [2, 1, 0], 'fresh'),
+        'sessions': (1, 1),
+        'left': [False, True, True]
+    },
+    scenario_deposits: {
+        'added': 2,
+        'claims': ['T-addr-0', 'T-addr-1', None],
+        'own': 'T-addr-1',
+        'unused': (0, 1),
+        'last_index': (1, 0, None)
+    }
+}
+
+@pytest.mark.parametrize('scenario', list(EXPECTED), ids=lambda scenario: scenario.__name__)
+def test_backend_matches_expected(storage, scenario):
+    assert storage.run(scenario) == EXPECTED[scenario]
+
+@pytest.mark.skipif(len(STORAGE_BACKENDS) < 2, reason="нужен второй бэкенд (TEST_MYSQL=1)")
+@pytest.mark.parametrize('scenario', list(EXPECTED), ids=lambda scenario: scenario.__name__)
+def test_backends_return_identical_results(tmp_path, scenario):
+    results = {
+        backend: StorageRunner(backend, str(tmp_path / f'{backend}.db')).run(scenario)
+        for backend in STORAGE_BACKENDS
+    }
+    assert len({repr(result) for result in results.values()}) == 1, results
+
+def test_stream_deals_export(storage):
+    async def scenario(storage):
+        await storage.create_user(1, 'user', 'Иван', None)
+        for index in range(5):
+            await _deal(storage, f'EXPO000{index}')
+        rows = []
+        async for batch in storage.stream_query("SELECT deal_code FROM deals ORDER BY id", batch_size=2):
+            rows.append([row[0] for row in batch])
+        exported = []
+        async for batch in storage.stream_deals_export(user_id=1):
+            exported.extend(batch)
+        return rows, len(exported)
+
+    assert storage.run(scenario) == (
+        [['EXPO0000', 'EXPO0001'], ['EXPO0002', 'EXPO0003'], ['EXPO0004']], 5
+    )
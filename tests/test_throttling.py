@@ -0,0 +1,52 @@
+"""Очистка состояний ограничения частоты: удвоение мьюта не сбрасывается"""
+
+import throttling
+from config import THROTTLE_IDLE_TTL, THROTTLE_MUTE_DECAY, THROTTLE_MUTE_SECONDS
+from throttling import MUTE_STARTED, Throttler
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def _flood(throttler: Throttler, user_id: int) -> str:
+    """Апдейты без пауз до начала мьюта"""
+    decision = None
+    while decision != MUTE_STARTED:
+        decision = throttler.check(user_id, 'callback')
+    return decision
+
+def test_sweep_keeps_mute_count_of_idle_user(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttling.time, 'monotonic', clock)
+    throttler = Throttler()
+
+    _flood(throttler, 1)
+    assert throttler.mute_remaining(1) == THROTTLE_MUTE_SECONDS
+
+    # Пользователь пережидает мьют вне бота, очистка его состояние не удаляет
+    clock.now += THROTTLE_MUTE_SECONDS + THROTTLE_IDLE_TTL + 1
+    assert throttler.sweep() == 0
+    assert throttler.users[1].mutes == 1
+    assert throttler.users[1].buckets == {}
+
+    _flood(throttler, 1)
+    assert throttler.mute_remaining(1) == THROTTLE_MUTE_SECONDS * 2
+
+def test_mute_count_decays_and_state_is_removed(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttling.time, 'monotonic', clock)
+    throttler = Throttler()
+
+    _flood(throttler, 1)
+    throttler.check(2, 'callback')
+    clock.now += THROTTLE_IDLE_TTL + 1
+    assert throttler.sweep() == 1
+    assert list(throttler.users) == [1]
+
+    # Сутки без мьюта откатывают удвоение, и пользователь без истории мьютов удаляется
+    clock.now += THROTTLE_MUTE_DECAY
+    assert throttler.sweep() == 1
+    assert throttler.users == {}
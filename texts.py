@@ -0,0 +1,506 @@
+import logging
+from string import Formatter
+from typing import Dict, Optional
+from config import DEFAULT_LOCALE, LOCALE_ALIASES
+
+logger = logging.getLogger(__name__)
+
+def escape_markdown(text: str) -> str:
+    """Экранирование значения для parse_mode="Markdown" вне `кода`
+
+    Цепочка str.replace по четырем спецсимволам на коротких строках быстрее
+    str.translate и re.sub: без совпадений каждый проход - быстрый поиск в C.
+    """
+    return text.replace('_', '\\_').replace('*', '\\*').replace('`', '\\`').replace('[', '\\[')
+
+def escape_markdown_code(text: str) -> str:
+    """Экранирование значения внутри `кода`: там обратная косая не действует,
+    поэтому обратная кавычка закрывает код, выводится экранированной и код
+    открывается снова"""
+    return text.replace('`', '`\\``')
+
+# Шаблоны сообщений: локаль -> имя -> текст с полями {имя} и {имя:формат}
+TEMPLATES = {
+    'ru': {
+        'role_buyer': "💰 Покупатель",
+        'role_seller': "💎 Продавец",
+        'welcome': """
+🎉 **Добро пожаловать в OZER GARANT!**
+
+🔐 Безопасная площадка для проведения сделок с гарантией!
+
+💼 **Возможности бота:**
+• Создание безопасных сделок
+• Гарантийная система
+• Поддержка TRC20 USDT и TON
+• 24/7 техническая поддержка
+
+👇 Используйте меню для навигации:
+""",
+        'support': """
+🆘 **Техническая поддержка**
+
+📞 **Контакты поддержки:**
+• Telegram: @{support_username}
+• Время работы: 24/7
+
+❓ **Часто задаваемые вопросы:**
+• Как создать сделку?
+• Как отменить сделку?
+• Сколько времени обрабатывается спор?
+• Какие комиссии?
+
+💡 **Полезные советы:**
+• Всегда проверяйте данные партнера
+• Не передавайте пароли сделки третьим лицам
+• Сохраняйте доказательства оплаты
+""",
+        'deal_created': """
+✅ **Сделка создана успешно!**
+
+💼 **Код сделки:** `{deal_code}`
+👤 **Ваша роль:** {role}
+💰 **Сумма:** ${amount}
+📋 **Условия:** {conditions}...
+🔐 **Пароль:** `{password}`
+
+🔗 **Ссылка для партнера:**
+{deal_link}
+
+⏰ **Сделка активна до:** {expires_at:%d.%m.%Y %H:%M}
+
+📝 **Как пригласить партнера:**
+1. Отправьте ему ссылку выше
+2. Партнер должен ввести пароль: `{password}`
+3. После присоединения начнется процесс сделки
+""",
+        'join_prompt': """
+💼 **Присоединение к сделке #{deal_code}**
+
+👤 **Роль создателя:** {creator_role}
+👤 **Ваша роль:** {role}
+💰 **Сумма:** ${amount}
+📋 **Условия:** {conditions}
+⏰ **Истекает:** {expires_at:%d.%m.%Y %H:%M}
+
+🔐 **Введите пароль сделки для присоединения:**
+""",
+        'partner_joined': """
+🎉 **К вашей сделке присоединился партнер!**
+
+💼 **Сделка:** #{deal_code}
+👤 **Партнер:** {partner}
+💰 **Сумма:** ${amount}
+📋 **Условия:** {conditions}...
+
+🔄 **Следующий шаг:**
+Если вы покупатель - выберите способ оплаты.
+Если вы продавец - ожидайте оплату от покупателя.
+""",
+        'joined': """
+✅ **Вы успешно присоединились к сделке!**
+
+💼 **Сделка:** #{deal_code}
+👤 **Ваша роль:** {role}
+💰 **Сумма:** ${amount}
+📋 **Условия:** {conditions}...
+
+🔄 **Что дальше:**
+Ожидайте действий от партнера. Вы получите уведомление при изменении статуса сделки.
+
+💬 Чат с партнером: /chat {deal_code}
+""",
+        'choose_payment': """
+💳 **Выберите способ оплаты для сделки #{deal_code}**
+
+💰 **Сумма к оплате:** ${amount}
+
+🔗 **TRC20 USDT** - USDT в сети TRON
+💎 **TON** - The Open Network
+
+Выберите удобный для вас способ:
+""",
+        'payment_memo_line': "• Укажите комментарий к переводу: `{memo}`\n",
+        'payment_details': """
+💳 **Оплата сделки #{deal_code}**
+
+💰 **Сумма:** ${amount} = {crypto_amount} {asset}
+📈 **Курс:** 1 {asset} = ${rate}
+🔗 **Способ:** {payment_method}
+📍 **Адрес:** `{address}`
+
+⚠️ **ВАЖНО:**
+• Переводите ТОЧНУЮ сумму: {crypto_amount} {asset}
+{memo_line}• Сохраните чек/подтверждение оплаты
+• После оплаты нажмите "✅ Я оплатил"
+
+📱 **QR код для быстрой оплаты:**
+""",
+        'payment_method_chosen': """
+💳 **Покупатель выбрал способ оплаты**
+
+💼 **Сделка:** #{deal_code}
+💰 **Сумма:** ${amount} = {crypto_amount} {asset}
+🔗 **Способ:** {payment_method}
+
+⏳ Ожидайте подтверждения оплаты от покупателя.
+""",
+        'buyer_completed': """
+✅ **Оплата подтверждена!**
+
+💼 **Сделка #{deal_code} завершена**
+💰 **Сумма:** ${amount}
+
+🎉 Спасибо за использование OZER GARANT!
+Ваша сделка успешно завершена.
+
+⭐ Оцените партнера по сделке:
+""",
+        'seller_completed': """
+✅ **Сделка завершена!**
+
+💼 **Сделка #{deal_code}**
+💰 **Сумма:** ${amount}
+
+🎉 Покупатель подтвердил оплату!
+Сделка успешно завершена.
+
+💼 Вы можете передать товар/услугу покупателю.
+
+⭐ Оцените партнера по сделке:
+""",
+        'payment_received': """
+✅ **Оплата получена!**
+
+💼 **Сделка #{deal_code} завершена**
+💰 **Сумма:** ${amount}
+
+🎉 Перевод найден в блокчейне, сделка успешно завершена.
+
+⭐ Оцените партнера по сделке:
+""",
+        'captcha_prompt': """
+🛡️ **Добро пожаловать в OZER GARANT!**
+
+Для продолжения работы пройдите проверку:
+
+{question}
+""",
+        'deal_role_chosen': """
+💼 **Создание сделки**
+
+👤 Роль: {role}
+
+💰 Введите сумму сделки в USD:
+(Минимум: $1, Максимум: $100,000)
+""",
+        'deal_amount_entered': """
+💼 **Создание сделки**
+
+💰 Сумма: ${amount}
+
+📋 Введите условия сделки:
+(Опишите что продаете/покупаете, условия передачи товара/услуги)
+""",
+        'deal_conditions_entered': """
+💼 **Создание сделки**
+
+📋 Условия: {conditions}...
+
+🔐 Введите пароль для сделки:
+(4-50 символов, этот пароль понадобится партнеру для присоединения)
+""",
+        'deal_chat_opened': """
+💬 **Чат сделки #{deal_code}**
+
+Все сообщения будут пересланы партнеру и сохранены в истории сделки.
+Для выхода нажмите кнопку ниже или отправьте /exit
+""",
+    },
+    'en': {
+        'role_buyer': "💰 Buyer",
+        'role_seller': "💎 Seller",
+        'welcome': """
+🎉 **Welcome to OZER GARANT!**
+
+🔐 A safe place for escrow-protected deals!
+
+💼 **What the bot can do:**
+• Create safe deals
+• Escrow guarantee
+• TRC20 USDT and TON support
+• 24/7 support
+
+👇 Use the menu to navigate:
+""",
+        'support': """
+🆘 **Support**
+
+📞 **Contacts:**
+• Telegram: @{support_username}
+• Working hours: 24/7
+
+❓ **Frequently asked questions:**
+• How do I create a deal?
+• How do I cancel a deal?
+• How long does a dispute take?
+• What are the fees?
+
+💡 **Tips:**
+• Always check your partner's details
+• Never share deal passwords with third parties
+• Keep proof of payment
+""",
+        'deal_created': """
+✅ **Deal created!**
+
+💼 **Deal code:** `{deal_code}`
+👤 **Your role:** {role}
+💰 **Amount:** ${amount}
+📋 **Terms:** {conditions}...
+🔐 **Password:** `{password}`
+
+🔗 **Link for your partner:**
+{deal_link}
+
+⏰ **Deal is open until:** {expires_at:%Y-%m-%d %H:%M}
+
+📝 **How to invite your partner:**
+1. Send them the link above
+2. Your partner enters the password: `{password}`
+3. The deal starts once they join
+""",
+        'join_prompt': """
+💼 **Joining deal #{deal_code}**
+
+👤 **Creator's role:** {creator_role}
+👤 **Your role:** {role}
+💰 **Amount:** ${amount}
+📋 **Terms:** {conditions}
+⏰ **Expires:** {expires_at:%Y-%m-%d %H:%M}
+
+🔐 **Enter the deal password to join:**
+""",
+        'partner_joined': """
+🎉 **A partner has joined your deal!**
+
+💼 **Deal:** #{deal_code}
+👤 **Partner:** {partner}
+💰 **Amount:** ${amount}
+📋 **Terms:** {conditions}...
+
+🔄 **Next step:**
+If you are the buyer, choose a payment method.
+If you are the seller, wait for the buyer's payment.
+""",
+        'joined': """
+✅ **You have joined the deal!**
+
+💼 **Deal:** #{deal_code}
+👤 **Your role:** {role}
+💰 **Amount:** ${amount}
+📋 **Terms:** {conditions}...
+
+🔄 **What's next:**
+Wait for your partner. You will be notified when the deal status changes.
+
+💬 Chat with your partner: /chat {deal_code}
+""",
+        'choose_payment': """
+💳 **Choose a payment method for deal #{deal_code}**
+
+💰 **Amount due:** ${amount}
+
+🔗 **TRC20 USDT** - USDT on TRON
+💎 **TON** - The Open Network
+
+Choose the method that suits you:
+""",
+        'payment_memo_line': "• Add this comment to the transfer: `{memo}`\n",
+        'payment_details': """
+💳 **Payment for deal #{deal_code}**
+
+💰 **Amount:** ${amount} = {crypto_amount} {asset}
+📈 **Rate:** 1 {asset} = ${rate}
+🔗 **Method:** {payment_method}
+📍 **Address:** `{address}`
+
+⚠️ **IMPORTANT:**
+• Transfer the EXACT amount: {crypto_amount} {asset}
+{memo_line}• Keep the receipt/payment confirmation
+• After paying, press "✅ Я оплатил"
+
+📱 **QR code for quick payment:**
+""",
+        'payment_method_chosen': """
+💳 **The buyer has chosen a payment method**
+
+💼 **Deal:** #{deal_code}
+💰 **Amount:** ${amount} = {crypto_amount} {asset}
+🔗 **Method:** {payment_method}
+
+⏳ Wait for the buyer to confirm the payment.
+""",
+        'buyer_completed': """
+✅ **Payment confirmed!**
+
+💼 **Deal #{deal_code} is complete**
+💰 **Amount:** ${amount}
+
+🎉 Thank you for using OZER GARANT!
+Your deal has been completed.
+
+⭐ Rate your partner:
+""",
+        'seller_completed': """
+✅ **Deal complete!**
+
+💼 **Deal #{deal_code}**
+💰 **Amount:** ${amount}
+
+🎉 The buyer has confirmed the payment!
+The deal has been completed.
+
+💼 You can now deliver the goods/service to the buyer.
+
+⭐ Rate your partner:
+""",
+        'payment_received': """
+✅ **Payment received!**
+
+💼 **Deal #{deal_code} is complete**
+💰 **Amount:** ${amount}
+
+🎉 The transfer was found on the blockchain, and the deal has been completed.
+
+⭐ Rate your partner:
+""",
+        'captcha_prompt': """
+🛡️ **Welcome to OZER GARANT!**
+
+Please pass a quick check to continue:
+
+{question}
+""",
+        'deal_role_chosen': """
+💼 **New deal**
+
+👤 Role: {role}
+
+💰 Enter the deal amount in USD:
+(Minimum: $1, maximum: $100,000)
+""",
+        'deal_amount_entered': """
+💼 **New deal**
+
+💰 Amount: ${amount}
+
+📋 Enter the deal terms:
+(Describe what you are selling/buying and how the goods/service will be delivered)
+""",
+        'deal_conditions_entered': """
+💼 **New deal**
+
+📋 Terms: {conditions}...
+
+🔐 Enter a password for the deal:
+(4-50 characters, your partner will need it to join)
+""",
+        'deal_chat_opened': """
+💬 **Deal chat #{deal_code}**
+
+All messages will be forwarded to your partner and saved in the deal history.
+To leave, press the button below or send /exit
+""",
+    },
+}
+
+class Markup(str):
+    """Готовая разметка: при подстановке в шаблон не экранируется"""
+
+class MessageTemplate:
+    """Шаблон, разобранный один раз: куски текста и поля со способом экранирования
+
+    Способ экранирования поля выбирается при разборе по месту поля: внутри
+    `кода` или в обычном тексте. Значение форматируется по формату поля и
+    экранируется; готовая разметка (Markup) подставляется как есть.
+    """
+
+    __slots__ = ('name', 'parts', 'fields')
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        parts = []
+        in_code = False
+        for literal, field, spec, conversion in Formatter().parse(source):
+            in_code ^= literal.count('`') % 2 == 1
+            if field is not None and (conversion or not field.isidentifier()):
+                raise ValueError(f"Template {name}: field {{{field}}} must be a plain name without conversion")
+            escape = escape_markdown_code if in_code else escape_markdown
+            parts.append((literal, field, spec, escape))
+        self.parts = tuple(parts)
+        self.fields = frozenset(field for _, field, _, _ in parts if field is not None)
+
+    def render(self, values: Dict) -> Markup:
+        chunks = []
+        for literal, field, spec, escape in self.parts:
+            chunks.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if isinstance(value, Markup):
+                chunks.append(value)
+            elif spec or not isinstance(value, str):
+                chunks.append(escape(format(value, spec)))
+            else:
+                chunks.append(escape(value))
+        return Markup(''.join(chunks))
+
+class TextCatalog:
+    """Каталог сообщений бота по локалям
+
+    Все шаблоны разбираются при запуске; у каждой локали должен быть тот же
+    набор шаблонов и полей, что у DEFAULT_LOCALE, иначе запуск прерывается.
+    Локаль выбирается по language_code пользователя Telegram, неизвестные
+    языки получают DEFAULT_LOCALE. Подставляемые значения экранируются для
+    parse_mode="Markdown", поэтому пользовательский текст (условия сделки,
+    имя) не ломает разметку.
+    """
+
+    def __init__(self, templates: Dict[str, Dict[str, str]] = TEMPLATES, default_locale: str = DEFAULT_LOCALE):
+        self.default_locale = default_locale
+        self.templates = {
+            locale: {name: MessageTemplate(name, source) for name, source in sources.items()}
+            for locale, sources in templates.items()
+        }
+        self._check()
+
+    def _check(self):
+        reference = self.templates[self.default_locale]
+        for locale, templates in self.templates.items():
+            if templates.keys() != reference.keys():
+                missing = sorted(reference.keys() ^ templates.keys())
+                raise ValueError(f"Locale {locale}: templates differ from {self.default_locale}: {missing}")
+            for name, template in templates.items():
+                if template.fields != reference[name].fields:
+                    raise ValueError(f"Locale {locale}: template {name} fields differ from {self.default_locale}")
+
+    def locale(self, language_code: Optional[str]) -> str:
+        """Локаль по language_code (например, 'en-US'); None - локаль по умолчанию"""
+        if not language_code:
+            return self.default_locale
+        language = language_code.split('-')[0].lower()
+        language = LOCALE_ALIASES.get(language, language)
+        return language if language in self.templates else self.default_locale
+
+    def render(self, name: str, language_code: Optional[str] = None, **values) -> Markup:
+        """Текст сообщения для пользователя с данным language_code"""
+        return self.templates[self.locale(language_code)][name].render(values)
+
+    def role(self, creator_role: str, language_code: Optional[str] = None, partner: bool = False) -> Markup:
+        """Название роли создателя сделки или его партнера"""
+        is_buyer = (creator_role == 'buyer') != partner
+        return self.render('role_buyer' if is_buyer else 'role_seller', language_code)
+
+# Создание глобального каталога сообщений
+texts = TextCatalog()
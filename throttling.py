@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from config import (
+    THROTTLE_LIMITS, THROTTLE_MAX_CONCURRENT, THROTTLE_MUTE_VIOLATIONS, THROTTLE_MUTE_WINDOW,
+    THROTTLE_MUTE_SECONDS, THROTTLE_MUTE_MAX, THROTTLE_NOTICE_INTERVAL, THROTTLE_IDLE_TTL,
+    THROTTLE_SWEEP_INTERVAL, THROTTLE_MUTE_DECAY
+)
+
+logger = logging.getLogger(__name__)
+
+# Решения по апдейту
+ALLOWED = 'allowed'
+THROTTLED = 'throttled'
+MUTED = 'muted'
+MUTE_STARTED = 'mute_started'
+
+class UserThrottleState:
+    """Корзины токенов пользователя по классам апдейтов, нарушения и мьют"""
+
+    __slots__ = ('buckets', 'violations', 'window_started', 'muted_until', 'mutes', 'last_notice', 'last_seen')
+
+    def __init__(self, now: float):
+        # класс -> [токены, время последнего пополнения]
+        self.buckets: Dict[str, list] = {}
+        self.violations = 0
+        self.window_started = now
+        self.muted_until = 0.0
+        self.mutes = 0
+        self.last_notice = 0.0
+        self.last_seen = now
+
+class Throttler:
+    """Ограничение частоты апдейтов пользователей и общей нагрузки
+
+    У каждого пользователя своя корзина токенов на каждый класс апдейтов
+    (/start, прочие команды, сообщения, нажатия кнопок) с пополнением и
+    запасом из THROTTLE_LIMITS. Апдейт без токена отклоняется. Пользователь,
+    набравший THROTTLE_MUTE_VIOLATIONS отклонений за THROTTLE_MUTE_WINDOW
+    секунд, получает мьют; каждый следующий мьют вдвое длиннее, до
+    THROTTLE_MUTE_MAX. Каждые THROTTLE_MUTE_DECAY секунд без мьюта счетчик
+    мьютов уменьшается на один. Все состояние в памяти процесса, БД не
+    используется.
+
+    Одновременно обрабатывается не больше THROTTLE_MAX_CONCURRENT апдейтов,
+    остальные сбрасываются с коротким ответом.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]] = THROTTLE_LIMITS,
+                 max_concurrent: int = THROTTLE_MAX_CONCURRENT):
+        self.limits = limits
+        self.max_concurrent = max_concurrent
+        self.users: Dict[int, UserThrottleState] = {}
+        self.in_flight = 0
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            'allowed': 0,
+            'throttled': 0,
+            'muted_dropped': 0,
+            'shed': 0,
+            'mutes': 0,
+            'notices': 0,
+            'max_in_flight': 0,
+            'removed': 0
+        }
+        self.stats_by_kind = {kind: {'allowed': 0, 'throttled': 0} for kind in limits}
+
+    def _state(self, user_id: int, now: float) -> UserThrottleState:
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = UserThrottleState(now)
+        state.last_seen = now
+        return state
+
+    def _take(self, state: UserThrottleState, kind: str, now: float) -> bool:
+        """Списание токена из корзины класса"""
+        rate, burst = self.limits[kind]
+        bucket = state.buckets.get(kind)
+        if bucket is None:
+            bucket = state.buckets[kind] = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _violation(self, state: UserThrottleState, user_id: int, now: float) -> bool:
+        """Учет отклонения; True - пользователь получил мьют"""
+        if now - state.window_started > THROTTLE_MUTE_WINDOW:
+            state.window_started = now
+            state.violations = 0
+        state.violations += 1
+        if state.violations < THROTTLE_MUTE_VIOLATIONS:
+            return False
+
+        duration = min(THROTTLE_MUTE_SECONDS * 2 ** state.mutes, THROTTLE_MUTE_MAX)
+        state.muted_until = now + duration
+        state.mutes += 1
+        state.violations = 0
+        self.stats['mutes'] += 1
+        logger.warning(f"User {user_id} muted for {duration} s after update flood")
+        return True
+
+    def check(self, user_id: int, kind: str) -> str:
+        """Решение по апдейту пользователя: ALLOWED, THROTTLED, MUTE_STARTED или MUTED"""
+        now = time.monotonic()
+        state = self._state(user_id, now)
+        if state.muted_until > now:
+            self.stats['muted_dropped'] += 1
+            return MUTED
+
+        if self._take(state, kind, now):
+            self.stats['allowed'] += 1
+            self.stats_by_kind[kind]['allowed'] += 1
+            return ALLOWED
+
+        self.stats['throttled'] += 1
+        self.stats_by_kind[kind]['throttled'] += 1
+        if self._violation(state, user_id, now):
+            return MUTE_STARTED
+        return THROTTLED
+
+    def should_notify(self, user_id: int) -> bool:
+        """Не чаще одного ответа об ограничении в THROTTLE_NOTICE_INTERVAL секунд"""
+        now = time.monotonic()
+        state = self._state(user_id, now)
+        if now - state.last_notice < THROTTLE_NOTICE_INTERVAL:
+            return False
+        state.last_notice = now
+        self.stats['notices'] += 1
+        return True
+
+    def mute_remaining(self, user_id: int) -> int:
+        """Оставшееся время мьюта, с"""
+        state = self.users.get(user_id)
+        return max(int(state.muted_until - time.monotonic()), 0) if state else 0
+
+    def admit(self) -> bool:
+        """Занятие места в общем лимите обработки; False - апдейт сбрасывается"""
+        if self.in_flight >= self.max_concurrent:
+            self.stats['shed'] += 1
+            return False
+        self.in_flight += 1
+        self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.in_flight)
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+    def sweep(self) -> int:
+        """Удаление состояний пользователей без активности, мьюта и истории мьютов
+
+        У простаивающего пользователя с мьютами в прошлом остается только
+        счетчик мьютов (корзины пересоздаются полными), иначе очистка
+        обнуляла бы удвоение мьюта для того, кто пережидает его вне бота.
+        """
+        now = time.monotonic()
+        cutoff = now - THROTTLE_IDLE_TTL
+        idle = []
+        for user_id, state in self.users.items():
+            if state.muted_until > now:
+                continue
+            if state.mutes and now - state.muted_until > THROTTLE_MUTE_DECAY:
+                # Отсчет следующего шага затухания - с этого момента
+                state.mutes -= 1
+                state.muted_until = now
+            if state.last_seen >= cutoff:
+                continue
+            if state.mutes:
+                state.buckets.clear()
+            else:
+                idle.append(user_id)
+        for user_id in idle:
+            del self.users[user_id]
+        self.stats['removed'] += len(idle)
+        return len(idle)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(THROTTLE_SWEEP_INTERVAL)
+            self.sweep()
+
+    def start(self):
+        """Запуск фоновой очистки"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        now = time.monotonic()
+        stats['in_flight'] = self.in_flight
+        stats['users'] = len(self.users)
+        stats['muted_users'] = sum(1 for state in self.users.values() if state.muted_until > now)
+        stats['by_kind'] = {kind: dict(counters) for kind, counters in self.stats_by_kind.items()}
+        return stats
+
+# Создание глобального экземпляра ограничения частоты
+throttler = Throttler()
@@ -2,12 +2,14 @@ import qrcode
 import io
 import random
 import string
-import hashlib
 import secrets
 from datetime import datetime, timedelta
+from decimal import Decimal
 from typing import Optional, Dict
 from PIL import Image, ImageDraw, ImageFont
 from config import TRC20_ADDRESS, TON_ADDRESS
+from texts import escape_markdown
+from passwords import password_hasher
 
 class BotUtils:
     """Вспомогательные функции для бота"""
@@ -19,28 +21,23 @@ class BotUtils:
     
     @staticmethod
     def hash_password(password: str) -> str:
-        """Хеширование пароля"""
-        salt = secrets.token_hex(16)
-        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000).hex() + ':' + salt
+        """Хеширование пароля (формат и параметры - в passwords.py)"""
+        return password_hasher.hash(password)
     
     @staticmethod
     def verify_password(password: str, hashed: str) -> bool:
         """Проверка пароля"""
-        try:
-            password_hash, salt = hashed.split(':')
-            return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000).hex() == password_hash
-        except:
-            return False
+        return password_hasher.verify(password, hashed)
     
     @staticmethod
-    def generate_qr_code(address: str, amount: float, payment_method: str) -> io.BytesIO:
-        """Генерация QR кода для оплаты"""
+    def generate_qr_code(address: str, amount: Decimal, payment_method: str, memo: str = None) -> io.BytesIO:
+        """Генерация QR кода для оплаты (amount - сумма в монете способа оплаты)"""
         if payment_method == "TRC20":
             # Формат для USDT TRC20
             qr_data = f"tron:{address}?amount={amount}&token=TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
         elif payment_method == "TON":
-            # Формат для TON
-            qr_data = f"ton://transfer/{address}?amount={int(amount * 1000000000)}&text=Deal_Payment"
+            # Формат для TON: сумма в нанотонах, комментарий позволяет сопоставить перевод со сделкой
+            qr_data = f"ton://transfer/{address}?amount={int(Decimal(str(amount)) * 1000000000)}&text={memo or 'Deal_Payment'}"
         else:
             qr_data = address
         
@@ -67,8 +64,9 @@ class BotUtils:
     @staticmethod
     def format_user_info(user_data: Dict) -> str:
         """Форматирование информации о пользователе"""
-        username = f"@{user_data['username']}" if user_data['username'] else "Не указан"
-        full_name = f"{user_data['first_name'] or ''} {user_data['last_name'] or ''}".strip()
+        # Имя и username задает пользователь: экранируются для parse_mode="Markdown"
+        username = escape_markdown(f"@{user_data['username']}") if user_data['username'] else "Не указан"
+        full_name = escape_markdown(f"{user_data['first_name'] or ''} {user_data['last_name'] or ''}".strip())
         
         rating_stars = "⭐" * int(user_data['rating']) + "☆" * (5 - int(user_data['rating']))
         
@@ -110,12 +108,12 @@ class BotUtils:
         payment_method = f"💳 {deal_data['payment_method']}" if deal_data['payment_method'] else "Не выбран"
         
         return f"""
-💼 **Сделка #{deal_data['deal_code']}**
+💼 **Сделка #{escape_markdown(deal_data['deal_code'])}**
 
 📊 Статус: {status_emoji}
 👤 Ваша роль: {user_role}
 💰 Сумма: ${deal_data['amount_usd']}
-📋 Условия: {deal_data['deal_conditions']}
+📋 Условия: {escape_markdown(deal_data['deal_conditions'])}
 💳 Способ оплаты: {payment_method}
 📅 Создана: {deal_data['created_at'].strftime('%d.%m.%Y %H:%M')}
 ⏰ Истекает: {deal_data['expires_at'].strftime('%d.%m.%Y %H:%M')}